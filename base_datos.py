@@ -0,0 +1,94 @@
+# Capa compartida de acceso a la BD MySQL: configuración y pool de conexiones.
+# La usan interfaz.py y get_data_to_database_test.py.
+
+import os
+import json
+import threading
+import mysql.connector
+from mysql.connector import pooling
+
+# --- Configuración ---
+# Valores por defecto; se pueden sobrescribir con db_config.json o variables de entorno
+DB_CONFIG = {
+    "host": "localhost",
+    "port": 3306,
+    "user": "root",
+    "password": "1234", # Asegúrate que sea la correcta
+    "database": "labiot_data_sensed"
+}
+POOL_SIZE = 5 # Conexiones reutilizables en el pool
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "db_config.json")
+# Variable de entorno -> clave de DB_CONFIG
+ENV_VARS = {
+    "SENSORES_DB_HOST": "host",
+    "SENSORES_DB_PORT": "port",
+    "SENSORES_DB_USER": "user",
+    "SENSORES_DB_PASSWORD": "password",
+    "SENSORES_DB_NAME": "database",
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def load_config():
+    """Devuelve (config, pool_size) combinando defaults, db_config.json y variables de entorno."""
+    config = dict(DB_CONFIG)
+    pool_size = POOL_SIZE
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, encoding="utf-8") as f:
+                file_config = json.load(f)
+            pool_size = int(file_config.pop("pool_size", pool_size))
+            config.update(file_config)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ No se pudo leer {CONFIG_FILE}: {e}. Usando valores por defecto.")
+    for env_var, key in ENV_VARS.items():
+        if os.environ.get(env_var):
+            config[key] = os.environ[env_var]
+    config["port"] = int(config.get("port", 3306))
+    if os.environ.get("SENSORES_DB_POOL_SIZE"):
+        pool_size = int(os.environ["SENSORES_DB_POOL_SIZE"])
+    return config, max(1, pool_size)
+
+def get_pool():
+    """Crea (una sola vez) y devuelve el pool de conexiones MySQL."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config, pool_size = load_config()
+            _pool = pooling.MySQLConnectionPool(
+                pool_name="sensores", pool_size=pool_size, pool_reset_session=True, **config
+            )
+        return _pool
+
+def get_connection():
+    """
+    Obtiene una conexión sana del pool. Al llamar conn.close() vuelve al pool en lugar de cerrarse.
+
+    Se hace ping antes de entregarla; si estaba caída (timeout del servidor, red) se reconecta.
+    Si el pool está agotado se abre una conexión directa para no bloquear al llamador.
+    Lanza mysql.connector.Error si no hay forma de conectar.
+    """
+    try:
+        conn = get_pool().get_connection()
+    except pooling.PoolError:
+        config, _ = load_config()
+        return mysql.connector.connect(**config)
+    try:
+        conn.ping(reconnect=True, attempts=2, delay=0.5)
+    except mysql.connector.Error:
+        conn.close() # Devolverla al pool; el pool la reabre en el siguiente uso
+        conn = get_pool().get_connection()
+        conn.ping(reconnect=True, attempts=2, delay=0.5)
+    return conn
+
+# Bloque para probar la conexión si se ejecuta este archivo directamente
+if __name__ == "__main__":
+    config, pool_size = load_config()
+    print(f"Conectando a {config['user']}@{config['host']}:{config['port']}/{config['database']} (pool={pool_size})...")
+    try:
+        conn = get_connection()
+        print("✅ Conexión exitosa.")
+        conn.close()
+    except mysql.connector.Error as err:
+        print(f"❌ Error de conexión BD: {err}")
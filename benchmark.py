@@ -0,0 +1,281 @@
+# Banco de pruebas de rendimiento: genera reportes CSV sintéticos y mide cada fase
+# (descubrimiento, parseo, inserción, flow_per_hour, agregados y consultas de la interfaz) contra una BD local.
+#
+# Uso:  python benchmark.py --sensors 5 --files-per-sensor 20 --rows-per-file 1440 --output bench.json
+# La BD de prueba (por defecto 'labiot_bench') se crea si no existe y se VACÍA en cada corrida.
+# Arranque en frío de la interfaz (sin BD):  python benchmark.py --startup-only --startup-budget-ms 400
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import subprocess
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timedelta
+import mysql.connector
+import base_datos
+import sensores
+import migraciones
+import get_data_to_database_test as ingest
+from consultas import clave_en_posicion, consultar_pagina, consultar_agregados, TABLAS_AGREGADOS
+from tabla_virtual import TablaVirtual, MARGEN_PREFETCH
+
+# --- Configuración ---
+BENCH_DATABASE = "labiot_bench"
+STARTUP_MODULE = "interfaz" # Lo que importa main.py antes de abrir la ventana
+STARTUP_BUDGET_MS = 400 # Presupuesto de importación en frío (python -X importtime)
+VISIBLE_ROWS = 25 # Filas visibles de la tabla de la interfaz (la página pedida suma MARGEN_PREFETCH)
+JUMP_FRACTION = 0.9 # Salto de la barra de desplazamiento: posición relativa dentro del historial
+STARTUP_HEAVY_MODULES = ["mysql", "pandas", "numpy", "googleapiclient", "PIL", "openpyxl", "pyarrow"] # No deben cargarse al abrir
+# Nombres fijos en inglés: el CSV real usa el formato "%a, %d %b %Y %H:%M:%S" sin depender del locale
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+CSV_HEADER = "time,Water Flow Value,Total Pulse,Last Pulse,Battery,\n" # Coma final -> columna 'Unnamed'
+
+# --- Generador de Reportes Sintéticos ---
+
+def format_report_time(dt):
+    """Fecha en el formato de los reportes del gateway: 'Mon, 01 Jan 2024 10:00:00'."""
+    return f"{DAY_NAMES[dt.weekday()]}, {dt.day:02d} {MONTH_NAMES[dt.month - 1]} {dt.year} {dt:%H:%M:%S}"
+
+def report_file_name(sensor_id, index):
+    """Nombre de archivo como los que llegan por Gmail (sensor 1 = pv-sw01, el resto = d-swm-XX)."""
+    if sensor_id == 1:
+        return f"report-pv-sw01-{index:04d}.csv"
+    return f"report-d-swm-{sensor_id:02d}-{index:04d}.csv"
+
+def generate_reports(directory, sensor_ids, files_per_sensor, rows_per_file, start=None, interval_s=60, seed=0):
+    """
+    Escribe reportes CSV sintéticos en 'directory'. Cada archivo cubre un bloque consecutivo de
+    lecturas; el flujo y los pulsos son acumulativos y hay algún valor vacío ocasional.
+    Devuelve el total de filas escritas.
+    """
+    rng = random.Random(seed)
+    start = start or datetime(2024, 1, 1)
+    total_rows = 0
+    for sensor_id in sensor_ids:
+        water_flow = rng.uniform(0, 100); total_pulse = rng.randint(0, 10000); battery = 3.6
+        current = start
+        for index in range(files_per_sensor):
+            buffer = io.StringIO()
+            buffer.write(CSV_HEADER)
+            for _ in range(rows_per_file):
+                last_pulse = rng.randint(0, 20)
+                water_flow += last_pulse * 0.01
+                total_pulse += last_pulse
+                battery = max(2.8, battery - rng.uniform(0, 0.0001))
+                wfv = "" if rng.random() < 0.001 else f"{water_flow:.2f}"
+                buffer.write(f"\"{format_report_time(current)}\",{wfv},{total_pulse},{last_pulse},{battery:.3f},\n")
+                current += timedelta(seconds=interval_s)
+            with open(os.path.join(directory, report_file_name(sensor_id, index)), "w", encoding="utf-8") as f:
+                f.write(buffer.getvalue())
+            total_rows += rows_per_file
+    return total_rows
+
+# --- Medición ---
+
+def percentile(values, pct):
+    """Percentil por rango más cercano (values no vacío)."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def summarize(latencies, rows=None, seconds=None):
+    """Resumen legible por máquina de una fase: total, p50/p95 en ms y filas/s."""
+    seconds = sum(latencies) if seconds is None else seconds
+    summary = {"count": len(latencies), "seconds": round(seconds, 4)}
+    if latencies:
+        summary["p50_ms"] = round(percentile(latencies, 50) * 1000, 3)
+        summary["p95_ms"] = round(percentile(latencies, 95) * 1000, 3)
+    if rows is not None:
+        summary["rows"] = rows
+        summary["rows_per_s"] = round(rows / seconds, 1) if seconds > 0 else None
+    return summary
+
+def measure_startup(module=STARTUP_MODULE, budget_ms=STARTUP_BUDGET_MS):
+    """
+    Importa 'module' en un intérprete nuevo con -X importtime y compara el tiempo acumulado con el presupuesto.
+    También revisa que no se hayan importado módulos pesados que deberían cargarse bajo demanda.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    cumulative_us = None
+    imported = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line: continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imported.add(name.strip().split(".")[0])
+        if name == f" {module}": # Nivel superior: un solo espacio antes del nombre
+            cumulative_us = int(cumulative)
+    if process.returncode != 0 or cumulative_us is None:
+        return {"module": module, "ok": False, "error": process.stderr.strip().splitlines()[-1:]}
+    heavy = sorted(m for m in STARTUP_HEAVY_MODULES if m in imported)
+    import_ms = round(cumulative_us / 1000, 1)
+    return {"module": module, "import_ms": import_ms, "budget_ms": budget_ms, "heavy_modules": heavy,
+            "ok": import_ms <= budget_ms and not heavy}
+
+def connect_bench_database(database):
+    """Conecta a la BD de prueba (misma configuración que base_datos, otra base) y la prepara."""
+    config, _ = base_datos.load_config()
+    if database == config["database"]:
+        raise SystemExit(f"❌ '{database}' es la BD configurada de producción; usa otra con --database.")
+    config.pop("database", None)
+    conn = mysql.connector.connect(**config)
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    cursor.execute(f"USE `{database}`")
+    if not migraciones.migrar(conn): # Mismo esquema que producción (índices incluidos)
+        raise SystemExit("❌ No se pudo preparar el esquema de la BD de prueba.")
+    for table in ("sensor_data", "processed_files", "sensors", "sensor_data_hourly", "sensor_data_daily"):
+        cursor.execute(f"DELETE FROM {table}")
+    conn.commit()
+    cursor.close()
+    return conn
+
+def register_sensors(conn, sensor_ids):
+    """Da de alta los sensores de la prueba con nombre y patrón de archivo."""
+    cursor = conn.cursor()
+    cursor.executemany(
+        "INSERT INTO sensors (id, name, file_pattern) VALUES (%s, %s, %s)",
+        [(sid, "sw01" if sid == 1 else f"swm-{sid:02d}", "report-pv-sw01" if sid == 1 else f"report-d-swm-{sid:02d}")
+         for sid in sensor_ids]
+    )
+    conn.commit()
+    cursor.close()
+
+def run_benchmark(args):
+    """Ejecuta todas las fases y devuelve el resultado como dict."""
+    sensor_ids = list(range(1, args.sensors + 1))
+    results = {"config": vars(args).copy(), "phases": {}}
+    phases = results["phases"]
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+
+    with tempfile.TemporaryDirectory(prefix="bench_reportes_") as directory:
+        t0 = time.perf_counter()
+        total_rows = generate_reports(directory, sensor_ids, args.files_per_sensor, args.rows_per_file, seed=args.seed)
+        phases["generate"] = summarize([], rows=total_rows, seconds=time.perf_counter() - t0)
+
+        conn = connect_bench_database(args.database)
+        register_sensors(conn, sensor_ids)
+        with quiet:
+            # Descubrimiento: listado + carga de processed_files/sensores + filtrado en memoria
+            t0 = time.perf_counter()
+            csv_files = sorted(f for f in os.listdir(directory) if f.lower().endswith(".csv"))
+            processed = ingest.load_processed_files(conn)
+            registry = sensores.get_registry(conn, refresh=True)
+            pending = ingest.filter_pending_files(csv_files, directory, processed, conn)
+            phases["discovery"] = summarize([], seconds=time.perf_counter() - t0)
+            phases["discovery"]["files"] = len(csv_files)
+
+            # Parseo + inserción por archivo (mismo orden que la carga real)
+            parse_latencies, insert_latencies = [], []
+            parsed_rows = inserted_rows = 0
+            sensor_min_times, sensor_max_times = {}, {}
+            for file_name, signature in pending:
+                sensor_id = registry.match(file_name)
+                t0 = time.perf_counter()
+                result = ingest.prepare_file(os.path.join(directory, file_name), file_name, sensor_id)
+                parse_latencies.append(time.perf_counter() - t0)
+                parsed_rows += len(result["rows"])
+                t0 = time.perf_counter()
+                inserted = ingest.insert_file_chunks(file_name, [result["rows"]], conn, args.batch_size, signature)
+                insert_latencies.append(time.perf_counter() - t0)
+                if inserted:
+                    inserted_rows += inserted[0]
+                    ingest.track_time_range({'sensor_id': sensor_id, 'min_time': inserted[1], 'max_time': inserted[2]},
+                                            sensor_min_times, sensor_max_times)
+            phases["parse"] = summarize(parse_latencies, rows=parsed_rows)
+            phases["insert"] = summarize(insert_latencies, rows=inserted_rows)
+
+            # flow_per_hour incremental (lo que corre tras cada carga) y recálculo completo
+            t0 = time.perf_counter()
+            ingest.update_flow_per_hour_incremental(sensor_min_times, conn, sensor_max_times)
+            phases["flow_per_hour_incremental"] = summarize([], rows=inserted_rows, seconds=time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            ingest.update_flow_per_hour(conn)
+            phases["flow_per_hour_rebuild"] = summarize([], rows=inserted_rows, seconds=time.perf_counter() - t0)
+
+            # Agregados por hora/día: incremental tras la carga y recálculo completo
+            t0 = time.perf_counter()
+            ingest.update_rollups_incremental(sensor_min_times, conn, sensor_max_times)
+            phases["rollups_incremental"] = summarize([], rows=inserted_rows, seconds=time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            ingest.rebuild_rollups(conn)
+            phases["rollups_rebuild"] = summarize([], rows=inserted_rows, seconds=time.perf_counter() - t0)
+
+            # Redescubrimiento con todo ya procesado (el caso común de la interfaz)
+            t0 = time.perf_counter()
+            processed = ingest.load_processed_files(conn)
+            ingest.filter_pending_files(csv_files, directory, processed, conn)
+            phases["discovery_rescan"] = summarize([], seconds=time.perf_counter() - t0)
+
+        # Consultas de la tabla virtual de la interfaz: botón "Consultar" (conteo + primera página),
+        # desplazamiento (página keyset) y salto largo de la barra (posición + página keyset)
+        page = VISIBLE_ROWS + 2 * MARGEN_PREFETCH
+        latencies = {"consultar_inicio": [], "consultar_pagina": [], "consultar_salto": []}
+        rows_read = dict.fromkeys(latencies, 0)
+        for _ in range(args.query_repeats):
+            for sensor_id in sensor_ids:
+                t0 = time.perf_counter()
+                total, rows = TablaVirtual.consultar_inicio(sensor_id, conn, page)
+                latencies["consultar_inicio"].append(time.perf_counter() - t0)
+                rows_read["consultar_inicio"] += len(rows)
+                if not rows: continue
+                t0 = time.perf_counter()
+                rows = consultar_pagina(sensor_id, conn, page, desde=(rows[-1]['time'], rows[-1]['id']))
+                latencies["consultar_pagina"].append(time.perf_counter() - t0)
+                rows_read["consultar_pagina"] += len(rows)
+                t0 = time.perf_counter()
+                key = clave_en_posicion(sensor_id, int(total * JUMP_FRACTION), conn)
+                rows = consultar_pagina(sensor_id, conn, page, desde=key, inclusivo=True) if key else []
+                latencies["consultar_salto"].append(time.perf_counter() - t0)
+                rows_read["consultar_salto"] += len(rows)
+        for name, values in latencies.items():
+            phases[name] = summarize(values, rows=rows_read[name])
+
+        # Misma consulta sobre los agregados (selector de resolución de la interfaz)
+        for resolucion in TABLAS_AGREGADOS:
+            query_latencies, query_rows = [], 0
+            for _ in range(args.query_repeats):
+                for sensor_id in sensor_ids:
+                    t0 = time.perf_counter()
+                    query_rows += len(consultar_agregados(sensor_id, conn, resolucion))
+                    query_latencies.append(time.perf_counter() - t0)
+            phases[f"consultar_agregados_{resolucion}"] = summarize(query_latencies, rows=query_rows)
+        conn.close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de carga y consulta con reportes sintéticos.")
+    parser.add_argument("--sensors", type=int, default=5, help="Número de sensores (default: 5)")
+    parser.add_argument("--files-per-sensor", type=int, default=10, help="Archivos por sensor (default: 10)")
+    parser.add_argument("--rows-per-file", type=int, default=1440, help="Filas por archivo (default: 1440 = 1 día por minuto)")
+    parser.add_argument("--batch-size", type=int, default=ingest.BATCH_SIZE, help="Filas por INSERT multi-fila")
+    parser.add_argument("--query-repeats", type=int, default=5, help="Repeticiones de las consultas de la interfaz por sensor")
+    parser.add_argument("--database", default=BENCH_DATABASE, help=f"BD de prueba (default: {BENCH_DATABASE}); se vacía")
+    parser.add_argument("--seed", type=int, default=0, help="Semilla del generador")
+    parser.add_argument("--output", help="Archivo JSON de salida (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida de la carga")
+    parser.add_argument("--startup-only", action="store_true",
+                        help="Solo medir el arranque en frío de la interfaz (sin BD); sale con error si excede el presupuesto")
+    parser.add_argument("--startup-budget-ms", type=float, default=STARTUP_BUDGET_MS,
+                        help=f"Presupuesto de importación de '{STARTUP_MODULE}' en ms (default: {STARTUP_BUDGET_MS})")
+    args = parser.parse_args()
+
+    startup = measure_startup(budget_ms=args.startup_budget_ms)
+    if args.startup_only:
+        print(json.dumps(startup, indent=2))
+        sys.exit(0 if startup["ok"] else 1)
+    results = run_benchmark(args)
+    results["startup"] = startup
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"✅ Resultados guardados en {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,106 @@
+# Caché LRU en memoria para resultados de consultas de la interfaz (por sensor + filtro).
+# Cada entrada guarda la "marca de agua" del sensor (sensors.data_version); si no cambió, el resultado
+# se sirve desde memoria sin repetir la consulta. data_version la suben la inserción de cada archivo
+# y los recálculos de flow_per_hour y de agregados (carga, pipeline o 'rebuild' desde otro proceso).
+
+import sys
+import threading
+from collections import OrderedDict
+
+# --- Configuración ---
+MAX_BYTES = 200 * 1024 * 1024 # Memoria aproximada máxima de la caché (200 MB)
+ER_BAD_FIELD_ERROR = 1054 # "Unknown column": esquema sin la migración 5
+
+def marca_de_agua(sensor_id, conn):
+    """
+    data_version del sensor: una fila de 'sensors' por clave primaria, sin recorrer sensor_data.
+    Devuelve None si no se puede usar (sensor sin fila o esquema sin data_version): no se cachea.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT data_version FROM sensors WHERE id = %s", (sensor_id,))
+        fila = cursor.fetchone()
+        return fila[0] if fila else None
+    except Exception as e:
+        if getattr(e, 'errno', None) == ER_BAD_FIELD_ERROR: return None # Falta migrar: consultas sin caché
+        raise Exception(f"Error en Marca de Agua: {str(e)}")
+    finally:
+        if cursor: cursor.close()
+
+def _tamano(valor):
+    """Tamaño aproximado en bytes de un resultado (listas/tuplas/dicts de valores simples)."""
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(_tamano(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sys.getsizeof(valor) + sum(_tamano(v) for v in valor)
+    return sys.getsizeof(valor)
+
+class CacheConsultas:
+    """
+    LRU con límite de memoria. obtener(sensor_id, filtro, conn, calcular) devuelve el resultado
+    en caché si la marca de agua del sensor no cambió; si no, llama calcular() y lo guarda
+    (sin marca de agua se llama calcular() y no se guarda).
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict() # (sensor_id, filtro) -> (marca, resultado, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock() # Las consultas corren en hilos de GestorTareas
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, sensor_id, filtro, conn, calcular):
+        marca = marca_de_agua(sensor_id, conn)
+        clave = (sensor_id, filtro)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == marca:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+        resultado = calcular() # Fuera del lock: la consulta puede tardar
+        if marca is not None: self._guardar(clave, marca, resultado)
+        return resultado
+
+    def _guardar(self, clave, marca, resultado):
+        tamano = _tamano(resultado)
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None: self._bytes -= anterior[2]
+            if tamano > self.max_bytes: return # No cabe: se sirve pero no se guarda
+            self._entradas[clave] = (marca, resultado, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, _, liberado) = self._entradas.popitem(last=False) # Menos usado recientemente
+                self._bytes -= liberado
+
+    def invalidar(self, sensor_ids=None):
+        """Descarta las entradas de los sensores indicados (o todas si sensor_ids es None)."""
+        with self._lock:
+            for clave in list(self._entradas):
+                if sensor_ids is None or clave[0] in sensor_ids:
+                    self._bytes -= self._entradas.pop(clave)[2]
+
+    def estadisticas(self):
+        """Contadores para ajustar MAX_BYTES: aciertos, fallos, entradas y memoria usada."""
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos, 'fallos': self.fallos,
+                'tasa_aciertos': round(self.aciertos / total, 3) if total else None,
+                'entradas': len(self._entradas), 'bytes': self._bytes,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """Devuelve la caché compartida del proceso."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheConsultas()
+        return _cache
@@ -0,0 +1,217 @@
+# Caché local de lecturas en Parquet, particionada por sensor y día:
+#   parquet_cache/sensor_id=<id>/<AAAA-MM-DD>.parquet
+# La carga de CSV reescribe solo los días afectados, después de calcular flow_per_hour (así refleja lo que quedó en MySQL).
+# Las lecturas usan proyección de columnas, filtro por 'time' (por archivo de día y por row group)
+# y memory_map, y sirven de respaldo a la interfaz y a las exportaciones si MySQL no responde.
+#
+# Uso:  python cache_parquet.py rebuild     (regenera la caché completa desde la BD)
+
+import os
+import argparse
+from contextlib import closing
+from datetime import datetime, date, timedelta
+import base_datos
+from consultas import iterar_lecturas
+
+# --- Configuración ---
+CACHE_DIR = "parquet_cache"
+COLUMNAS = ['id', 'sensor_id', 'time', 'water_flow_value', 'total_pulse', 'flow_per_hour', 'last_pulse', 'battery']
+LOTE = 10000 # Filas por lote al leer de la BD o de la caché
+
+def _pyarrow():
+    """Importa pyarrow solo cuando se usa (dependencia opcional, pesada para el arranque)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("La caché Parquet requiere 'pyarrow' (pip install pyarrow).")
+    return pa, pq
+
+def habilitada():
+    """True si pyarrow está instalado (sin él la carga sigue, solo sin caché)."""
+    try:
+        _pyarrow()
+        return True
+    except Exception:
+        return False
+
+def esquema():
+    """Esquema Arrow de las lecturas (lo comparten la caché y la exportación a Parquet)."""
+    pa, _ = _pyarrow()
+    return pa.schema([
+        ('id', pa.int64()), ('sensor_id', pa.int32()), ('time', pa.timestamp('s')),
+        ('water_flow_value', pa.float64()), ('total_pulse', pa.int64()), ('flow_per_hour', pa.float64()),
+        ('last_pulse', pa.int64()), ('battery', pa.float64()),
+    ])
+
+def tabla_arrow(filas, schema=None):
+    """Convierte tuplas en el orden de COLUMNAS a una tabla Arrow."""
+    pa, _ = _pyarrow()
+    schema = schema or esquema()
+    columnas = list(zip(*filas)) if filas else [[] for _ in COLUMNAS]
+    return pa.Table.from_arrays([pa.array(valores, type=campo.type) for valores, campo in zip(columnas, schema)],
+                                schema=schema)
+
+# --- Particiones ---
+
+def _dir_sensor(sensor_id, directorio=CACHE_DIR):
+    return os.path.join(directorio, f"sensor_id={int(sensor_id)}")
+
+def _a_fecha(valor):
+    """'AAAA-MM-DD[ HH:MM:SS]', date o datetime -> date."""
+    if isinstance(valor, datetime): return valor.date()
+    if isinstance(valor, date): return valor
+    return datetime.strptime(str(valor)[:10], "%Y-%m-%d").date()
+
+def _a_datetime(valor):
+    if isinstance(valor, datetime): return valor
+    if isinstance(valor, date): return datetime(valor.year, valor.month, valor.day)
+    texto = str(valor)
+    return datetime.strptime(texto, "%Y-%m-%d %H:%M:%S" if len(texto) > 10 else "%Y-%m-%d")
+
+def sensores_en_cache(directorio=CACHE_DIR):
+    """IDs de sensor con al menos una partición."""
+    if not os.path.isdir(directorio): return []
+    return sorted(int(d.split("=", 1)[1]) for d in os.listdir(directorio) if d.startswith("sensor_id="))
+
+def archivos_en_rango(sensor_id, inicio=None, fin=None, directorio=CACHE_DIR):
+    """Particiones diarias del sensor que pueden tener lecturas en [inicio, fin), en orden de fecha."""
+    carpeta = _dir_sensor(sensor_id, directorio)
+    if not os.path.isdir(carpeta): return []
+    dia_ini = _a_fecha(inicio) if inicio is not None else None
+    fin_dt = _a_datetime(fin) if fin is not None else None
+    archivos = []
+    for nombre in sorted(os.listdir(carpeta)):
+        if not nombre.endswith(".parquet"): continue
+        dia = _a_fecha(nombre[:10])
+        if dia_ini is not None and dia < dia_ini: continue
+        if fin_dt is not None and datetime(dia.year, dia.month, dia.day) >= fin_dt: continue
+        archivos.append(os.path.join(carpeta, nombre))
+    return archivos
+
+def disponible(sensor_id=None, directorio=CACHE_DIR):
+    """True si se puede leer de la caché (pyarrow instalado y particiones del sensor, o de alguno)."""
+    if not habilitada(): return False
+    if sensor_id is None: return bool(sensores_en_cache(directorio))
+    return bool(archivos_en_rango(sensor_id, directorio=directorio))
+
+# --- Escritura (desde MySQL) ---
+
+def _escribir_dia(sensor_id, dia, filas, directorio):
+    """Reemplaza la partición de un día de forma atómica (archivo temporal + os.replace)."""
+    _, pq = _pyarrow()
+    carpeta = _dir_sensor(sensor_id, directorio)
+    os.makedirs(carpeta, exist_ok=True)
+    ruta = os.path.join(carpeta, f"{dia.isoformat()}.parquet")
+    pq.write_table(tabla_arrow(filas), ruta + ".tmp")
+    os.replace(ruta + ".tmp", ruta)
+
+def _siguiente_lectura(sensor_id, despues_de, connection):
+    """Hora de la primera lectura del sensor posterior a 'despues_de' (None si no hay)."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT MIN(time) FROM sensor_data WHERE sensor_id = %s AND time > %s", (sensor_id, despues_de))
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def actualizar_desde_bd(sensor_min_times, connection, directorio=CACHE_DIR, sensor_max_times=None):
+    """
+    Regenera las particiones de los días afectados por la carga.
+
+    Por sensor se reescriben los días entre la fecha mínima y la máxima insertadas, más el de la
+    primera lectura posterior (update_flow_per_hour_incremental le cambió flow_per_hour). Sin
+    'sensor_max_times' se reescribe desde el día de la fecha mínima hasta el final.
+    Lee la BD por lotes y escribe un día a la vez (memoria acotada). Devuelve el número de días escritos.
+    """
+    sensor_max_times = sensor_max_times or {}
+    dias_escritos = 0
+    for sensor_id, min_time in sorted(sensor_min_times.items()):
+        fin = None
+        if sensor_max_times.get(sensor_id) is not None:
+            siguiente = _siguiente_lectura(sensor_id, sensor_max_times[sensor_id], connection)
+            ultimo_dia = _a_fecha(siguiente if siguiente is not None else sensor_max_times[sensor_id])
+            fin = (ultimo_dia + timedelta(days=1)).isoformat() # Días completos: fin exclusivo al día siguiente
+        dia_actual, filas_dia = None, []
+        # closing: si falla una escritura, el generador cierra su cursor sin buffer antes de seguir con la conexión
+        with closing(iterar_lecturas(sensor_id, connection, inicio=_a_fecha(min_time).isoformat(), fin=fin,
+                                     lote=LOTE)) as lotes:
+            for filas in lotes:
+                for fila in filas:
+                    dia = fila[2].date()
+                    if dia != dia_actual and filas_dia:
+                        _escribir_dia(sensor_id, dia_actual, filas_dia, directorio); dias_escritos += 1
+                        filas_dia = []
+                    dia_actual = dia
+                    filas_dia.append(fila)
+        if filas_dia:
+            _escribir_dia(sensor_id, dia_actual, filas_dia, directorio); dias_escritos += 1
+    return dias_escritos
+
+def reconstruir(connection, directorio=CACHE_DIR):
+    """Regenera la caché completa de todos los sensores con datos en la BD."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT sensor_id, MIN(time) FROM sensor_data GROUP BY sensor_id")
+        sensor_min_times = {sensor_id: min_time for sensor_id, min_time in cursor.fetchall()}
+    finally:
+        cursor.close()
+    for sensor_id in sensores_en_cache(directorio): # Particiones de sensores que ya no tienen datos
+        if sensor_id not in sensor_min_times:
+            for ruta in archivos_en_rango(sensor_id, directorio=directorio): os.remove(ruta)
+    return actualizar_desde_bd(sensor_min_times, connection, directorio)
+
+# --- Lectura ---
+
+def _filtros(inicio, fin):
+    """Predicado sobre 'time' para read_table (descarta row groups por sus estadísticas min/max)."""
+    filtros = []
+    if inicio is not None: filtros.append(('time', '>=', _a_datetime(inicio)))
+    if fin is not None: filtros.append(('time', '<', _a_datetime(fin)))
+    return filtros or None
+
+def leer(sensor_id=None, inicio=None, fin=None, columnas=None, como="pandas", directorio=CACHE_DIR):
+    """
+    Lecturas de la caché en [inicio, fin) como DataFrame de pandas (como="pandas") o tabla Arrow ("arrow").
+
+    sensor_id=None lee todos los sensores. 'columnas' limita lo que se lee del disco (proyección);
+    el rango descarta días completos por nombre de archivo y row groups por sus estadísticas de 'time'.
+    Los archivos se abren con memory_map: las páginas se leen del disco bajo demanda.
+    """
+    pa, pq = _pyarrow()
+    filtros = _filtros(inicio, fin)
+    ids = sensores_en_cache(directorio) if sensor_id is None else [sensor_id]
+    tablas = [pq.read_table(ruta, columns=columnas, filters=filtros, memory_map=True)
+              for sid in ids for ruta in archivos_en_rango(sid, inicio, fin, directorio)]
+    if tablas:
+        tabla = pa.concat_tables(tablas)
+    else:
+        vacia = esquema().empty_table()
+        tabla = vacia.select(columnas) if columnas else vacia
+    return tabla.to_pandas() if como == "pandas" else tabla
+
+def iterar_lotes(sensor_id, inicio=None, fin=None, lote=LOTE, directorio=CACHE_DIR):
+    """Mismo contrato que consultas.iterar_lecturas (lotes de tuplas en orden de COLUMNAS), desde la caché."""
+    _, pq = _pyarrow()
+    filtros = _filtros(inicio, fin)
+    for ruta in archivos_en_rango(sensor_id, inicio, fin, directorio): # Un día a la vez en memoria
+        tabla = pq.read_table(ruta, filters=filtros, memory_map=True)
+        for batch in tabla.to_batches(max_chunksize=lote):
+            yield list(zip(*(columna.to_pylist() for columna in batch.columns)))
+
+def leer_filas(sensor_id, inicio=None, fin=None, max_filas=None, directorio=CACHE_DIR):
+    """Lecturas como lista de dicts (mismo formato que consultas.consultar_pagina), como máximo 'max_filas'."""
+    tabla = leer(sensor_id, inicio, fin, como="arrow", directorio=directorio)
+    if max_filas is not None: tabla = tabla.slice(0, max_filas)
+    return tabla.to_pylist()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Caché Parquet local de lecturas por sensor y día.")
+    parser.add_argument("accion", choices=["rebuild"], help="'rebuild' regenera la caché completa desde la BD")
+    parser.add_argument("--directory", default=CACHE_DIR, help=f"Directorio de la caché (default: {CACHE_DIR})")
+    args = parser.parse_args()
+    conn = base_datos.get_connection()
+    try:
+        print(f"✅ {reconstruir(conn, args.directory)} particiones diarias escritas en {args.directory}")
+    finally:
+        conn.close()
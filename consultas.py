@@ -0,0 +1,131 @@
+# Consultas de lectura sobre sensor_data, sin dependencias de la interfaz gráfica.
+# Las usa interfaz.py y se pueden importar desde scripts (p. ej. benchmark.py) sin abrir la ventana.
+
+import mysql.connector
+
+# --- Paginación por clave (keyset) sobre (sensor_id, time, id) ---
+# Cada página continúa desde la última fila vista en lugar de usar OFFSET, así el costo
+# no crece con la posición dentro del historial del sensor.
+
+COLUMNAS_SENSOR_DATA = """id, sensor_id, time, water_flow_value, total_pulse,
+               flow_per_hour, last_pulse, battery"""
+
+def contar_filas_sensor(sensor_id, conn, inicio=None, fin=None):
+    """Total de lecturas de un sensor en [inicio, fin) (para dimensionar la barra de desplazamiento)."""
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        condicion, params = condicion_rango(inicio, fin)
+        cursor.execute(f"SELECT COUNT(*) FROM sensor_data WHERE sensor_id = %s{condicion}", [sensor_id] + params)
+        return cursor.fetchone()[0]
+    except Exception as e:
+        raise Exception(f"Error en Conteo: {str(e)}")
+    finally:
+        if cursor: cursor.close()
+
+def clave_en_posicion(sensor_id, posicion, conn, inicio=None, fin=None):
+    """(time, id) de la fila número 'posicion' en orden (time, id). Se usa solo para saltos largos."""
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        condicion, params = condicion_rango(inicio, fin)
+        cursor.execute(
+            f"SELECT time, id FROM sensor_data WHERE sensor_id = %s{condicion} ORDER BY time, id LIMIT 1 OFFSET %s",
+            [sensor_id] + params + [int(posicion)]
+        )
+        return cursor.fetchone()
+    except Exception as e:
+        raise Exception(f"Error en Consulta: {str(e)}")
+    finally:
+        if cursor: cursor.close()
+
+def condicion_rango(inicio=None, fin=None, columna="time"):
+    """Fragmento SQL y parámetros para acotar 'columna' a [inicio, fin) (cualquiera puede ser None)."""
+    condicion, params = "", []
+    if inicio is not None:
+        condicion += f" AND {columna} >= %s"; params.append(inicio)
+    if fin is not None:
+        condicion += f" AND {columna} < %s"; params.append(fin)
+    return condicion, params
+
+def iterar_lecturas(sensor_id, conn, inicio=None, fin=None, lote=10000):
+    """
+    Genera lotes de hasta 'lote' tuplas (columnas de COLUMNAS_SENSOR_DATA, orden time, id).
+
+    Usa un cursor sin buffer: las filas se leen del servidor a medida que se piden,
+    así la memoria no depende del tamaño del resultado. No usar 'conn' para otra cosa mientras tanto.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor(buffered=False)
+        condicion, params = condicion_rango(inicio, fin)
+        cursor.execute(f"""
+        SELECT {COLUMNAS_SENSOR_DATA}
+        FROM sensor_data WHERE sensor_id = %s{condicion}
+        ORDER BY time, id
+        """, [sensor_id] + params)
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas: break
+            yield filas
+    except mysql.connector.Error as e:
+        raise Exception(f"Error en Consulta: {str(e)}")
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                conn.consume_results() # Corte a medias: descartar el resto para devolver la conexión limpia
+
+def consultar_pagina(sensor_id, conn, limite, desde=None, hacia_atras=False, inclusivo=False, inicio=None, fin=None):
+    """
+    Página de lecturas ordenada por (time, id) a partir de la clave 'desde' = (time, id),
+    dentro del rango opcional [inicio, fin).
+
+    hacia_atras=True devuelve las filas anteriores a 'desde' (ya en orden ascendente).
+    inclusivo=True incluye la fila de la clave 'desde'.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        condicion, params = condicion_rango(inicio, fin)
+        params = [sensor_id] + params
+        if desde is not None:
+            op = "<" if hacia_atras else ">"
+            op_id = op + ("=" if inclusivo else "")
+            condicion += f" AND (time {op} %s OR (time = %s AND id {op_id} %s))"
+            params += [desde[0], desde[0], desde[1]]
+        orden = "time DESC, id DESC" if hacia_atras else "time, id"
+        query = f"""
+        SELECT {COLUMNAS_SENSOR_DATA}
+        FROM sensor_data WHERE sensor_id = %s{condicion}
+        ORDER BY {orden} LIMIT %s
+        """
+        cursor.execute(query, params + [int(limite)])
+        rows = cursor.fetchall()
+        return rows[::-1] if hacia_atras else rows
+    except Exception as e:
+        raise Exception(f"Error en Consulta: {str(e)}")
+    finally:
+        if cursor: cursor.close()
+
+# --- Agregados por hora / día (tablas mantenidas por la carga, ver get_data_to_database_test.py) ---
+
+TABLAS_AGREGADOS = {'hora': "sensor_data_hourly", 'dia': "sensor_data_daily"}
+COLUMNAS_AGREGADOS = """sensor_id, bucket, flow_sum, water_flow_min, water_flow_max,
+               water_flow_avg, battery_min, samples"""
+
+def consultar_agregados(sensor_id, conn, resolucion, inicio=None, fin=None):
+    """Filas de la tabla de agregados ('hora' o 'dia') de un sensor en [inicio, fin), ordenadas por intervalo."""
+    tabla = TABLAS_AGREGADOS[resolucion]
+    cursor = None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        condicion, params = condicion_rango(inicio, fin, "bucket")
+        cursor.execute(f"SELECT {COLUMNAS_AGREGADOS} FROM {tabla} WHERE sensor_id = %s{condicion} ORDER BY bucket",
+                       [sensor_id] + params)
+        return cursor.fetchall()
+    except Exception as e:
+        raise Exception(f"Error en Consulta de Agregados: {str(e)}")
+    finally:
+        if cursor: cursor.close()
@@ -1,10 +1,15 @@
 # Descarga archivos adjuntos específicos de correos en Gmail y los marca como leídos.
 
 import os
+import json
+import time
 import base64
+import random
+import threading
 from typing import List
-import time
-from google_apis import create_service # Importa la función para crear el servicio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from googleapiclient.errors import HttpError
+from google_apis import create_service, TOKEN_DIR # Importa la función para crear el servicio
 
 # --- Clases de Excepción Personalizadas ---
 class GmailException(Exception):
@@ -15,6 +20,10 @@ class NoEmailFound(GmailException):
     """Excepción para cuando no se encuentran correos."""
     pass
 
+class HistoryExpired(GmailException):
+    """El historyId guardado ya no es válido (Gmail devuelve 404); hay que hacer búsqueda completa."""
+    pass
+
 # --- Constantes ---
 CLIENT_FILE = 'credentials.json'
 API_NAME = 'gmail'
@@ -22,6 +31,67 @@ API_VERSION = 'v1'
 SCOPES = ['https://mail.google.com/'] # Permisos necesarios para leer y modificar correos
 # Directorio donde se guardarán los reportes descargados
 SAVE_LOCATION = r"C:\Users\erika\Desktop\SERVICIO SOCIAL - BD\PYTHON\Reportes desde gmail"
+BATCH_SIZE = 50 # Peticiones por lote HTTP de Gmail (máx. 100; Google recomienda <= 50)
+MODIFY_CHUNK_SIZE = 1000 # IDs por llamada a batchModify (límite de la API)
+DOWNLOAD_WORKERS = 4 # Hilos de descarga de adjuntos (1 = secuencial)
+# Cuota de Gmail por usuario: 250 unidades/s; attachments.get cuesta 5 unidades
+QUOTA_UNITS_PER_SECOND = 250
+ATTACHMENT_GET_COST = 5
+MAX_RETRIES = 5 # Reintentos con backoff exponencial ante 429/5xx
+BACKOFF_BASE = 0.5 # Segundos de la primera espera (se duplica en cada intento, más jitter)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Máscara de respuesta parcial: solo el árbol de partes con nombre y attachmentId (sin cuerpos
+# en línea). 'format=full' es el formato más ligero que incluye las partes; la máscara quita el resto.
+PART_FIELDS = 'partId,mimeType,filename,body/attachmentId'
+MAX_PART_DEPTH = 5 # Niveles de multipart anidado que se piden
+MESSAGE_FIELDS = 'id,payload(' + PART_FIELDS + ''.join(f',parts({PART_FIELDS}' for _ in range(MAX_PART_DEPTH)) + ')' * (MAX_PART_DEPTH + 1)
+# Punto de control de la sincronización incremental (historyId del buzón tras la última corrida)
+HISTORY_CHECKPOINT_FILE = os.path.join(TOKEN_DIR, f'history_{API_NAME}_{API_VERSION}.json')
+
+# --- Control de Ritmo ---
+class TokenBucket:
+    """Limitador token-bucket seguro entre hilos: 'rate' unidades por segundo, ráfagas hasta 'capacity'."""
+
+    def __init__(self, rate=QUOTA_UNITS_PER_SECOND, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """Bloquea hasta que haya 'cost' unidades disponibles y las consume."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                wait = (cost - self._tokens) / self.rate
+            time.sleep(wait)
+
+def is_retryable(error):
+    """True si el error es transitorio: 429, 5xx, límite de tasa (403 rateLimitExceeded) o fallo de red."""
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, 'status', None)
+        if status in RETRY_STATUSES: return True
+        return status == 403 and 'rateLimitExceeded' in str(error)
+    return isinstance(error, (OSError, TimeoutError))
+
+def execute_with_backoff(request, limiter=None, cost=ATTACHMENT_GET_COST, max_retries=MAX_RETRIES):
+    """Ejecuta una petición de la API respetando el limitador y reintentando con backoff exponencial + jitter."""
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire(cost)
+        try:
+            return request.execute()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            delay = BACKOFF_BASE * (2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+            time.sleep(delay)
 
 # --- Funciones de Interacción con Gmail API ---
 
@@ -53,33 +123,245 @@ def search_emails(service, query_string: str, label_ids: List = None):
         print(f"❌ Error buscando correos: {e}")
         return []
 
-def get_file_data(service, message_id, attachment_id):
-    """Obtiene los datos binarios de un archivo adjunto."""
+def get_file_data(service, message_id, attachment_id, limiter=None):
+    """Obtiene los datos binarios de un archivo adjunto (con backoff ante 429/5xx)."""
     try:
-        response = service.users().messages().attachments().get(
+        response = execute_with_backoff(service.users().messages().attachments().get(
             userId='me', messageId=message_id, id=attachment_id
-        ).execute()
+        ), limiter)
         file_data = base64.urlsafe_b64decode(response.get('data').encode('UTF-8'))
         return file_data
     except Exception as e:
         print(f"❌ Error descargando adjunto ID {attachment_id} del mensaje {message_id}: {e}")
         return None
 
-def get_message_detail(service, message_id, msg_format='metadata', metadata_headers: List = None):
-    """Obtiene los detalles de un mensaje específico."""
+def get_message_detail(service, message_id, msg_format='metadata', metadata_headers: List = None, fields=None):
+    """Obtiene los detalles de un mensaje específico ('fields' = máscara de respuesta parcial opcional)."""
     try:
         message_detail = service.users().messages().get(
-            userId='me', id=message_id, format=msg_format, metadataHeaders=metadata_headers
+            userId='me', id=message_id, format=msg_format, metadataHeaders=metadata_headers, fields=fields
         ).execute()
         return message_detail
     except Exception as e:
         print(f"❌ Error obteniendo detalles del mensaje {message_id}: {e}")
         return None
 
+def get_message_details_batch(service, message_ids, msg_format='metadata', metadata_headers: List = None,
+                              batch_size=BATCH_SIZE, fields=None):
+    """
+    Obtiene los detalles de varios mensajes usando lotes HTTP de Gmail (una petición por cada 'batch_size').
+
+    Los elementos que fallan dentro de un lote se reintentan uno por uno con get_message_detail.
+    Devuelve {message_id: detalle}; los que fallan también en el reintento no aparecen.
+    """
+    details = {}
+    failed_ids = []
+
+    def on_response(request_id, response, exception):
+        if exception is not None:
+            failed_ids.append(request_id)
+        else:
+            details[request_id] = response
+
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        batch = service.new_batch_http_request(callback=on_response)
+        for message_id in chunk:
+            batch.add(
+                service.users().messages().get(
+                    userId='me', id=message_id, format=msg_format, metadataHeaders=metadata_headers, fields=fields
+                ),
+                request_id=message_id
+            )
+        try:
+            batch.execute()
+        except Exception as e:
+            print(f"⚠️ Error ejecutando lote de detalles ({len(chunk)} mensajes): {e}. Reintentando uno por uno.")
+            failed_ids.extend([mid for mid in chunk if mid not in details and mid not in failed_ids])
+
+    # Reintento individual de los fallos parciales
+    for message_id in failed_ids:
+        detail = get_message_detail(service, message_id, msg_format=msg_format, metadata_headers=metadata_headers, fields=fields)
+        if detail:
+            details[message_id] = detail
+    return details
+
+def iter_report_attachments(part):
+    """
+    Recorre recursivamente el árbol MIME y genera (file_name, attachment_id) de cada CSV de reporte.
+    Encuentra también adjuntos anidados (p. ej. dentro de multipart/mixed -> multipart/alternative).
+    """
+    file_name = part.get('filename')
+    body = part.get('body') or {}
+    # Verificar si es un adjunto CSV de reporte
+    if file_name and file_name.lower().endswith('.csv') and file_name.startswith('report-') and 'attachmentId' in body:
+        yield file_name, body['attachmentId']
+    for child in part.get('parts') or []:
+        yield from iter_report_attachments(child)
+
+def mark_messages_read(service, message_ids, chunk_size=MODIFY_CHUNK_SIZE):
+    """
+    Quita la etiqueta UNREAD con una llamada batchModify por cada 'chunk_size' mensajes.
+    Si un batchModify falla, ese bloque se reintenta mensaje por mensaje. Devuelve cuántos se marcaron.
+    """
+    marked = 0
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        try:
+            service.users().messages().batchModify(
+                userId='me', body={'ids': chunk, 'removeLabelIds': ['UNREAD']}
+            ).execute()
+            marked += len(chunk)
+        except Exception as e:
+            print(f"  ⚠️ Error en batchModify ({len(chunk)} mensajes): {e}. Reintentando uno por uno.")
+            for msg_id in chunk:
+                try:
+                    service.users().messages().modify(
+                        userId='me', id=msg_id, body={'removeLabelIds': ['UNREAD']}
+                    ).execute()
+                    marked += 1
+                except Exception as e:
+                    print(f"  ⚠️ Error marcando correo {msg_id} como leído: {e}")
+    return marked
+
+# --- Sincronización Incremental (historyId) ---
+
+def load_history_checkpoint():
+    """Devuelve el historyId guardado o None si no hay punto de control."""
+    try:
+        with open(HISTORY_CHECKPOINT_FILE, encoding='utf-8') as f:
+            return json.load(f).get('historyId')
+    except (OSError, ValueError):
+        return None
+
+def save_history_checkpoint(history_id):
+    """Guarda el historyId para que la próxima corrida pida solo lo nuevo."""
+    try:
+        os.makedirs(TOKEN_DIR, exist_ok=True)
+        with open(HISTORY_CHECKPOINT_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'historyId': str(history_id), 'saved_at': time.strftime('%Y-%m-%d %H:%M:%S')}, f)
+    except OSError as e:
+        print(f"⚠️ No se pudo guardar el punto de control de historial: {e}")
+
+def get_current_history_id(service):
+    """historyId actual del buzón (se toma ANTES de buscar para no perder correos que lleguen durante la corrida)."""
+    return service.users().getProfile(userId='me').execute().get('historyId')
+
+def list_new_message_ids(service, start_history_id):
+    """
+    Lista los mensajes agregados desde 'start_history_id' con users().history().list.
+    Devuelve (ids_en_orden, historyId_actual). Lanza HistoryExpired si el punto de control caducó.
+    """
+    message_ids = []
+    seen = set()
+    page_token = None
+    latest_history_id = start_history_id
+    while True:
+        try:
+            response = service.users().history().list(
+                userId='me', startHistoryId=start_history_id, historyTypes=['messageAdded'], pageToken=page_token
+            ).execute()
+        except HttpError as e:
+            if getattr(e.resp, 'status', None) == 404:
+                raise HistoryExpired(str(e))
+            raise
+        latest_history_id = response.get('historyId', latest_history_id)
+        for record in response.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added.get('message', {})
+                labels = message.get('labelIds', [])
+                if message.get('id') and message['id'] not in seen and 'SENT' not in labels and 'DRAFT' not in labels:
+                    seen.add(message['id'])
+                    message_ids.append(message['id'])
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return message_ids, latest_history_id
+
+def save_attachment(file_name, content):
+    """Guarda un adjunto en SAVE_LOCATION. Devuelve la ruta o None si falla."""
+    file_path = os.path.join(SAVE_LOCATION, file_name)
+    try:
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        return file_path
+    except IOError as e:
+        print(f"  ❌ Error guardando archivo {file_name}: {e}")
+        return None
+
+def download_attachments(service, jobs, workers=DOWNLOAD_WORKERS, service_factory=None, limiter=None,
+                         on_attachment=None, archive=True):
+    """
+    Descarga y guarda los adjuntos de 'jobs' [(msg_id, file_name, attachment_id), ...].
+
+    Si se da 'on_attachment(file_name, content)' se llama con cada adjunto descargado (p. ej. para
+    cargarlo directo a la BD); con archive=False no se escribe a disco.
+
+    Con workers > 1 usa un pool de hilos. El objeto service de googleapiclient no es seguro
+    entre hilos, así que cada hilo crea el suyo con 'service_factory()'. Todas las descargas
+    comparten un token-bucket ajustado a la cuota por usuario de Gmail.
+    Devuelve estadísticas: archivos, bytes, segundos, adjuntos/s y bytes/s.
+    """
+    limiter = limiter or TokenBucket()
+    stats = {'files': 0, 'failed': 0, 'bytes': 0, 'seconds': 0.0}
+    stats_lock = threading.Lock()
+    local = threading.local()
+    start = time.perf_counter()
+
+    def worker_service():
+        if workers <= 1 or service_factory is None:
+            return service
+        if getattr(local, 'service', None) is None:
+            local.service = service_factory()
+        return local.service
+
+    def download_one(job):
+        msg_id, file_name, attachment_id = job
+        content = get_file_data(worker_service(), msg_id, attachment_id, limiter)
+        if not content:
+            print(f"  ⚠️ No se pudo descargar el contenido de {file_name}.")
+            with stats_lock: stats['failed'] += 1
+            return
+        file_path = save_attachment(file_name, content) if archive else None
+        if file_path: print(f"  ✅ Archivo guardado: {file_path}")
+        ok = file_path is not None or not archive
+        with stats_lock:
+            if ok:
+                stats['files'] += 1; stats['bytes'] += len(content)
+            else:
+                stats['failed'] += 1
+        if ok and on_attachment is not None:
+            on_attachment(file_name, content)
+
+    if workers <= 1:
+        for job in jobs:
+            download_one(job)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(download_one, job) for job in jobs]):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"  ❌ Error en hilo de descarga: {e}")
+                    with stats_lock: stats['failed'] += 1
+
+    stats['seconds'] = time.perf_counter() - start
+    elapsed = stats['seconds'] or 1e-9
+    stats['attachments_per_s'] = round(stats['files'] / elapsed, 2)
+    stats['bytes_per_s'] = round(stats['bytes'] / elapsed, 1)
+    return stats
+
 # --- Flujo Principal ---
-def main():
+def new_service():
+    """Crea un objeto service de Gmail independiente (uno por hilo de descarga); reutiliza las credenciales en caché."""
+    return create_service(CLIENT_FILE, API_NAME, API_VERSION, SCOPES, shared=False)
+
+def main(workers=DOWNLOAD_WORKERS, incremental=True, on_attachment=None, archive=True):
+    """
+    Descarga los reportes nuevos. 'on_attachment(file_name, content)' recibe cada adjunto al
+    descargarse (ver pipeline.py); con archive=False no se guardan los CSV en SAVE_LOCATION.
+    """
     print("--- Iniciando Descarga de Reportes Gmail ---")
-    service = create_service(CLIENT_FILE, API_NAME, API_VERSION, SCOPES)
+    service = create_service(CLIENT_FILE, API_NAME, API_VERSION, SCOPES) # En caché entre corridas de la misma sesión
 
     if service is None:
         print("❌ Falló la creación del servicio de Gmail. Abortando.")
@@ -91,7 +373,7 @@ def main():
     # query_string = 'is:unread has:attachment'
 
     # Crear directorio de guardado si no existe
-    if not os.path.exists(SAVE_LOCATION):
+    if archive and not os.path.exists(SAVE_LOCATION):
         try:
             os.makedirs(SAVE_LOCATION)
             print(f"Directorio creado: {SAVE_LOCATION}")
@@ -99,60 +381,80 @@ def main():
             print(f"❌ Error creando directorio {SAVE_LOCATION}: {e}. Abortando.")
             return
 
-    # Buscar correos
-    email_messages = search_emails(service, query_string)
+    # Buscar correos: incremental desde el último historyId o búsqueda completa
+    message_ids = None
+    new_history_id = None
+    from_search = False # La búsqueda ya filtra por asunto; el historial trae cualquier correo nuevo
+    checkpoint = load_history_checkpoint() if incremental else None
+    if checkpoint:
+        try:
+            message_ids, new_history_id = list_new_message_ids(service, checkpoint)
+            print(f"Sincronización incremental: {len(message_ids)} mensajes nuevos desde historyId {checkpoint}.")
+        except HistoryExpired:
+            print("ℹ️ El punto de control de historial caducó. Haciendo búsqueda completa.")
+        except Exception as e:
+            print(f"⚠️ Error en sincronización incremental: {e}. Haciendo búsqueda completa.")
+    if message_ids is None:
+        try:
+            new_history_id = get_current_history_id(service)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el historyId actual: {e}")
+        email_messages = search_emails(service, query_string)
+        message_ids = [email_message['id'] for email_message in email_messages]
+        from_search = True
+
+    # Obtener los detalles de todos los mensajes en lotes HTTP
+    message_details = get_message_details_batch(service, message_ids, msg_format='full', fields=MESSAGE_FIELDS)
 
-    files_downloaded_count = 0
+    attachment_jobs = [] # (msg_id, file_name, attachment_id) a descargar
+    processed_ids = [] # Mensajes a marcar como leídos al final (batchModify)
     # Procesar cada correo encontrado
-    for email_message in email_messages:
-        msg_id = email_message['id']
+    for msg_id in message_ids:
         print(f"\nProcesando mensaje ID: {msg_id}")
-        messageDetail = get_message_detail(service, msg_id, msg_format='full', metadata_headers=['parts'])
+        messageDetail = message_details.get(msg_id)
 
         if not messageDetail: continue # Saltar si no se obtienen detalles
 
         messageDetailPayload = messageDetail.get('payload')
         if not messageDetailPayload: continue
 
-        # Iterar sobre las partes del mensaje para encontrar adjuntos
-        if 'parts' in messageDetailPayload:
-            for msgPayload in messageDetailPayload['parts']:
-                file_name = msgPayload.get('filename')
-                body = msgPayload.get('body')
-
-                # Verificar si es un adjunto CSV de reporte
-                if file_name and file_name.lower().endswith('.csv') and file_name.startswith('report-') and body and 'attachmentId' in body:
-                    attachment_id = body['attachmentId']
-                    print(f"  Encontrado adjunto: {file_name} (ID: {attachment_id})")
-
-                    # Descargar el contenido del adjunto
-                    attachment_content = get_file_data(service, msg_id, attachment_id)
-
-                    if attachment_content:
-                        # Guardar el archivo
-                        file_path = os.path.join(SAVE_LOCATION, file_name)
-                        try:
-                            with open(file_path, 'wb') as f:
-                                f.write(attachment_content)
-                            print(f"  ✅ Archivo guardado: {file_path}")
-                            files_downloaded_count += 1
-                        except IOError as e:
-                            print(f"  ❌ Error guardando archivo {file_name}: {e}")
-                    else:
-                         print(f"  ⚠️ No se pudo descargar el contenido de {file_name}.")
-
-        # Marcar el correo como leído (quitar etiqueta UNREAD) después de procesar adjuntos
-        try:
-            service.users().messages().modify(
-                userId='me', id=msg_id, body={'removeLabelIds': ['UNREAD']}
-            ).execute()
-            print(f"  Correo {msg_id} marcado como leído.")
-        except Exception as e:
-            print(f"  ⚠️ Error marcando correo {msg_id} como leído: {e}")
+        # Recorrer todo el árbol de partes (incluye multipart anidados) para encontrar adjuntos
+        for file_name, attachment_id in iter_report_attachments(messageDetailPayload):
+            print(f"  Encontrado adjunto: {file_name} (ID: {attachment_id})")
+            attachment_jobs.append((msg_id, file_name, attachment_id))
+
+        # Marcar el correo como leído (quitar etiqueta UNREAD) después de procesar adjuntos.
+        # Con historial solo se marcan los que traían reportes, para no tocar otros correos.
+        if from_search or (attachment_jobs and attachment_jobs[-1][0] == msg_id):
+            processed_ids.append(msg_id)
+
+    # Descargar los adjuntos (en paralelo si workers > 1, con límite de cuota y backoff)
+    stats = {'files': 0, 'bytes': 0, 'seconds': 0.0, 'attachments_per_s': 0.0, 'bytes_per_s': 0.0}
+    if attachment_jobs:
+        print(f"\nDescargando {len(attachment_jobs)} adjuntos con {max(1, workers)} hilo(s)...")
+        stats = download_attachments(service, attachment_jobs, workers, service_factory=new_service,
+                                     on_attachment=on_attachment, archive=archive)
+    files_downloaded_count = stats['files']
+
+    # Marcar como leídos todos los correos procesados (una llamada por bloque)
+    if processed_ids:
+        marked = mark_messages_read(service, processed_ids)
+        print(f"\n{marked} correos marcados como leídos.")
 
-        time.sleep(0.2) # Pequeña pausa entre correos
+    # Corrida completa: la próxima vez solo se pide lo agregado después de este punto.
+    # Si faltó algún detalle o adjunto se conserva el punto anterior: con historial esos
+    # mensajes no se vuelven a listar y sus reportes se perderían.
+    missing_details = [msg_id for msg_id in message_ids if msg_id not in message_details]
+    if incremental and new_history_id:
+        if missing_details or stats.get('failed', 0):
+            print(f"⚠️ {len(missing_details)} mensajes sin detalles y {stats.get('failed', 0)} adjuntos con error: "
+                  "se conserva el punto de control anterior para reintentarlos en la próxima corrida.")
+        else:
+            save_history_checkpoint(new_history_id)
 
-    print(f"\n--- Descarga Finalizada: {files_downloaded_count} archivos descargados ---")
+    print(f"\n--- Descarga Finalizada: {files_downloaded_count} archivos descargados "
+          f"({stats['bytes']} bytes en {stats['seconds']:.1f}s, {stats['attachments_per_s']} adjuntos/s) ---")
+    return stats
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
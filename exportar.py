@@ -0,0 +1,159 @@
+# Exportación de lecturas de sensor_data a XLSX, CSV o Parquet en streaming.
+# Las filas pasan por lotes desde un cursor sin buffer directo al archivo, así la memoria
+# no crece con el tamaño de la exportación. Acepta varios sensores y un rango de tiempo opcional.
+#
+# Sin conexión a MySQL (o con --from-cache) se exporta desde la caché Parquet local (cache_parquet.py).
+#
+# Uso:  python exportar.py --sensor sw01 --sensor swm-02 --start 2024-01-01 --end 2024-02-01 --output datos.parquet
+
+import os
+import csv
+import argparse
+from contextlib import closing
+import mysql.connector
+import base_datos
+import sensores
+import cache_parquet
+from consultas import iterar_lecturas
+
+# --- Configuración ---
+LOTE = 10000 # Filas por lote leído de la BD (y por row group en Parquet)
+COLUMNAS = ['id', 'sensor_id', 'time', 'water_flow_value', 'total_pulse', 'flow_per_hour', 'last_pulse', 'battery']
+MAX_FILAS_XLSX = 1048575 # Límite de filas por hoja de Excel (sin contar la cabecera)
+FORMATOS = {'.xlsx': 'xlsx', '.csv': 'csv', '.parquet': 'parquet'}
+
+# --- Escritores (abrir / escribir lotes / cerrar) ---
+
+class EscritorCSV:
+    """Un solo CSV con todas las filas; el sensor va en la columna sensor_id."""
+
+    def __init__(self, ruta):
+        self.archivo = open(ruta, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.archivo)
+        self.writer.writerow(COLUMNAS)
+
+    def escribir(self, nombre_sensor, filas):
+        self.writer.writerows(filas)
+
+    def cerrar(self):
+        self.archivo.close()
+
+class EscritorXLSX:
+    """Libro de openpyxl en modo write-only (escribe a disco por filas): una hoja por sensor."""
+
+    def __init__(self, ruta):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise Exception("Exportar a XLSX requiere 'openpyxl' (pip install openpyxl).")
+        self.ruta = ruta
+        self.libro = Workbook(write_only=True)
+        self.hoja = None; self.nombre_hoja = None; self.filas_hoja = 0; self.partes = 0
+
+    def _nueva_hoja(self, nombre_sensor):
+        self.partes = self.partes + 1 if nombre_sensor == self.nombre_hoja else 1
+        titulo = nombre_sensor if self.partes == 1 else f"{nombre_sensor} ({self.partes})"
+        self.hoja = self.libro.create_sheet(title=titulo[:31]) # Excel limita el nombre a 31 caracteres
+        self.hoja.append(COLUMNAS)
+        self.nombre_hoja = nombre_sensor; self.filas_hoja = 0
+
+    def escribir(self, nombre_sensor, filas):
+        for fila in filas:
+            if self.hoja is None or nombre_sensor != self.nombre_hoja or self.filas_hoja >= MAX_FILAS_XLSX:
+                self._nueva_hoja(nombre_sensor) # Sensor nuevo o hoja llena: continuar en otra hoja
+            self.hoja.append(fila)
+            self.filas_hoja += 1
+
+    def cerrar(self):
+        if self.hoja is None: self.libro.create_sheet(title="Sin datos").append(COLUMNAS)
+        self.libro.save(self.ruta)
+
+class EscritorParquet:
+    """Parquet con pyarrow: cada lote de la BD se escribe como un row group (mismo esquema que la caché local)."""
+
+    def __init__(self, ruta):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Exportar a Parquet requiere 'pyarrow' (pip install pyarrow).")
+        self.esquema = cache_parquet.esquema()
+        self.writer = pq.ParquetWriter(ruta, self.esquema)
+
+    def escribir(self, nombre_sensor, filas):
+        self.writer.write_table(cache_parquet.tabla_arrow(filas, self.esquema))
+
+    def cerrar(self):
+        self.writer.close()
+
+ESCRITORES = {'csv': EscritorCSV, 'xlsx': EscritorXLSX, 'parquet': EscritorParquet}
+
+def formato_de_ruta(ruta):
+    """Formato ('xlsx', 'csv' o 'parquet') según la extensión del archivo de salida."""
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension not in FORMATOS:
+        raise ValueError(f"Extensión no soportada '{extension}'. Usa {', '.join(FORMATOS)}.")
+    return FORMATOS[extension]
+
+def exportar(sensor_ids, ruta, conn, inicio=None, fin=None, formato=None, lote=LOTE, progreso=None):
+    """
+    Exporta las lecturas de 'sensor_ids' (en ese orden, cada uno por time) a 'ruta'.
+
+    inicio/fin acotan 'time' a [inicio, fin). progreso(sensor_id, filas_escritas) se llama tras
+    cada lote; si lanza una excepción (p. ej. tarea cancelada) la exportación se aborta.
+    Si algo falla se borra el archivo incompleto. Devuelve el total de filas escritas.
+    Con conn=None las lecturas salen de la caché Parquet local (respaldo si MySQL no responde).
+    """
+    escritor = ESCRITORES[formato or formato_de_ruta(ruta)](ruta)
+    registro = sensores.get_registry()
+    total = 0
+    completo = False
+    try:
+        for sensor_id in sensor_ids:
+            nombre = registro.name_for_id(sensor_id) or str(sensor_id)
+            lotes = (iterar_lecturas(sensor_id, conn, inicio, fin, lote) if conn is not None
+                     else cache_parquet.iterar_lotes(sensor_id, inicio, fin, lote))
+            # closing: si progreso (cancelar) o el escritor fallan, el generador cierra su cursor ya,
+            # antes de que el llamador devuelva la conexión al pool con resultados sin leer
+            with closing(lotes):
+                for filas in lotes:
+                    escritor.escribir(nombre, filas)
+                    total += len(filas)
+                    if progreso: progreso(sensor_id, total)
+        completo = True
+    finally:
+        try:
+            escritor.cerrar()
+        finally:
+            if not completo and os.path.exists(ruta):
+                os.remove(ruta)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta lecturas de sensores a XLSX, CSV o Parquet (según la extensión).")
+    parser.add_argument("--sensor", action="append", required=True, help="Nombre o ID del sensor (se puede repetir)")
+    parser.add_argument("--start", help="Fecha/hora inicial incluida, p. ej. '2024-01-01' o '2024-01-01 08:00:00'")
+    parser.add_argument("--end", help="Fecha/hora final excluida")
+    parser.add_argument("--output", required=True, help="Archivo de salida (.xlsx, .csv o .parquet)")
+    parser.add_argument("--batch-size", type=int, default=LOTE, help=f"Filas por lote (default: {LOTE})")
+    parser.add_argument("--from-cache", action="store_true", help="Leer de la caché Parquet local en lugar de MySQL")
+    args = parser.parse_args()
+
+    conn = None
+    if not args.from_cache:
+        try:
+            conn = base_datos.get_connection()
+        except mysql.connector.Error as err:
+            if not cache_parquet.disponible(): raise
+            print(f"⚠️ BD no disponible ({err}). Exportando desde la caché local {cache_parquet.CACHE_DIR}.")
+    try:
+        registro = sensores.get_registry(conn, refresh=conn is not None)
+        ids = []
+        for sensor in args.sensor:
+            sensor_id = int(sensor) if sensor.isdigit() else registro.id_for_name(sensor)
+            if sensor_id is None: raise SystemExit(f"❌ Sensor desconocido: {sensor}")
+            ids.append(sensor_id)
+        total = exportar(ids, args.output, conn, args.start, args.end, lote=args.batch_size,
+                         progreso=lambda sensor_id, filas: print(f"  -> sensor {sensor_id}: {filas} filas escritas", end="\r"))
+        print(f"\n✅ {total} filas exportadas a {args.output}")
+    finally:
+        if conn: conn.close()
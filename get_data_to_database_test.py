@@ -2,61 +2,277 @@
 # Calcula el valor 'flow_per_hour' usando SQL después de la inserción.
 
 import os
+import io
+import time
+import argparse
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import mysql.connector
-import re
+import base_datos
+import sensores
+import migraciones
+import cache_parquet
 import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # --- Configuración ---
-DB_CONFIG = {
-    "host": "localhost",
-    "user": "root",
-    "password": "1234", # Asegúrate que sea la correcta
-    "database": "labiot_data_sensed"
-}
+# La conexión (credenciales, pool) se configura en base_datos.py / db_config.json / variables de entorno
 CSV_DIRECTORY = r"C:\Users\erika\Desktop\SERVICIO SOCIAL - BD\PYTHON\Reportes desde gmail" # Ruta a los CSV
-# Mapeo de patrones de nombre de archivo a ID de sensor en la BD
-SENSOR_MAPPING = {
-    r'report-d-swm-02.*': 2,
-    r'report-d-swm-03.*': 3,
-    r'report-d-swm-04.*': 4,
-    r'report-d-swm-05.*': 5,
-    r'report-pv-sw01.*': 1,
-}
+# El mapeo nombre de archivo -> sensor_id vive en sensores.py (registro con caché)
+BATCH_SIZE = 1000 # Filas por sentencia INSERT multi-fila (executemany)
+CHUNK_SIZE = 50000 # Filas por bloque en el modo de lectura por streaming (--chunk-size)
+WORKERS = 1 # Procesos que leen/limpian CSV en paralelo (1 = secuencial, sin pool)
+
+# Columnas numéricas del CSV: (nombre, ¿entero?). Los enteros se truncan como int(float(x)).
+NUMERIC_COLUMNS = [
+    ('Water Flow Value', False),
+    ('Total Pulse', True),
+    ('Last Pulse', True),
+    ('Battery', False),
+]
+
+# --- Conversión de Datos ---
+
+def _column_to_objects(df, column, as_int):
+    """Convierte una columna completa a objetos Python (float/int/None). Devuelve (valores, máscara_de_error)."""
+    if column not in df.columns:
+        # Igual que row.get(): columna ausente -> None en todas las filas
+        return np.full(len(df), None, dtype=object), np.zeros(len(df), dtype=bool)
+    raw = df[column]
+    values = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float)
+    missing = np.isnan(values)
+    failed = missing & raw.notna().to_numpy() # Había dato pero no es numérico
+    if as_int:
+        out = np.trunc(np.where(missing, 0, values)).astype(np.int64).astype(object)
+    else:
+        out = values.astype(object)
+    out[missing] = None # NaN -> NULL en la BD
+    return out, failed
+
+def dataframe_to_rows(df, sensor_id):
+    """
+    Convierte el DataFrame (ya con 'time_dt') en tuplas listas para insert_file_chunks.
+
+    Trabaja columna por columna en lugar de fila por fila. Devuelve (filas, índices_con_error):
+    las filas con algún valor no numérico se omiten y se reportan juntas.
+    """
+    fechas = df['time_dt'].dt.strftime("%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+    failed = np.zeros(len(df), dtype=bool)
+    columns = []
+    for column, as_int in NUMERIC_COLUMNS:
+        values, column_failed = _column_to_objects(df, column, as_int)
+        columns.append(values)
+        failed |= column_failed
+    keep = ~failed
+    rows = list(zip([sensor_id] * int(keep.sum()), fechas[keep], *(values[keep] for values in columns)))
+    return rows, df.index[failed].tolist()
+
+def prepare_file(file_path, file_name, sensor_id):
+    """
+    Lee, limpia, ordena y convierte un CSV. No toca la BD, así que puede correr en otro proceso.
+    'file_path' puede ser una ruta o el contenido del CSV en bytes (adjunto recién descargado).
+
+    Devuelve un dict con 'status' y, si es 'ok', las filas listas para insertar:
+      read_error / empty_file / empty_csv / no_time_column / date_error / no_dates / ok
+    """
+    result = {'file_name': file_name, 'status': 'ok', 'error': None, 'rows': [], 'bad_rows': []}
+    # Validar y leer CSV
+    try:
+        if isinstance(file_path, (bytes, bytearray)):
+            if len(file_path) == 0:
+                result['status'] = 'empty_file'; return result
+            df = pd.read_csv(io.BytesIO(file_path))
+        else:
+            if os.path.getsize(file_path) == 0:
+                result['status'] = 'empty_file'; return result
+            df = pd.read_csv(file_path)
+        if df.empty:
+            result['status'] = 'empty_csv'; return result
+    except Exception as read_err:
+        result.update(status='read_error', error=str(read_err)); return result
+
+    # Limpiar columnas sin nombre (comunes en algunos CSV)
+    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+
+    # Preparar columna de fecha y ordenar
+    try:
+        df['time_dt'] = pd.to_datetime(df['time'], format="%a, %d %b %Y %H:%M:%S", errors='coerce')
+        df = df.dropna(subset=['time_dt'])
+        df = df.sort_values(by='time_dt')
+        if df.empty:
+            result['status'] = 'no_dates'; return result
+    except KeyError:
+        result['status'] = 'no_time_column'; return result
+    except Exception as sort_err:
+        result.update(status='date_error', error=str(sort_err)); return result
+
+    # Preparar filas (conversión vectorizada por columnas)
+    result['rows'], result['bad_rows'] = dataframe_to_rows(df, sensor_id)
+    return result
+
+class SkipFile(Exception):
+    """Se lanza desde la lectura por streaming para abortar un archivo sin marcarlo como procesado."""
+    pass
+
+def iter_file_chunks(file_path, sensor_id, chunk_size, info):
+    """
+    Lee un CSV por bloques de 'chunk_size' filas y genera listas de tuplas listas para insertar.
+
+    La memoria queda acotada por el tamaño del bloque. 'info' acumula el estado del archivo:
+    filas leídas, filas válidas, índices con error y 'status' si hay que abortar (SkipFile).
+    """
+    try:
+        reader = pd.read_csv(file_path, chunksize=chunk_size)
+    except Exception as read_err:
+        info.update(status='read_error', error=str(read_err)); raise SkipFile()
+    with reader:
+        for chunk in reader:
+            info['rows_read'] += len(chunk)
+            # Limpiar columnas sin nombre (comunes en algunos CSV)
+            chunk = chunk.loc[:, ~chunk.columns.str.contains('^Unnamed')]
+            if 'time' not in chunk.columns:
+                info['status'] = 'no_time_column'; raise SkipFile()
+            chunk['time_dt'] = pd.to_datetime(chunk['time'], format="%a, %d %b %Y %H:%M:%S", errors='coerce')
+            chunk = chunk.dropna(subset=['time_dt'])
+            if chunk.empty: continue
+            # El orden dentro del bloque no afecta a flow_per_hour: LAG() ordena por time en SQL
+            rows, bad_rows = dataframe_to_rows(chunk, sensor_id)
+            info['bad_rows'].extend(bad_rows)
+            info['valid_rows'] += len(chunk)
+            yield rows
+
+def stream_file(file_path, file_name, sensor_id, connection, chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, signature=None):
+    """
+    Modo streaming: lee el CSV por bloques y los inserta directo en la BD en una sola transacción.
+
+    Devuelve un dict con el mismo 'status' que prepare_file más 'inserted', 'min_time' y 'max_time'.
+    """
+    info = {'file_name': file_name, 'status': 'ok', 'error': None, 'bad_rows': [],
+            'rows_read': 0, 'valid_rows': 0, 'inserted': 0, 'min_time': None, 'max_time': None}
+    chunks = iter_file_chunks(file_path, sensor_id, chunk_size, info)
+    result = insert_file_chunks(file_name, chunks, connection, batch_size, signature)
+    if result is None:
+        if info['status'] == 'ok': info['status'] = 'insert_error'
+        return info
+    info['inserted'], info['min_time'], info['max_time'] = result
+    # El archivo ya quedó marcado; solo se ajusta el mensaje
+    if info['rows_read'] == 0: info['status'] = 'empty_csv'
+    elif info['valid_rows'] == 0: info['status'] = 'no_dates'
+    return info
+
+def iter_prepared_files(tasks, workers=WORKERS):
+    """
+    Genera los resultados de prepare_file en el mismo orden que 'tasks' [(ruta, nombre, sensor_id), ...].
+
+    Con workers > 1 el trabajo se reparte en un pool de procesos; se mantienen como máximo
+    2*workers archivos en vuelo para que la memoria no crezca si la BD es más lenta que el parseo.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield prepare_file(*task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append(executor.submit(prepare_file, *task))
+            if len(pending) >= workers * 2: break
+        while pending:
+            future = pending.popleft()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append(executor.submit(prepare_file, *next_task))
+            try:
+                yield future.result()
+            except Exception as worker_err: # p. ej. el proceso murió
+                yield {'file_name': None, 'status': 'read_error', 'error': str(worker_err), 'rows': [], 'bad_rows': []}
+
+def file_signature(file_path):
+    """Clave barata de cambio para un archivo: (tamaño en bytes, mtime en ns)."""
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
 
 # --- Funciones de Base de Datos ---
 
 def connect_to_database():
-    """Establece conexión con la base de datos MySQL."""
+    """Obtiene una conexión del pool compartido (base_datos)."""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = base_datos.get_connection()
         print("Conexión a BD establecida.")
         return conn
     except mysql.connector.Error as err:
         print(f"❌ Error de conexión BD: {err}")
         return None
 
-def insert_data_to_table(sensor_id, date, water_flow_value, total_pulse, last_pulse, battery, connection):
-    """Inserta una fila de datos de sensor en la tabla sensor_data."""
-    if connection is None: return
+def insert_file_chunks(file_name, chunks, connection, batch_size=BATCH_SIZE, signature=None):
+    """
+    Inserta las filas de un archivo (un iterable de bloques, p. ej. lectura por chunks) en lotes
+    y lo marca como procesado en UNA transacción.
+
+    Si algo falla a mitad del archivo se hace rollback: no quedan filas sueltas ni
+    el archivo marcado como procesado.
+    Devuelve (filas_insertadas, fecha_mínima, fecha_máxima) o None si falló y se revirtió; las lecturas
+    que ya existían (mismo sensor y hora) no se cuentan.
+    """
+    if connection is None: return None
     cursor = None
+    batch_size = max(1, int(batch_size))
+    inserted = 0
+    min_time = max_time = None
+    sensor_ids = set()
     try:
         cursor = connection.cursor()
+        # La clave única (sensor_id, time) descarta lecturas repetidas (reportes que se solapan)
         insert_query = """
         INSERT INTO sensor_data
         (sensor_id, time, water_flow_value, total_pulse, last_pulse, battery)
         VALUES (%s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = id
         """
-        data_tuple = (sensor_id, date, water_flow_value, total_pulse, last_pulse, battery)
-        cursor.execute(insert_query, data_tuple)
+        for rows in chunks:
+            # executemany reescribe el INSERT como un VALUES multi-fila por lote
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(insert_query, rows[start:start + batch_size])
+                inserted += max(0, cursor.rowcount) # Los duplicados cuentan 0 filas afectadas
+            if rows:
+                sensor_ids.update(row[0] for row in rows)
+                chunk_min = min(row[1] for row in rows) # Formato ISO: el orden de texto es el cronológico
+                chunk_max = max(row[1] for row in rows)
+                min_time = chunk_min if min_time is None else min(min_time, chunk_min)
+                max_time = chunk_max if max_time is None else max(max_time, chunk_max)
+        # Marca y versión de datos en la misma transacción
+        cursor.execute(*_processed_file_marker(file_name, signature))
+        if inserted:
+            for sensor_id in sorted(sensor_ids): bump_data_version(cursor, sensor_id)
         connection.commit()
-    except mysql.connector.Error as err:
-        print(f"❌ Error insertando en sensor_data: {err} - Datos: {data_tuple}")
-        # traceback.print_exc() # Descomentar para traza completa
+        return inserted, min_time, max_time
+    except Exception as err:
+        if not isinstance(err, SkipFile):
+            print(f"  ❌ Error insertando {file_name}: {err}. Revirtiendo transacción.")
+        try:
+            connection.rollback()
+        except mysql.connector.Error as rb_err:
+            print(f"  ❌ Error en rollback: {rb_err}")
+        return None
     finally:
         if cursor: cursor.close()
 
+def bump_data_version(cursor, sensor_id=None):
+    """
+    Sube sensors.data_version del sensor (o de todos) en la transacción en curso.
+    Es la marca de agua de cache_consultas: inserciones y recálculos de flow_per_hour o de agregados
+    invalidan así las consultas en caché, también en otros procesos.
+    """
+    try:
+        if sensor_id is None:
+            cursor.execute("UPDATE sensors SET data_version = data_version + 1")
+        else:
+            cursor.execute("UPDATE sensors SET data_version = data_version + 1 WHERE id = %s", (sensor_id,))
+    except mysql.connector.Error as err: # Esquema sin la migración 5: no se pierde la actualización por esto
+        print(f"⚠️ No se pudo actualizar data_version (¿falta migrar?): {err}")
+
 def update_flow_per_hour(connection):
     """Calcula y actualiza la columna flow_per_hour usando SQL (Requiere MySQL 8.0+)."""
     if connection is None or not connection.is_connected():
@@ -85,8 +301,10 @@ def update_flow_per_hour(connection):
         """
         print("⚙️ Calculando y actualizando flow_per_hour vía SQL...")
         cursor.execute(update_query)
+        updated = cursor.rowcount
+        bump_data_version(cursor)
         connection.commit()
-        print(f"✅ {cursor.rowcount} filas actualizadas en flow_per_hour.")
+        print(f"✅ {updated} filas actualizadas en flow_per_hour.")
     except mysql.connector.Error as err:
         print(f"❌ Error SQL al actualizar flow_per_hour: {err}")
         print("  (Asegúrate de usar MySQL 8.0+ o MariaDB 10.2+ para la función LAG)")
@@ -94,14 +312,234 @@ def update_flow_per_hour(connection):
     finally:
         if cursor: cursor.close()
 
-def insert_processed_file(file_name, connection):
+def track_time_range(outcome, sensor_min_times, sensor_max_times):
+    """Acumula por sensor las fechas mínima y máxima insertadas (ventana de los cálculos incrementales)."""
+    if outcome['min_time'] is None: return
+    sensor_id = outcome['sensor_id']
+    sensor_min_times[sensor_id] = min(sensor_min_times.get(sensor_id, outcome['min_time']), outcome['min_time'])
+    sensor_max_times[sensor_id] = max(sensor_max_times.get(sensor_id, outcome['max_time']), outcome['max_time'])
+
+def update_flow_per_hour_incremental(sensor_min_times, connection, sensor_max_times=None):
+    """
+    Recalcula flow_per_hour solo para los datos nuevos de esta ejecución.
+
+    sensor_min_times / sensor_max_times: {sensor_id: 'YYYY-MM-DD HH:MM:SS'} con la fecha más antigua y
+    la más reciente insertadas por sensor. Por sensor, la ventana empieza en la última lectura anterior
+    a la mínima (ancla, ya calculada) y termina en la primera posterior a la máxima, así también se corrige
+    la lectura siguiente a datos que llegan tarde. Sin 'sensor_max_times' sigue hasta el final.
+    """
+    if connection is None or not connection.is_connected():
+        print("❌ Conexión BD no disponible (update_flow_per_hour_incremental).")
+        return
+    cursor = None
+    total_updated = 0
+    # Misma fórmula que update_flow_per_hour, restringida a un sensor y a un rango de tiempo
+    update_query = """
+    WITH SensorDataWithPrev AS (
+        SELECT
+            id,
+            time,
+            water_flow_value,
+            LAG(water_flow_value, 1, NULL) OVER (ORDER BY time) AS prev_water_flow_value
+        FROM sensor_data
+        WHERE sensor_id = %s AND time >= %s{window_end}
+    )
+    UPDATE sensor_data sd
+    JOIN SensorDataWithPrev sdwp ON sd.id = sdwp.id
+    SET sd.flow_per_hour =
+        CASE
+            WHEN sdwp.prev_water_flow_value IS NOT NULL AND sdwp.water_flow_value IS NOT NULL THEN
+                ROUND(sdwp.water_flow_value - sdwp.prev_water_flow_value, 2) -- Redondeado
+            ELSE NULL
+        END
+    WHERE sdwp.time >= %s;
+    """
+    sensor_max_times = sensor_max_times or {}
+    try:
+        cursor = connection.cursor()
+        print(f"⚙️ Calculando flow_per_hour incremental para {len(sensor_min_times)} sensor(es)...")
+        for sensor_id, min_time in sorted(sensor_min_times.items()):
+            # Ancla: última lectura previa a los datos nuevos (su flow_per_hour no cambia)
+            cursor.execute(
+                "SELECT MAX(time) FROM sensor_data WHERE sensor_id = %s AND time < %s",
+                (sensor_id, min_time)
+            )
+            anchor = cursor.fetchone()[0]
+            window_start = anchor if anchor is not None else min_time
+            window_end = None # Sin máxima: hasta el final
+            if sensor_max_times.get(sensor_id) is not None:
+                # Fin: primera lectura posterior a los datos nuevos (su valor previo pudo cambiar)
+                cursor.execute(
+                    "SELECT MIN(time) FROM sensor_data WHERE sensor_id = %s AND time > %s",
+                    (sensor_id, sensor_max_times[sensor_id])
+                )
+                next_time = cursor.fetchone()[0]
+                window_end = next_time if next_time is not None else sensor_max_times[sensor_id]
+            if window_end is None:
+                cursor.execute(update_query.format(window_end=""), (sensor_id, window_start, min_time))
+            else:
+                cursor.execute(update_query.format(window_end=" AND time <= %s"),
+                               (sensor_id, window_start, window_end, min_time))
+            total_updated += cursor.rowcount
+            bump_data_version(cursor, sensor_id)
+            connection.commit()
+        print(f"✅ {total_updated} filas actualizadas en flow_per_hour (incremental).")
+    except mysql.connector.Error as err:
+        print(f"❌ Error SQL al actualizar flow_per_hour incremental: {err}")
+        print("  (Ejecuta 'rebuild' para recalcular toda la tabla si el problema persiste)")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            pass
+    finally:
+        if cursor: cursor.close()
+
+# --- Tablas de Agregados (rollups por hora y por día) ---
+# Una fila por (sensor, intervalo) con suma de flow_per_hour, min/max/promedio de water_flow_value,
+# batería mínima y número de lecturas. Se mantienen tras cada carga solo para los intervalos afectados.
+
+ROLLUP_TABLES = {
+    'hour': ("sensor_data_hourly", "TIMESTAMP(DATE(time), MAKETIME(HOUR(time), 0, 0))"),
+    'day': ("sensor_data_daily", "DATE(time)"),
+}
+
+def _rollup_query(table, bucket_expr, where):
+    """INSERT ... SELECT que recalcula los intervalos de 'table' que cumplen 'where' sobre sensor_data."""
+    return f"""
+    INSERT INTO {table} (sensor_id, bucket, flow_sum, water_flow_min, water_flow_max,
+                         water_flow_avg, battery_min, samples)
+    SELECT sensor_id, {bucket_expr} AS bucket, SUM(flow_per_hour), MIN(water_flow_value),
+           MAX(water_flow_value), AVG(water_flow_value), MIN(battery), COUNT(*)
+    FROM sensor_data
+    WHERE {where}
+    GROUP BY sensor_id, bucket
+    ON DUPLICATE KEY UPDATE
+        flow_sum = VALUES(flow_sum), water_flow_min = VALUES(water_flow_min),
+        water_flow_max = VALUES(water_flow_max), water_flow_avg = VALUES(water_flow_avg),
+        battery_min = VALUES(battery_min), samples = VALUES(samples)
+    """
+
+def _as_datetime(value):
+    """'YYYY-MM-DD HH:MM:SS' (como se insertan las filas) o datetime (como lo devuelve MySQL) -> datetime."""
+    return value if isinstance(value, datetime) else datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+
+def _bucket_bounds(resolution, first, last):
+    """[inicio, fin) de los intervalos 'hour' o 'day' que cubren de 'first' a 'last'."""
+    if resolution == 'hour':
+        floor, step = (lambda t: t.replace(minute=0, second=0, microsecond=0)), timedelta(hours=1)
+    else:
+        floor, step = (lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0)), timedelta(days=1)
+    return floor(first), floor(last) + step
+
+def update_rollups_incremental(sensor_min_times, connection, sensor_max_times=None):
+    """
+    Recalcula los agregados por hora y día de los intervalos afectados por la carga.
+
+    Por sensor se recalculan los intervalos entre la fecha mínima y la máxima insertadas, más el de
+    la primera lectura posterior (su flow_per_hour, calculado con LAG, cambió). Sin 'sensor_max_times'
+    se recalcula desde el intervalo de la fecha mínima hasta el final.
+    """
+    if connection is None or not connection.is_connected():
+        print("❌ Conexión BD no disponible (update_rollups_incremental).")
+        return
+    if not sensor_min_times: return
+    sensor_max_times = sensor_max_times or {}
+    cursor = None
+    total_buckets = 0
+    try:
+        cursor = connection.cursor()
+        print(f"⚙️ Actualizando agregados por hora/día para {len(sensor_min_times)} sensor(es)...")
+        for sensor_id, min_time in sorted(sensor_min_times.items()):
+            last = None
+            if sensor_max_times.get(sensor_id) is not None:
+                cursor.execute("SELECT MIN(time) FROM sensor_data WHERE sensor_id = %s AND time > %s",
+                               (sensor_id, sensor_max_times[sensor_id]))
+                next_time = cursor.fetchone()[0]
+                last = _as_datetime(next_time if next_time is not None else sensor_max_times[sensor_id])
+            for resolution, (table, bucket_expr) in ROLLUP_TABLES.items():
+                # El filtro por time (y no por bucket) usa el índice (sensor_id, time); límites en intervalos completos
+                start, stop = _bucket_bounds(resolution, _as_datetime(min_time), last or _as_datetime(min_time))
+                if last is None:
+                    cursor.execute(_rollup_query(table, bucket_expr, "sensor_id = %s AND time >= %s"), (sensor_id, start))
+                else:
+                    cursor.execute(_rollup_query(table, bucket_expr, "sensor_id = %s AND time >= %s AND time < %s"),
+                                   (sensor_id, start, stop))
+                total_buckets += cursor.rowcount
+            bump_data_version(cursor, sensor_id)
+            connection.commit()
+        print(f"✅ Agregados actualizados ({total_buckets} filas afectadas).")
+    except mysql.connector.Error as err:
+        print(f"❌ Error SQL al actualizar agregados: {err}")
+        print("  (Ejecuta 'rebuild' para recalcular los agregados completos si el problema persiste)")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            pass
+    finally:
+        if cursor: cursor.close()
+
+def rebuild_rollups(connection):
+    """Vacía y recalcula por completo las tablas de agregados."""
+    if connection is None or not connection.is_connected():
+        print("❌ Conexión BD no disponible (rebuild_rollups).")
+        return
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        print("⚙️ Recalculando agregados por hora/día...")
+        for table, bucket_expr in ROLLUP_TABLES.values():
+            cursor.execute(f"DELETE FROM {table}")
+            cursor.execute(_rollup_query(table, bucket_expr, "1 = 1"))
+        bump_data_version(cursor)
+        connection.commit()
+        print("✅ Agregados recalculados.")
+    except mysql.connector.Error as err:
+        print(f"❌ Error SQL al recalcular agregados: {err}")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            pass
+    finally:
+        if cursor: cursor.close()
+
+def update_parquet_cache(sensor_min_times, connection, rebuild=False, sensor_max_times=None):
+    """
+    Copia a la caché Parquet local (cache_parquet.py) los días afectados por la carga, o toda la tabla con rebuild.
+    Va después de flow_per_hour y los agregados; un fallo aquí no afecta lo ya cargado en MySQL.
+    """
+    if not cache_parquet.habilitada():
+        print("ℹ️ pyarrow no está instalado: se omite la caché Parquet local.")
+        return
+    if connection is None or not connection.is_connected():
+        print("❌ Conexión BD no disponible (update_parquet_cache).")
+        return
+    try:
+        print(f"⚙️ Actualizando caché Parquet en {cache_parquet.CACHE_DIR}...")
+        if rebuild:
+            days = cache_parquet.reconstruir(connection)
+        else:
+            days = cache_parquet.actualizar_desde_bd(sensor_min_times, connection, sensor_max_times=sensor_max_times)
+        print(f"✅ Caché Parquet actualizada ({days} particiones diarias escritas).")
+    except Exception as err: # BD (iterar_lecturas la reenvía como Exception), Arrow o disco: la carga ya está en MySQL
+        print(f"❌ Error al actualizar la caché Parquet: {err}")
+        print("  (Ejecuta 'rebuild' para regenerarla completa si el problema persiste)")
+
+def _processed_file_marker(file_name, signature=None):
+    """Devuelve (query, params) para registrar un archivo; con firma actualiza tamaño/mtime si ya existía."""
+    if signature is not None:
+        return ("""
+        INSERT INTO processed_files (file_name, file_size, file_mtime) VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE file_size = VALUES(file_size), file_mtime = VALUES(file_mtime)
+        """, (file_name, signature[0], signature[1]))
+    return ("INSERT IGNORE INTO processed_files (file_name) VALUES (%s)", (file_name,))
+
+def insert_processed_file(file_name, connection, signature=None):
     """Registra un archivo como procesado en la tabla processed_files."""
     if connection is None: return
     cursor = None
     try:
         cursor = connection.cursor()
-        insert_query = "INSERT INTO processed_files (file_name) VALUES (%s)"
-        cursor.execute(insert_query, (file_name,))
+        cursor.execute(*_processed_file_marker(file_name, signature))
         connection.commit()
         # print(f"Archivo {file_name} registrado.") # Menos verboso
     except mysql.connector.Error as err:
@@ -112,133 +550,264 @@ def insert_processed_file(file_name, connection):
     finally:
         if cursor: cursor.close()
 
-def is_file_processed(file_name, connection):
-    """Verifica si un archivo ya fue registrado como procesado."""
-    if connection is None: return False # Asumir no procesado si no hay conexión
+def load_processed_files(connection):
+    """Carga processed_files en memoria de una sola vez: {file_name: (tamaño, mtime) o None}."""
+    processed = {}
+    if connection is None: return processed
     cursor = None
-    is_processed = False
     try:
         cursor = connection.cursor()
-        query = "SELECT 1 FROM processed_files WHERE file_name = %s LIMIT 1" # Más eficiente
-        cursor.execute(query, (file_name,))
-        is_processed = cursor.fetchone() is not None
+        # file_size/file_mtime los agrega la migración 2 (migraciones.py)
+        cursor.execute("SELECT file_name, file_size, file_mtime FROM processed_files")
+        for file_name, size, mtime in cursor:
+            processed[file_name] = (size, mtime) if size is not None else None
     except mysql.connector.Error as err:
-        print(f"❌ Error verificando archivo procesado {file_name}: {err}")
+        print(f"❌ Error cargando processed_files: {err}")
     finally:
         if cursor: cursor.close()
-    return is_processed
+    return processed
 
-def get_sensor_id(sensor_id, connection):
-    """Verifica si un ID de sensor existe en la tabla 'sensors'."""
-    if connection is None: return False
-    cursor = None
-    exists = False
-    try:
-        cursor = connection.cursor()
-        query = "SELECT 1 FROM sensors WHERE id = %s LIMIT 1"
-        cursor.execute(query, (sensor_id,))
-        exists = cursor.fetchone() is not None
-    except mysql.connector.Error as err:
-        print(f"❌ Error buscando sensor ID {sensor_id}: {err}")
-    finally:
-        if cursor: cursor.close()
-    return exists
+def write_prepared_file(file_name, result, sensor_id, registry, connection, batch_size=BATCH_SIZE, signature=None):
+    """
+    Escribe en la BD el resultado de prepare_file (único escritor) y reporta el estado del archivo.
 
-# --- Flujo Principal de Procesamiento ---
-if __name__ == "__main__":
-    print("--- Iniciando Carga de Datos CSV a BD ---")
-    conn = connect_to_database()
-    if conn is None:
-        exit(1) # Salir si no hay conexión
+    Devuelve {'marked': bool, 'inserted': n, 'min_time'/'max_time': fechas o None, 'sensor_id': id}:
+    'marked' indica si el archivo quedó registrado en processed_files.
+    """
+    outcome = {'marked': False, 'inserted': 0, 'min_time': None, 'max_time': None, 'sensor_id': sensor_id}
+    status = result['status']
 
-    processed_files_in_run = 0 # Contar archivos nuevos en esta ejecución
+    # Resultado de la lectura
+    if status == 'read_error':
+        print(f"  ❌ Error leyendo CSV {file_name}: {result['error']}. Omitiendo.")
+        return outcome
+    if status in ('empty_file', 'empty_csv'):
+        print("  ⚠️ Archivo vacío. Marcando como procesado." if status == 'empty_file'
+              else "  ⚠️ Archivo CSV sin datos. Marcando como procesado.")
+        insert_processed_file(file_name, connection, signature)
+        outcome['marked'] = True
+        return outcome
 
-    # Iterar sobre archivos en el directorio, ordenados por nombre
-    try:
-        # Usar list comprehension para filtrar solo CSV y luego ordenar
-        csv_files = sorted([f for f in os.listdir(CSV_DIRECTORY) if f.lower().endswith('.csv')])
-    except FileNotFoundError:
-        print(f"❌ Error: Directorio CSV no encontrado en '{CSV_DIRECTORY}'. Abortando.")
-        exit(1)
+    # Identificar sensor_id
+    if sensor_id is None: print(f"  ⚠️ Sensor no mapeado para {file_name}. Omitiendo."); return outcome
+    if not registry.is_valid(sensor_id): print(f"  ⚠️ Sensor ID {sensor_id} no existe en BD. Omitiendo."); return outcome
 
-    print(f"Encontrados {len(csv_files)} archivos CSV en {CSV_DIRECTORY}")
+    # Resultado de la preparación de fechas
+    if status == 'no_dates':
+        print(f"  ⚠️ Sin fechas válidas en {file_name}. Marcando como procesado.")
+        insert_processed_file(file_name, connection, signature)
+        outcome['marked'] = True
+        return outcome
+    if status == 'no_time_column': print(f"  ⚠️ Columna 'time' no encontrada en {file_name}. Omitiendo."); return outcome
+    if status == 'date_error': print(f"  ❌ Error preparando fecha en {file_name}: {result['error']}. Omitiendo."); return outcome
 
-    for file_name in csv_files:
-        file_path = os.path.join(CSV_DIRECTORY, file_name)
+    rows, bad_rows = result['rows'], result['bad_rows']
+    if bad_rows:
+        print(f"    ❌ {len(bad_rows)} filas con valores no numéricos omitidas en {file_name}: {bad_rows[:10]}{' ...' if len(bad_rows) > 10 else ''}")
 
-        # Omitir si ya fue procesado
-        if is_file_processed(file_name, conn):
-            continue
+    # Insertar el archivo completo (filas + marca de procesado) en una sola transacción
+    inserted = insert_file_chunks(file_name, [rows], connection, batch_size, signature)
+    if inserted is None:
+        print(f"  ⚠️ {file_name} no se marcó como procesado; se reintentará en la próxima ejecución.")
+        return outcome
+    outcome['marked'] = True
+    outcome['inserted'], outcome['min_time'], outcome['max_time'] = inserted
+    print(f"  -> {outcome['inserted']} filas insertadas.")
+    return outcome
 
-        print(f"\n-> Procesando: {file_name}")
+def filter_pending_files(csv_files, directory, processed, connection):
+    """
+    Filtra en memoria los archivos ya procesados. Devuelve [(nombre, firma), ...] pendientes.
 
-        # Validar y leer CSV
+    - Nombre conocido con la misma firma (o sin firma guardada): se omite.
+    - Nombre conocido con otro tamaño: reporte reenviado con cambios, se vuelve a procesar.
+    - Nombre nuevo con la firma exacta de otro archivo procesado: renombrado, se registra y se omite.
+    """
+    known_signatures = {sig for sig in processed.values() if sig is not None}
+    pending = []
+    for file_name in csv_files:
         try:
-            if os.path.getsize(file_path) == 0:
-                print("  ⚠️ Archivo vacío. Marcando como procesado.")
-                insert_processed_file(file_name, conn)
-                continue
-            df = pd.read_csv(file_path)
-            if df.empty:
-                print("  ⚠️ Archivo CSV sin datos. Marcando como procesado.")
-                insert_processed_file(file_name, conn)
+            signature = file_signature(os.path.join(directory, file_name))
+        except OSError:
+            signature = None
+        if file_name in processed:
+            stored = processed[file_name]
+            if stored is None or signature is None or stored[0] == signature[0]:
                 continue
-        except Exception as read_err:
-            print(f"  ❌ Error leyendo CSV {file_name}: {read_err}. Omitiendo.")
-            continue # Saltar al siguiente archivo
-
-        # Limpiar columnas sin nombre (comunes en algunos CSV)
-        df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-
-        # Identificar sensor_id
-        sensor_id = None
-        for pattern, id_val in SENSOR_MAPPING.items():
-            if re.match(pattern, file_name, re.IGNORECASE): # Ignorar mayúsculas/minúsculas
-                sensor_id = id_val
-                break
-        if sensor_id is None: print(f"  ⚠️ Sensor no mapeado para {file_name}. Omitiendo."); continue
-        if not get_sensor_id(sensor_id, conn): print(f"  ⚠️ Sensor ID {sensor_id} no existe en BD. Omitiendo."); continue
-
-        # Preparar columna de fecha y ordenar
+            print(f"  ℹ️ {file_name} cambió de tamaño desde que se procesó; se procesará de nuevo.")
+        elif signature in known_signatures:
+            print(f"  ℹ️ {file_name} es una copia renombrada de un archivo ya procesado. Registrando y omitiendo.")
+            insert_processed_file(file_name, connection, signature)
+            processed[file_name] = signature
+            continue
+        pending.append((file_name, signature))
+    return pending
+
+def stream_pending_file(file_name, file_path, sensor_id, registry, connection, chunk_size=CHUNK_SIZE,
+                        batch_size=BATCH_SIZE, signature=None):
+    """Modo streaming de un archivo pendiente. Devuelve el mismo dict que write_prepared_file."""
+    outcome = {'marked': False, 'inserted': 0, 'min_time': None, 'max_time': None, 'sensor_id': sensor_id}
+    try:
+        if os.path.getsize(file_path) == 0:
+            print("  ⚠️ Archivo vacío. Marcando como procesado.")
+            insert_processed_file(file_name, connection, signature)
+            outcome['marked'] = True
+            return outcome
+    except OSError as read_err:
+        print(f"  ❌ Error leyendo CSV {file_name}: {read_err}. Omitiendo.")
+        return outcome
+    if sensor_id is None: print(f"  ⚠️ Sensor no mapeado para {file_name}. Omitiendo."); return outcome
+    if not registry.is_valid(sensor_id): print(f"  ⚠️ Sensor ID {sensor_id} no existe en BD. Omitiendo."); return outcome
+
+    result = stream_file(file_path, file_name, sensor_id, connection, chunk_size, batch_size, signature)
+    status = result['status']
+    if status == 'read_error': print(f"  ❌ Error leyendo CSV {file_name}: {result['error']}. Omitiendo."); return outcome
+    if status == 'no_time_column': print(f"  ⚠️ Columna 'time' no encontrada en {file_name}. Omitiendo."); return outcome
+    if status == 'insert_error':
+        print(f"  ⚠️ {file_name} no se marcó como procesado; se reintentará en la próxima ejecución.")
+        return outcome
+    outcome['marked'] = True
+    if status == 'empty_csv': print("  ⚠️ Archivo CSV sin datos. Marcado como procesado."); return outcome
+    if status == 'no_dates': print(f"  ⚠️ Sin fechas válidas en {file_name}. Marcado como procesado."); return outcome
+    bad_rows = result['bad_rows']
+    if bad_rows:
+        print(f"    ❌ {len(bad_rows)} filas con valores no numéricos omitidas en {file_name}: {bad_rows[:10]}{' ...' if len(bad_rows) > 10 else ''}")
+    print(f"  -> {result['inserted']} filas insertadas.")
+    outcome['inserted'], outcome['min_time'], outcome['max_time'] = result['inserted'], result['min_time'], result['max_time']
+    return outcome
+
+# --- Flujo Principal de Procesamiento ---
+
+def ingest_directory(directory=CSV_DIRECTORY, connection=None, progress_cb=None, batch_size=BATCH_SIZE,
+                     workers=WORKERS, stream=False, chunk_size=CHUNK_SIZE):
+    """
+    Carga a la BD los CSV pendientes de 'directory' y actualiza flow_per_hour y los agregados.
+
+    'connection' puede ser una conexión del pool (no se cierra); sin ella se abre y cierra una propia.
+    progress_cb(hechos, total, file_name) se llama tras cada archivo; si lanza una excepción
+    (p. ej. cancelación) la carga se detiene, pero lo ya insertado se deja con flow_per_hour al día.
+
+    Devuelve estadísticas: archivos encontrados / pendientes / procesados, filas, archivos con error,
+    sensores con datos nuevos y segundos por fase.
+    """
+    start = time.perf_counter()
+    stats = {'files_found': 0, 'files_pending': 0, 'files_processed': 0, 'rows': 0,
+             'errors': [], 'sensors': [], 'timings': {}}
+    own_connection = connection is None
+    conn = connect_to_database() if own_connection else connection
+    if conn is None:
+        raise ConnectionError("Sin conexión a la BD.")
+    try:
         try:
-            df['time_dt'] = pd.to_datetime(df['time'], format="%a, %d %b %Y %H:%M:%S", errors='coerce')
-            df = df.dropna(subset=['time_dt'])
-            df = df.sort_values(by='time_dt')
-            if df.empty: print(f"  ⚠️ Sin fechas válidas en {file_name}. Marcando como procesado."); insert_processed_file(file_name, conn); continue
-        except KeyError: print(f"  ⚠️ Columna 'time' no encontrada en {file_name}. Omitiendo."); continue
-        except Exception as sort_err: print(f"  ❌ Error preparando fecha en {file_name}: {sort_err}. Omitiendo."); continue
-
-        # Insertar filas
-        rows_inserted_count = 0
-        for index, row in df.iterrows():
-            try:
-                fecha_sql = row['time_dt'].strftime("%Y-%m-%d %H:%M:%S")
-                wfv = row.get('Water Flow Value'); total_p = row.get('Total Pulse')
-                last_p = row.get('Last Pulse'); batt = row.get('Battery')
-                # Conversión segura a tipos numéricos, manejando None
-                wfv = None if pd.isna(wfv) else float(wfv)
-                total_p = None if pd.isna(total_p) else int(float(total_p))
-                last_p = None if pd.isna(last_p) else int(float(last_p))
-                batt = None if pd.isna(batt) else float(batt)
-
-                insert_data_to_table(sensor_id, fecha_sql, wfv, total_p, last_p, batt, conn)
-                rows_inserted_count += 1
-            except Exception as row_err:
-                print(f"    ❌ Error procesando fila {index} de {file_name}: {row_err}")
-
-        print(f"  -> {rows_inserted_count} filas insertadas.")
-        insert_processed_file(file_name, conn) # Marcar archivo como procesado
-        processed_files_in_run += rows_inserted_count # Contar filas en lugar de archivos para la actualización
-
-    # --- Actualizar flow_per_hour al final si se insertaron filas ---
-    if processed_files_in_run > 0:
-        print("\n--- Ejecutando actualización final de flow_per_hour ---")
-        update_flow_per_hour(conn)
-    else:
-        print("\n--- No se insertaron filas nuevas, omitiendo actualización de flow_per_hour ---")
+            # Listar CSV del directorio, ordenados por nombre
+            csv_files = sorted([f for f in os.listdir(directory) if f.lower().endswith('.csv')])
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Directorio CSV no encontrado en '{directory}'.")
+        stats['files_found'] = len(csv_files)
+        print(f"Encontrados {len(csv_files)} archivos CSV en {directory}")
 
-    # Cerrar conexión
-    if conn and conn.is_connected():
+        # Cargar de una vez lo ya procesado y los sensores válidos; el filtrado se hace en memoria
+        processed = load_processed_files(conn)
+        registry = sensores.get_registry(conn, refresh=True) # IDs válidos + regex de archivos compilado
+        pending = filter_pending_files(csv_files, directory, processed, conn)
+        pending_files = [file_name for file_name, _ in pending]
+        signatures = dict(pending)
+        stats['files_pending'] = len(pending_files)
+        stats['timings']['discovery'] = round(time.perf_counter() - start, 3)
+        print(f"{len(pending_files)} archivos pendientes ({len(csv_files) - len(pending_files)} ya procesados).")
+
+        sensor_min_times = {} # Fechas mínima y máxima insertadas por sensor (para el cálculo incremental)
+        sensor_max_times = {}
+        t0 = time.perf_counter()
+        try:
+            if not stream:
+                # El parseo puede correr en paralelo, la BD la maneja solo este proceso
+                tasks = [(os.path.join(directory, f), f, registry.match(f)) for f in pending_files]
+                if workers > 1:
+                    print(f"Procesando {len(tasks)} archivos pendientes con {workers} procesos.")
+                results = iter_prepared_files(tasks, workers)
+            for done, file_name in enumerate(pending_files, start=1):
+                sensor_id = registry.match(file_name)
+                if stream:
+                    # Modo streaming: un archivo a la vez, bloque a bloque directo a la BD
+                    print(f"\n-> Procesando (stream): {file_name}")
+                    outcome = stream_pending_file(file_name, os.path.join(directory, file_name), sensor_id, registry, conn,
+                                                  chunk_size, batch_size, signatures.get(file_name))
+                else:
+                    result = next(results)
+                    print(f"\n-> Procesando: {file_name}")
+                    outcome = write_prepared_file(file_name, result, sensor_id, registry, conn, batch_size, signatures.get(file_name))
+                if outcome['marked']:
+                    processed[file_name] = signatures.get(file_name)
+                    stats['files_processed'] += 1
+                else:
+                    stats['errors'].append(file_name)
+                stats['rows'] += outcome['inserted']
+                track_time_range(outcome, sensor_min_times, sensor_max_times)
+                if progress_cb: progress_cb(done, len(pending_files), file_name)
+        finally:
+            stats['timings']['files'] = round(time.perf_counter() - t0, 3)
+            # --- Actualizar flow_per_hour al final si se insertaron filas (también si se interrumpió) ---
+            t0 = time.perf_counter()
+            if stats['rows'] > 0:
+                print("\n--- Ejecutando actualización incremental de flow_per_hour ---")
+                update_flow_per_hour_incremental(sensor_min_times, conn, sensor_max_times)
+                update_rollups_incremental(sensor_min_times, conn, sensor_max_times)
+                stats['timings']['flow_update'] = round(time.perf_counter() - t0, 3)
+                t0 = time.perf_counter()
+                update_parquet_cache(sensor_min_times, conn, sensor_max_times=sensor_max_times)
+                stats['timings']['parquet_cache'] = round(time.perf_counter() - t0, 3)
+            else:
+                print("\n--- No se insertaron filas nuevas, omitiendo actualización de flow_per_hour ---")
+                stats['timings']['flow_update'] = round(time.perf_counter() - t0, 3)
+            stats['sensors'] = sorted(sensor_min_times)
+            stats['seconds'] = round(time.perf_counter() - start, 3)
+    finally:
+        if own_connection and conn.is_connected():
+            conn.close()
+            print("Conexión a BD cerrada.")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga reportes CSV de sensores a la BD MySQL.")
+    parser.add_argument("accion", nargs="?", choices=["cargar", "rebuild"], default="cargar",
+                        help="'cargar' (default) procesa CSV nuevos; 'rebuild' recalcula flow_per_hour, los agregados y la caché Parquet en toda la tabla")
+    parser.add_argument("--directory", default=CSV_DIRECTORY, help="Directorio con los CSV (default: CSV_DIRECTORY)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"Filas por INSERT multi-fila (default: {BATCH_SIZE})")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help=f"Procesos para leer/limpiar CSV en paralelo (default: {WORKERS})")
+    parser.add_argument("--stream", action="store_true",
+                        help="Leer cada CSV por bloques e insertarlos directo (memoria acotada; ignora --workers)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help=f"Filas por bloque en modo --stream (default: {CHUNK_SIZE})")
+    args = parser.parse_args()
+
+    print("--- Iniciando Carga de Datos CSV a BD ---")
+    conn = connect_to_database()
+    if conn is None:
+        exit(1) # Salir si no hay conexión
+    if not migraciones.migrar(conn): # Tablas, clave única (sensor_id, time) y agregados
+        print("⚠️ El esquema no está al día; se continúa con el existente.")
+
+    if args.accion == "rebuild":
+        print("--- Recalculando flow_per_hour en toda la tabla ---")
+        update_flow_per_hour(conn)
+        rebuild_rollups(conn)
+        update_parquet_cache(None, conn, rebuild=True)
         conn.close()
-        print("Conexión a BD cerrada.")
-    print("--- Proceso de Carga Finalizado ---")
\ No newline at end of file
+        print("--- Proceso de Recalculo Finalizado ---")
+        exit(0)
+
+    try:
+        stats = ingest_directory(args.directory, conn, batch_size=args.batch_size, workers=args.workers,
+                                 stream=args.stream, chunk_size=args.chunk_size)
+    except FileNotFoundError as err:
+        print(f"❌ Error: {err} Abortando.")
+        exit(1)
+    finally:
+        if conn.is_connected():
+            conn.close()
+            print("Conexión a BD cerrada.")
+    print(f"--- Proceso de Carga Finalizado: {stats['files_processed']} archivos, {stats['rows']} filas, "
+          f"{len(stats['errors'])} con error, {stats['seconds']}s ---")
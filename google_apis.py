@@ -2,23 +2,91 @@
 
 import os
 import datetime
+import threading
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document, DISCOVERY_URI, V2_DISCOVERY_URI
+from googleapiclient.http import build_http
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 
 # --- Constantes Globales ---
 TOKEN_DIR = 'token files' # Directorio para guardar tokens
+REFRESH_MARGIN = datetime.timedelta(minutes=5) # Refrescar el token si vence antes de este margen
 
-def create_service(client_secret_file, api_name, api_version, *scopes):
+# Caché en memoria: (api, versión, scopes) -> {'creds': Credentials, 'service': Resource compartido o None}
+_SERVICE_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+def _discovery_file(api_name, api_version):
+    return os.path.join(TOKEN_DIR, f'discovery_{api_name}_{api_version}.json')
+
+def _build_service(api_name, api_version, creds):
+    """
+    Construye el cliente sin descargar el documento de descubrimiento si se puede:
+    1) copia local en TOKEN_DIR, 2) documento incluido en googleapiclient (static_discovery),
+    3) descarga por red, guardando la copia local para la próxima vez.
+    """
+    discovery_file = _discovery_file(api_name, api_version)
+    if os.path.exists(discovery_file):
+        try:
+            with open(discovery_file, encoding='utf-8') as f:
+                return build_from_document(f.read(), credentials=creds)
+        except Exception as e:
+            print(f"⚠️ Documento de descubrimiento local inválido ({e}); se reconstruirá.")
+    try:
+        return build(api_name, api_version, credentials=creds, static_discovery=True)
+    except Exception:
+        pass # Versión de googleapiclient sin documentos estáticos para esta API
+    content = _fetch_discovery_document(api_name, api_version)
+    service = build_from_document(content, credentials=creds)
+    try:
+        os.makedirs(TOKEN_DIR, exist_ok=True)
+        with open(discovery_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+    except Exception as e:
+        print(f"⚠️ No se pudo guardar el documento de descubrimiento: {e}")
+    return service
+
+def _fetch_discovery_document(api_name, api_version):
+    """Descarga el documento de descubrimiento (JSON en texto) de las mismas URLs que usa build()."""
+    http = build_http()
+    for uri in (DISCOVERY_URI, V2_DISCOVERY_URI):
+        resp, content = http.request(uri.format(api=api_name, apiVersion=api_version))
+        if resp.status < 400:
+            return content.decode('utf-8') if isinstance(content, bytes) else content
+    raise Exception(f"No se pudo descargar el documento de descubrimiento de {api_name} {api_version} (HTTP {resp.status})")
+
+def _expires_soon(creds):
+    """True si el token vence dentro de REFRESH_MARGIN (expiry de google-auth es UTC sin zona)."""
+    if creds is None or not creds.expiry: return False
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now < REFRESH_MARGIN
+
+def _save_token(token_file, creds):
+    """Guarda el token en disco; devuelve True si se pudo."""
+    try:
+        os.makedirs(TOKEN_DIR, exist_ok=True) # Crear directorio si no existe
+        with open(token_file, 'w') as token:
+            token.write(creds.to_json())
+        return True
+    except Exception as e:
+        print(f"❌ Error al guardar token en {token_file}: {e}")
+        return False
+
+def create_service(client_secret_file, api_name, api_version, *scopes, shared=True):
     """
     Crea o refresca credenciales y construye el objeto de servicio para una Google API.
 
+    Las credenciales y el cliente quedan en caché por (api, versión, scopes): llamadas repetidas
+    en la misma sesión no releen el token ni vuelven a construir el cliente. El token se refresca
+    antes de vencer (REFRESH_MARGIN).
+
     Args:
         client_secret_file (str): Ruta al archivo JSON de credenciales del cliente.
         api_name (str): Nombre de la API (ej. 'gmail').
         api_version (str): Versión de la API (ej. 'v1').
         *scopes: Lista de scopes (permisos) requeridos.
+        shared (bool): False para obtener un cliente nuevo (p. ej. uno por hilo) reutilizando las credenciales.
 
     Returns:
         googleapiclient.discovery.Resource: Objeto de servicio de la API o None si falla.
@@ -28,6 +96,31 @@ def create_service(client_secret_file, api_name, api_version, *scopes):
     API_VERSION = api_version
     SCOPES = [scope for scope in scopes[0]] # Asegurar que scopes sea una lista
     TOKEN_FILE = os.path.join(TOKEN_DIR, f'token_{api_name}_{api_version}.json')
+    cache_key = (api_name, api_version, tuple(sorted(SCOPES)))
+
+    # --- Caché en memoria ---
+    with _CACHE_LOCK:
+        cached = _SERVICE_CACHE.get(cache_key)
+        if cached:
+            creds = cached['creds']
+            if creds.refresh_token and (not creds.valid or _expires_soon(creds)):
+                try:
+                    creds.refresh(Request()) # Refresco proactivo; el cliente en caché usa este mismo objeto
+                    _save_token(TOKEN_FILE, creds)
+                except Exception as e:
+                    print(f"❌ Error al refrescar token: {e}. Se requerirá nuevo login.")
+                    _SERVICE_CACHE.pop(cache_key, None)
+                    cached = None
+            if cached and creds.valid:
+                if shared and cached['service'] is not None:
+                    return cached['service']
+                try:
+                    service = _build_service(API_SERVICE_NAME, API_VERSION, creds)
+                except Exception as e:
+                    print(f"❌ Error al crear el servicio {API_SERVICE_NAME}: {e}")
+                    return None
+                if shared: cached['service'] = service
+                return service
 
     creds = None
 
@@ -39,8 +132,8 @@ def create_service(client_secret_file, api_name, api_version, *scopes):
             print(f"❌ Error al cargar token desde {TOKEN_FILE}: {e}")
 
     # Si no hay credenciales válidas o expiraron (y se puede refrescar)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    if not creds or not creds.valid or _expires_soon(creds):
+        if creds and creds.refresh_token and (creds.expired or _expires_soon(creds)):
             try:
                 print(f"Refrescando token para {api_name}...")
                 creds.refresh(Request())
@@ -59,20 +152,21 @@ def create_service(client_secret_file, api_name, api_version, *scopes):
                 return None
 
         # --- Guardado de Token ---
-        try:
-            os.makedirs(TOKEN_DIR, exist_ok=True) # Crear directorio si no existe
-            with open(TOKEN_FILE, 'w') as token:
-                token.write(creds.to_json())
-                print(f"✅ Token guardado/actualizado en: {TOKEN_FILE}")
-        except Exception as e:
-            print(f"❌ Error al guardar token en {TOKEN_FILE}: {e}")
-            # No retornar None aquí, intentar crear el servicio de todas formas
+        # Si falla no se retorna None: se intenta crear el servicio de todas formas
+        if _save_token(TOKEN_FILE, creds):
+            print(f"✅ Token guardado/actualizado en: {TOKEN_FILE}")
 
     # --- Creación del Servicio de API ---
     try:
         print(f"Creando servicio para {API_SERVICE_NAME} v{API_VERSION}...")
-        service = build(API_SERVICE_NAME, API_VERSION, credentials=creds)
+        service = _build_service(API_SERVICE_NAME, API_VERSION, creds)
         print(f"✅ Servicio {API_SERVICE_NAME} creado con éxito.")
+        with _CACHE_LOCK:
+            # Un cliente no compartido es de un solo hilo: se guardan sus credenciales, no el cliente
+            if shared:
+                _SERVICE_CACHE[cache_key] = {'creds': creds, 'service': service}
+            elif cache_key not in _SERVICE_CACHE:
+                _SERVICE_CACHE[cache_key] = {'creds': creds, 'service': None}
         return service
     except Exception as e:
         print(f"❌ Error al crear el servicio {API_SERVICE_NAME}: {e}")
@@ -0,0 +1,268 @@
+# Gráfica de series de tiempo de un sensor sobre un tk.Canvas (sin matplotlib).
+# Cada vista pide a la BD solo el rango visible y a la resolución adecuada (lecturas crudas o
+# agregados por hora/día), y reduce cada serie a ~1 punto por píxel con LTTB antes de dibujar.
+
+import tkinter as tk
+from datetime import datetime, date
+
+# --- Configuración ---
+MAX_PUNTOS_CRUDOS = 50000 # Por encima de esto se usan los agregados en lugar de las lecturas
+MARGENES = (80, 20, 10, 30) # izquierda, derecha, arriba, abajo (px)
+ZOOM = 1.5 # Factor por paso de la rueda
+ESPERA_MS = 250 # Pausa tras el último zoom/arrastre antes de volver a consultar
+COLORES = ["#6A0035", "#1F5F8B", "#2E7D32"]
+
+# Series por resolución: (título, índice de columna en iterar_lecturas o clave en los agregados)
+SERIES_CRUDAS = [("flow_per_hour", 5), ("water_flow_value", 3), ("battery", 7)]
+SERIES_AGREGADAS = [("flow_sum", 'flow_sum'), ("water_flow_avg", 'water_flow_avg'), ("battery_min", 'battery_min')]
+
+# --- Reducción de puntos ---
+
+def lttb(xs, ys, umbral):
+    """
+    Largest-Triangle-Three-Buckets: reduce (xs, ys) a 'umbral' puntos conservando la forma de la curva.
+    Por cada cubeta elige el punto que forma el triángulo más grande con el elegido antes y
+    el promedio de la cubeta siguiente. O(n), sin dependencias.
+    """
+    n = len(xs)
+    if umbral >= n or umbral < 3:
+        return list(xs), list(ys)
+    salida_x, salida_y = [xs[0]], [ys[0]]
+    ancho = (n - 2) / (umbral - 2)
+    anterior = 0
+    for i in range(umbral - 2):
+        ini = int(i * ancho) + 1
+        fin = int((i + 1) * ancho) + 1
+        sig_ini, sig_fin = fin, min(int((i + 2) * ancho) + 1, n)
+        cuenta = max(1, sig_fin - sig_ini)
+        prom_x = sum(xs[sig_ini:sig_fin]) / cuenta if sig_ini < n else xs[-1]
+        prom_y = sum(ys[sig_ini:sig_fin]) / cuenta if sig_ini < n else ys[-1]
+        ax, ay = xs[anterior], ys[anterior]
+        elegido, area_max = ini, -1.0
+        for j in range(ini, fin):
+            area = abs((ax - prom_x) * (ys[j] - ay) - (ax - xs[j]) * (prom_y - ay))
+            if area > area_max:
+                area_max, elegido = area, j
+        salida_x.append(xs[elegido]); salida_y.append(ys[elegido])
+        anterior = elegido
+    salida_x.append(xs[-1]); salida_y.append(ys[-1])
+    return salida_x, salida_y
+
+def _segundos(valor):
+    """datetime o date (agregado diario) -> segundos desde epoch."""
+    if not isinstance(valor, datetime) and isinstance(valor, date):
+        valor = datetime(valor.year, valor.month, valor.day)
+    return valor.timestamp()
+
+# --- Consulta (solo BD, se puede correr en un hilo) ---
+
+def consultar_series(sensor_id, conn, inicio, fin, puntos, max_crudos=MAX_PUNTOS_CRUDOS):
+    """
+    Series del sensor en [inicio, fin) reducidas a 'puntos' por serie.
+
+    Si el rango tiene más de 'max_crudos' lecturas se usan los agregados por hora
+    (o por día si ni así caben). Devuelve (resolución, {título: (xs, ys)}).
+    """
+    from consultas import contar_filas_sensor, iterar_lecturas, consultar_agregados # mysql.connector fuera del arranque
+    if contar_filas_sensor(sensor_id, conn, inicio, fin) <= max_crudos:
+        resolucion, nombres = "crudo", SERIES_CRUDAS
+        crudas = {titulo: ([], []) for titulo, _ in nombres}
+        for filas in iterar_lecturas(sensor_id, conn, inicio, fin):
+            for fila in filas:
+                x = _segundos(fila[2])
+                for titulo, columna in nombres:
+                    if fila[columna] is not None:
+                        crudas[titulo][0].append(x); crudas[titulo][1].append(float(fila[columna]))
+    else:
+        horas = (fin - inicio).total_seconds() / 3600 if inicio and fin else None
+        resolucion = 'hora' if horas is not None and horas <= max_crudos else 'dia'
+        nombres = SERIES_AGREGADAS
+        crudas = {titulo: ([], []) for titulo, _ in nombres}
+        for fila in consultar_agregados(sensor_id, conn, resolucion, inicio, fin):
+            x = _segundos(fila['bucket'])
+            for titulo, clave in nombres:
+                if fila[clave] is not None:
+                    crudas[titulo][0].append(x); crudas[titulo][1].append(float(fila[clave]))
+    return resolucion, {titulo: lttb(xs, ys, puntos) for titulo, (xs, ys) in crudas.items()}
+
+def rango_sensor(sensor_id, conn):
+    """(primera, última) lectura del sensor, o (None, None) si no tiene datos."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MIN(time), MAX(time) FROM sensor_data WHERE sensor_id = %s", (sensor_id,))
+        return tuple(cursor.fetchone())
+    finally:
+        cursor.close()
+
+# --- Widget ---
+
+class GraficaSensor:
+    """
+    Canvas con una banda por serie y eje de tiempo compartido. Rueda = zoom, arrastre = desplazar.
+
+    ejecutar(nombre, funcion, al_terminar, al_error): lanza funcion(tarea) en segundo plano
+    (GestorTareas.ejecutar); obtener_conexion(): conexión del pool.
+    """
+
+    def __init__(self, parent, obtener_conexion, ejecutar, al_error=None):
+        self.canvas = tk.Canvas(parent, bg="white", highlightthickness=0)
+        self.obtener_conexion = obtener_conexion
+        self.ejecutar = ejecutar
+        self.al_error = al_error or (lambda mensaje: print(f"Error en gráfica: {mensaje}"))
+        self.sensor_id = None
+        self.limites = (None, None) # Rango completo permitido (segundos)
+        self.vista = (None, None) # Rango visible (segundos)
+        self.series = {}; self.resolucion = None
+        self._arrastre = None; self._espera = None
+        self._carga = 0 # Sube con cada cargar(): descarta respuestas de una selección anterior
+
+        self.canvas.bind("<Configure>", lambda e: self._dibujar())
+        self.canvas.bind("<MouseWheel>", lambda e: self._zoom(e.x, 1 / ZOOM if e.delta > 0 else ZOOM))
+        self.canvas.bind("<Button-4>", lambda e: self._zoom(e.x, 1 / ZOOM)) # Linux
+        self.canvas.bind("<Button-5>", lambda e: self._zoom(e.x, ZOOM))
+        self.canvas.bind("<ButtonPress-1>", self._inicio_arrastre)
+        self.canvas.bind("<B1-Motion>", self._mover_arrastre)
+        self.canvas.bind("<ButtonRelease-1>", self._fin_arrastre)
+
+    def pack(self, **kwargs):
+        self.canvas.pack(**kwargs)
+
+    # --- API pública ---
+    def cargar(self, sensor_id, inicio=None, fin=None):
+        """Muestra un sensor en [inicio, fin) (datetime o None = desde la primera / hasta la última lectura)."""
+        self.sensor_id = sensor_id
+        self.series = {}; self.vista = (None, None); self.limites = (None, None)
+        self._carga += 1
+        self._dibujar("Cargando...")
+        self._lanzar_carga(self._carga, sensor_id, inicio, fin)
+
+    def _lanzar_carga(self, carga, sensor_id, inicio, fin):
+        if carga != self._carga: return # Se eligió otro sensor mientras se esperaba
+        def trabajo(tarea):
+            conn = self.obtener_conexion()
+            tarea.registrar_conexion(conn)
+            try:
+                primera, ultima = rango_sensor(sensor_id, conn)
+            finally:
+                conn.close()
+            if primera is None: return None
+            desde = inicio or primera
+            hasta = fin or ultima
+            return _segundos(desde), _segundos(hasta) + 1 # +1 s: 'fin' es exclusivo
+        def terminado(limites):
+            if carga != self._carga: return # Respuesta de una selección anterior
+            if limites is None:
+                self._dibujar("Sin datos para este sensor."); return
+            self.limites = limites
+            self.vista = limites
+            self._consultar()
+        if self.ejecutar("Gráfica", trabajo, terminado, self.al_error) is None:
+            # Sigue en curso una consulta anterior de la gráfica: se reintenta al rato
+            self.canvas.after(ESPERA_MS, lambda: self._lanzar_carga(carga, sensor_id, inicio, fin))
+
+    def reiniciar(self):
+        """Vuelve al rango completo."""
+        if self.limites[0] is None: return
+        self.vista = self.limites
+        self._programar()
+
+    # --- Zoom y desplazamiento ---
+    def _ancho_util(self):
+        return max(10, self.canvas.winfo_width() - MARGENES[0] - MARGENES[1])
+
+    def _x_a_t(self, x):
+        inicio, fin = self.vista
+        return inicio + (x - MARGENES[0]) / self._ancho_util() * (fin - inicio)
+
+    def _fijar_vista(self, inicio, fin):
+        """Acota la vista a los límites del sensor conservando su ancho."""
+        ancho = min(fin - inicio, self.limites[1] - self.limites[0])
+        inicio = max(self.limites[0], min(inicio, self.limites[1] - ancho))
+        self.vista = (inicio, inicio + ancho)
+
+    def _zoom(self, x, factor):
+        if self.vista[0] is None: return
+        centro = self._x_a_t(x)
+        inicio, fin = self.vista
+        # Mínimo un minuto visible, máximo todo el rango; el punto bajo el cursor queda fijo
+        nuevo_ancho = min(self.limites[1] - self.limites[0], max(60.0, (fin - inicio) * factor))
+        nuevo_inicio = centro - (centro - inicio) * nuevo_ancho / (fin - inicio)
+        self._fijar_vista(nuevo_inicio, nuevo_inicio + nuevo_ancho)
+        self._dibujar() # Mientras tanto se redibuja lo que ya hay con la nueva escala
+        self._programar()
+
+    def _inicio_arrastre(self, event):
+        self._arrastre = (event.x, self.vista)
+
+    def _mover_arrastre(self, event):
+        if self._arrastre is None or self.vista[0] is None: return
+        x0, (inicio, fin) = self._arrastre
+        desplazamiento = -(event.x - x0) / self._ancho_util() * (fin - inicio)
+        self._fijar_vista(inicio + desplazamiento, fin + desplazamiento)
+        self._dibujar()
+
+    def _fin_arrastre(self, event):
+        if self._arrastre is not None and self.vista != self._arrastre[1]:
+            self._programar()
+        self._arrastre = None
+
+    def _programar(self):
+        """Consulta la vista actual tras ESPERA_MS sin más cambios (agrupa pasos de rueda/arrastre)."""
+        if self._espera is not None: self.canvas.after_cancel(self._espera)
+        self._espera = self.canvas.after(ESPERA_MS, self._consultar)
+
+    # --- Consulta de la vista visible ---
+    def _consultar(self):
+        self._espera = None
+        if self.sensor_id is None or self.vista[0] is None: return
+        sensor_id, vista, puntos, carga = self.sensor_id, self.vista, self._ancho_util(), self._carga
+        def trabajo(tarea):
+            conn = self.obtener_conexion()
+            tarea.registrar_conexion(conn)
+            try:
+                tarea.progreso("consultando rango visible...")
+                return vista, consultar_series(sensor_id, conn, datetime.fromtimestamp(vista[0]),
+                                               datetime.fromtimestamp(vista[1]), puntos)
+            finally:
+                conn.close()
+        def terminado(resultado):
+            if carga != self._carga: return # Se cambió de sensor mientras se consultaba
+            consultada, (self.resolucion, self.series) = resultado
+            self._dibujar()
+            if consultada != self.vista: self._consultar() # La vista cambió mientras se consultaba
+        if self.ejecutar("Gráfica", trabajo, terminado, self.al_error) is None:
+            self._programar() # Ya hay una consulta de la gráfica en curso: se reintenta al rato
+
+    # --- Dibujo ---
+    def _dibujar(self, mensaje=None):
+        c = self.canvas
+        c.delete("all")
+        ancho, alto = c.winfo_width(), c.winfo_height()
+        izq, der, arriba, abajo = MARGENES
+        if mensaje or not self.series or self.vista[0] is None:
+            c.create_text(ancho // 2, alto // 2, text=mensaje or "Selecciona un sensor y pulsa Graficar.", fill="#777777")
+            return
+        inicio, fin = self.vista
+        util_x = self._ancho_util()
+        banda = max(20, (alto - arriba - abajo) // len(self.series))
+        for k, (titulo, (xs, ys)) in enumerate(self.series.items()):
+            y0 = arriba + k * banda; y1 = y0 + banda - 15
+            c.create_rectangle(izq, y0, izq + util_x, y1, outline="#DDDDDD")
+            c.create_text(izq + 5, y0 + 2, text=titulo, anchor="nw", fill=COLORES[k % len(COLORES)], font=("Segoe UI", 9, "bold"))
+            visibles = [(x, y) for x, y in zip(xs, ys) if inicio <= x <= fin]
+            if not visibles: continue
+            minimo = min(y for _, y in visibles); maximo = max(y for _, y in visibles)
+            rango = (maximo - minimo) or 1.0
+            c.create_text(izq - 5, y0, text=f"{maximo:.2f}", anchor="ne", font=("Segoe UI", 8))
+            c.create_text(izq - 5, y1, text=f"{minimo:.2f}", anchor="se", font=("Segoe UI", 8))
+            puntos = []
+            for x, y in visibles:
+                puntos += [izq + (x - inicio) / (fin - inicio) * util_x, y1 - (y - minimo) / rango * (y1 - y0)]
+            if len(puntos) >= 4:
+                c.create_line(*puntos, fill=COLORES[k % len(COLORES)], width=1)
+            else:
+                c.create_oval(puntos[0] - 2, puntos[1] - 2, puntos[0] + 2, puntos[1] + 2, fill=COLORES[k % len(COLORES)])
+        formato = "%Y-%m-%d %H:%M"
+        c.create_text(izq, alto - abajo + 5, text=datetime.fromtimestamp(inicio).strftime(formato), anchor="nw", font=("Segoe UI", 8))
+        c.create_text(izq + util_x, alto - abajo + 5, text=datetime.fromtimestamp(fin).strftime(formato), anchor="ne", font=("Segoe UI", 8))
+        c.create_text(izq + util_x // 2, alto - abajo + 5, text=f"resolución: {self.resolucion}", anchor="n", fill="#777777", font=("Segoe UI", 8))
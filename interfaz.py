@@ -1,166 +1,317 @@
 # Archivo: interfaz.py
 
 import os
+from datetime import datetime
 import tkinter as tk
 from tkinter import messagebox
+from tkinter import filedialog
 from tkinter import ttk # Importar ttk
-import mysql.connector
-# Importar funciones de otros scripts (asegúrate que estén accesibles)
-# from download_attachment import main as run_download_attachment
-# from get_data_to_database_test import main as run_get_data_to_db
-import threading
-import download_attachment # Para ejecutar en hilo
-import subprocess # Para ejecutar get_data_to_database_test.py
-import pandas as pd
-import traceback
-import queue
-from PIL import Image, ImageTk
-
-# --- FUNCIONES DE LA BASE DE DATOS (sin cambios) ---
+import sensores
+from tabla_virtual import TablaVirtual
+from tareas import GestorTareas
+import cache_consultas # Caché LRU de resultados validada con marca de agua por sensor
+from graficos import GraficaSensor # Gráfica en tk.Canvas con LTTB (sin matplotlib)
+# Módulos pesados (pandas vía la carga de CSV, cliente de Google API, PIL) y los de la BD
+# (mysql.connector vía base_datos, migraciones, consultas, exportar, cache_parquet) se importan
+# dentro de la función que los usa, así abrir la ventana no paga su importación.
+
+# --- FUNCIONES DE LA BASE DE DATOS ---
+def obtener_conexion():
+    """Conexión del pool compartido; base_datos (y mysql.connector) se cargan en el primer uso."""
+    import base_datos
+    return base_datos.get_connection()
+
 def connect_to_database():
+    # Conexión reutilizada del pool compartido; conn.close() la devuelve al pool
+    import mysql.connector
     try:
-        conn = mysql.connector.connect(
-            host="localhost", user="root", password="1234", database="labiot_data_sensed"
-        )
+        conn = obtener_conexion()
         return conn
     except mysql.connector.Error as err:
         messagebox.showerror("Error de Conexión", f"Error de Conexión: {err}")
         return None
 
-def consultar_sensor(sensor_id, conn):
-    cursor = None
+def cargar_registro_sensores(refresh=False):
+    """Carga (o refresca) el registro de sensores; sin BD se usan los sensores por defecto."""
+    import mysql.connector
+    try:
+        conn = obtener_conexion()
+    except mysql.connector.Error as err:
+        print(f"Advertencia: no se pudo cargar la lista de sensores desde la BD: {err}")
+        return sensores.get_registry()
     try:
-        cursor = conn.cursor(dictionary=True)
-        query = f"""
-        SELECT id, sensor_id, time, water_flow_value, total_pulse,
-               flow_per_hour, last_pulse, battery
-        FROM sensor_data WHERE sensor_id = {sensor_id} ORDER BY time
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        return rows
-    except Exception as e:
-        raise Exception(f"Error en Consulta: {str(e)}")
+        return sensores.get_registry(conn, refresh=refresh, max_age=sensores.MAX_AGE)
     finally:
-        if cursor: cursor.close()
+        conn.close()
 
-def obtener_datos_sensor(conn):
-    cursor = None
+def preparar_esquema():
+    """Aplica las migraciones pendientes al abrir la interfaz (índices, clave única, agregados)."""
+    import mysql.connector, migraciones
     try:
-        cursor = conn.cursor(dictionary=True)
-        query = """
-        SELECT id, sensor_id, time, water_flow_value, total_pulse,
-               flow_per_hour, last_pulse, battery
-        FROM sensor_data
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        return rows
-    except Exception as e:
-        raise Exception(f"Error en Consulta General: {str(e)}")
+        conn = obtener_conexion()
+    except mysql.connector.Error as err:
+        print(f"Advertencia: no se pudo revisar el esquema de la BD: {err}")
+        return
+    try:
+        migraciones.migrar(conn)
     finally:
-        if cursor: cursor.close()
+        conn.close()
+
+def iniciar_bd(tarea):
+    """Tarea de arranque: migraciones pendientes y sensores desde la BD. Devuelve los nombres para el combobox."""
+    tarea.progreso("revisando esquema...")
+    preparar_esquema() # Antes de leer sensores: crea/actualiza tablas e índices si hace falta
+    tarea.progreso("cargando sensores...")
+    return cargar_registro_sensores(refresh=True).names()
+
+def actualizar_combo_sensores():
+    """
+    postcommand del combobox: muestra el registro en memoria (sin tocar la BD en el hilo de Tk)
+    y, si caducó, lo refresca en segundo plano para la próxima vez que se abra la lista.
+    """
+    registro = sensores.get_registry()
+    combo['values'] = registro.names()
+    if registro.is_stale(sensores.MAX_AGE):
+        gestor_tareas.ejecutar("Sensores", lambda tarea: cargar_registro_sensores().names(),
+                               lambda nombres: combo.configure(values=nombres),
+                               lambda error: print(f"Advertencia: no se pudo refrescar la lista de sensores: {error}"))
+
+# --- FUNCIONES DE LA INTERFAZ ---
+def formatear_fila(row):
+    """Valores de una fila de sensor_data para el Treeview."""
+    flow_value = row.get('flow_per_hour')
+    flow_display = f"{flow_value:.2f}" if flow_value is not None else ""
+    return (
+        row.get('id', ''), row.get('sensor_id', ''), row.get('time', ''),
+        row.get('water_flow_value', ''), row.get('total_pulse', ''),
+        flow_display, row.get('last_pulse', ''), row.get('battery', '')
+    )
+
+def formatear_agregado(row):
+    """Valores de una fila de sensor_data_hourly / sensor_data_daily para el Treeview."""
+    def num(valor): return f"{valor:.2f}" if valor is not None else ""
+    return (
+        row.get('sensor_id', ''), row.get('bucket', ''), num(row.get('flow_sum')),
+        num(row.get('water_flow_min')), num(row.get('water_flow_max')), num(row.get('water_flow_avg')),
+        num(row.get('battery_min')), row.get('samples', '')
+    )
+
+# Resolución del combobox -> clave de consultas.TABLAS_AGREGADOS (None = lecturas crudas)
+RESOLUCIONES = {"Crudo": None, "Por hora": 'hora', "Por día": 'dia'}
+# Cabeceras por columna del Treeview: (texto crudo, texto agregado)
+ENCABEZADOS = {
+    "ID": ("ID", "Sensor"), "Sensor ID": ("Sensor", "Intervalo"), "Time": ("Timestamp", "Flow Total"),
+    "Water Flow": ("W Flow", "W Flow Mín"), "Total Pulse": ("T Pulse", "W Flow Máx"),
+    "Flow Per Hour": ("Flow/Hr", "W Flow Prom"), "Last Pulse": ("L Pulse", "Bat. Mín"), "Battery": ("Bat.", "Lecturas"),
+}
+
+FORMATOS_FECHA = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+MAX_FILAS_CACHE = 200000 # Lecturas crudas que se cargan de la caché Parquet a la tabla (sin BD no hay paginación)
+
+def leer_fecha(texto, nombre):
+    """Convierte el texto de un campo de fecha a 'YYYY-MM-DD HH:MM:SS' (None si está vacío)."""
+    texto = texto.strip()
+    if not texto: return None
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha '{nombre}' no válida: '{texto}'. Usa AAAA-MM-DD o AAAA-MM-DD HH:MM.")
+
+def leer_rango():
+    """(inicio, fin) de los campos Desde/Hasta, o None (con mensaje de error) si no son válidos."""
+    try:
+        inicio = leer_fecha(entry_desde.get(), "Desde"); fin = leer_fecha(entry_hasta.get(), "Hasta")
+    except ValueError as e:
+        messagebox.showerror("Rango de Fechas", str(e)); return None
+    if inicio and fin and inicio >= fin:
+        messagebox.showerror("Rango de Fechas", "'Desde' debe ser anterior a 'Hasta'."); return None
+    return inicio, fin
+
+def configurar_encabezados(agregado):
+    """Cambia las cabeceras del Treeview entre lecturas crudas y agregados (mismas 8 columnas)."""
+    for columna, textos in ENCABEZADOS.items():
+        tree.heading(columna, text=textos[1 if agregado else 0])
+
+def conexion_o_cache(tarea, sensor_id=None):
+    """
+    Conexión registrada en la tarea, o None si MySQL no responde y la caché Parquet tiene datos
+    (el llamador lee entonces de cache_parquet). Sin caché se relanza el error de conexión.
+    """
+    import mysql.connector, cache_parquet
+    try:
+        conn = obtener_conexion()
+    except mysql.connector.Error as err:
+        if not cache_parquet.disponible(sensor_id): raise
+        print(f"⚠️ BD no disponible ({err}). Usando la caché local {cache_parquet.CACHE_DIR}.")
+        tarea.progreso("BD no disponible: leyendo de la caché local...")
+        return None
+    tarea.registrar_conexion(conn) # Cancelar interrumpe la consulta en el servidor
+    return conn
 
-# --- FUNCIONES DE LA INTERFAZ (consultar y descargar sin cambios funcionales) ---
 def consultar_sensor_gui():
-    sensor_map = {"sw01": 1, "swm-02": 2, "swm-03": 3, "swm-04": 4, "swm-05": 5}
     sensor_seleccionado = combo.get()
-    sensor_id = sensor_map.get(sensor_seleccionado)
+    sensor_id = sensores.get_registry().id_for_name(sensor_seleccionado)
 
     if sensor_id is None:
         messagebox.showerror("Error de Selección", "Por favor, seleccione un sensor válido.")
         return
 
-    conn = connect_to_database()
-    if conn is None: return
-
-    try:
-        for item in tree.get_children(): tree.delete(item)
-
-        rows = consultar_sensor(sensor_id, conn)
-
-        if rows:
-            for i, row in enumerate(rows):
-                flow_value = row.get('flow_per_hour')
-                flow_display = f"{flow_value:.2f}" if flow_value is not None else ""
-                # Aplicar tag para colores alternos (puede que no funcione dependiendo del tema ttk)
-                tag_to_use = 'evenrow' if i % 2 == 0 else 'oddrow'
-                values_to_insert = (
-                    row.get('id', ''), row.get('sensor_id', ''), row.get('time', ''),
-                    row.get('water_flow_value', ''), row.get('total_pulse', ''),
-                    flow_display, row.get('last_pulse', ''), row.get('battery', '')
-                )
-                tree.insert("", "end", values=values_to_insert, tags=(tag_to_use,)) # Añadir tag aquí
-            messagebox.showinfo("Consulta Exitosa", f"Datos del sensor {sensor_seleccionado} consultados.")
+    resolucion = RESOLUCIONES.get(combo_resolucion.get())
+    rango = leer_rango()
+    if rango is None: return
+    inicio, fin = rango
+    # Tabla virtual: solo se cargan las filas visibles; el resto se pide al desplazarse
+    limite = tabla.tamano_pagina_inicial()
+    def trabajo(tarea):
+        import cache_parquet
+        from consultas import consultar_agregados
+        conn = conexion_o_cache(tarea, sensor_id)
+        if conn is None:
+            if resolucion: raise Exception("BD no disponible: la caché local solo tiene lecturas crudas.")
+            filas = cache_parquet.leer_filas(sensor_id, inicio, fin, MAX_FILAS_CACHE)
+            return True, len(filas), filas
+        try:
+            tarea.progreso(f"consultando {sensor_seleccionado}...")
+            cache = cache_consultas.get_cache()
+            if resolucion:
+                # Agregados: pocas filas (8760 por año por hora), se traen completas
+                filas = cache.obtener(sensor_id, ('agregados', resolucion, inicio, fin), conn,
+                                      lambda: consultar_agregados(sensor_id, conn, resolucion, inicio, fin))
+                return False, len(filas), filas
+            return (False,) + cache.obtener(sensor_id, ('inicio', limite, inicio, fin), conn,
+                                            lambda: TablaVirtual.consultar_inicio(sensor_id, conn, limite, inicio, fin))
+        finally:
+            conn.close()
+    def terminado(resultado):
+        desde_cache, total, filas = resultado
+        configurar_encabezados(resolucion is not None)
+        if resolucion:
+            tabla.mostrar_lista(filas, formatear_agregado)
+        elif desde_cache:
+            tabla.mostrar_lista(filas, formatear_fila) # Sin BD: todas las filas en memoria (hasta MAX_FILAS_CACHE)
         else:
+            tabla.mostrar(sensor_id, total, filas, formatear_fila, inicio, fin)
+        if not total:
+            tabla.limpiar()
             messagebox.showwarning("Sin Resultados", f"No se encontraron datos para {sensor_seleccionado}.")
-    except Exception as e:
-        messagebox.showerror("Error en Consulta GUI", str(e))
-    finally:
-        if conn and conn.is_connected(): conn.close()
+        elif desde_cache:
+            limite_txt = f" (primeras {MAX_FILAS_CACHE})" if total >= MAX_FILAS_CACHE else ""
+            estado_var.set(f"Sensor {sensor_seleccionado}: {total} filas{limite_txt} desde la caché local (BD no disponible).")
+        else:
+            stats = cache_consultas.get_cache().estadisticas()
+            estado_var.set(f"Sensor {sensor_seleccionado}: {total} filas ({combo_resolucion.get().lower()}). "
+                           f"Caché: {stats['aciertos']} aciertos / {stats['fallos']} fallos.")
+    gestor_tareas.ejecutar("Consulta", trabajo, terminado,
+                           lambda error: messagebox.showerror("Error en Consulta GUI", error))
 
 def descargar_datos_gui():
-    sensor_map = {"sw01": 1, "swm-02": 2, "swm-03": 3, "swm-04": 4, "swm-05": 5}
-    sensor_seleccionado = combo.get()
-    sensor_id = sensor_map.get(sensor_seleccionado)
+    registro = sensores.get_registry()
+    if exportar_todos_var.get():
+        sensor_ids = sorted(registro.ids); etiqueta = "todos"
+    else:
+        sensor_id = registro.id_for_name(combo.get())
+        if sensor_id is None: messagebox.showerror("Error", "Seleccione sensor."); return
+        sensor_ids = [sensor_id]; etiqueta = combo.get()
+    rango = leer_rango()
+    if rango is None: return
+    file_name = filedialog.asksaveasfilename(
+        title="Exportar datos", defaultextension=".xlsx", initialfile=f"sensor_data_{etiqueta}.xlsx",
+        filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("Parquet", "*.parquet")])
+    if not file_name: return # Cancelado por el usuario
+    def trabajo(tarea):
+        # Streaming: las filas van de la BD (o de la caché local) al archivo por lotes, sin DataFrame intermedio
+        import exportar # openpyxl/pyarrow se importan al crear el escritor
+        conn = conexion_o_cache(tarea)
+        def progreso(sensor_id, filas):
+            tarea.verificar()
+            tarea.progreso(f"sensor {registro.name_for_id(sensor_id)}: {filas} filas escritas...")
+        try:
+            return exportar.exportar(sensor_ids, file_name, conn, *rango, progreso=progreso)
+        finally:
+            if conn: conn.close()
+    def terminado(total):
+        if total: messagebox.showinfo("Descarga Exitosa", f"{total} filas guardadas en\n{file_name}.")
+        else: messagebox.showwarning("Sin Datos", "No hay datos para descargar.")
+    gestor_tareas.ejecutar("Exportación", trabajo, terminado,
+                           lambda error: messagebox.showerror("Error en Descarga", f"Error: {error}"))
+
+ventana_grafica = None; grafica = None # Ventana de la gráfica (una sola, se reutiliza)
+
+def abrir_grafica():
+    """Grafica flow_per_hour, water_flow_value y battery del sensor seleccionado en el rango Desde/Hasta."""
+    global ventana_grafica, grafica
+    sensor_id = sensores.get_registry().id_for_name(combo.get())
     if sensor_id is None: messagebox.showerror("Error", "Seleccione sensor."); return
-    conn = connect_to_database()
-    if conn is None: return
-    try:
-        rows = consultar_sensor(sensor_id, conn)
-        if rows:
-            save_dir = "C:/Users/erika/Desktop/SERVICIO SOCIAL - BD/PYTHON/Datos en XLSX/"
-            os.makedirs(save_dir, exist_ok=True)
-            file_name = os.path.join(save_dir, f"sensor_data_{sensor_seleccionado}.xlsx")
-            df = pd.DataFrame(rows)
-            column_order = ['id', 'sensor_id', 'time', 'water_flow_value', 'total_pulse', 'flow_per_hour', 'last_pulse', 'battery']
-            df_columns_existing = [col for col in column_order if col in df.columns]
-            df = df[df_columns_existing]
-            df.to_excel(file_name, index=False)
-            messagebox.showinfo("Descarga Exitosa", f"Datos guardados en\n{file_name}.")
-        else:
-            messagebox.showwarning("Sin Datos", "No hay datos para descargar.")
-    except Exception as e:
-        messagebox.showerror("Error en Descarga", f"Error: {str(e)}\n{traceback.format_exc()}")
-    finally:
-        if conn and conn.is_connected(): conn.close()
-
-# --- FUNCIONES PARA EJECUTAR SCRIPTS (sin cambios) ---
+    rango = leer_rango()
+    if rango is None: return
+    inicio, fin = (datetime.strptime(valor, "%Y-%m-%d %H:%M:%S") if valor else None for valor in rango)
+    if ventana_grafica is None or not ventana_grafica.winfo_exists():
+        ventana_grafica = tk.Toplevel(ventana)
+        ventana_grafica.geometry("900x600")
+        barra = ttk.Frame(ventana_grafica, padding=5, style='Content.TFrame'); barra.pack(fill='x')
+        ttk.Label(barra, text="Rueda: zoom · Arrastrar: desplazar", style='Label.TLabel').pack(side='left')
+        grafica = GraficaSensor(ventana_grafica, obtener_conexion, gestor_tareas.ejecutar,
+                                lambda error: messagebox.showerror("Error en Gráfica", error, parent=ventana_grafica))
+        borde = crear_boton_con_borde(barra, "Ver todo", grafica.reiniciar, color_guinda, padding_borde=1); borde.pack(side='right')
+        grafica.pack(fill='both', expand=True)
+    ventana_grafica.title(f"Gráfica - {combo.get()}")
+    ventana_grafica.lift()
+    grafica.cargar(sensor_id, inicio, fin)
+
+# --- FUNCIONES PARA EJECUTAR SCRIPTS (en segundo plano con GestorTareas) ---
 def ejecutar_download_attachment():
-    result_queue = queue.Queue()
-    def download_attachment_thread():
-        try:
-            download_attachment.main()
-            result_queue.put("Descarga de archivos adjuntos completada.")
-        except Exception as e:
-            result_queue.put(f"Error descarga: {e}\n{traceback.format_exc()}")
-    thread = threading.Thread(target=download_attachment_thread)
-    thread.start()
-    messagebox.showinfo("Descarga Iniciada", "Descargando adjuntos en segundo plano...")
-    def check_result():
-        try:
-            result = result_queue.get_nowait()
-            if "Error" in result: messagebox.showerror("Error Descarga", result)
-            else: messagebox.showinfo("Descarga Completada", result)
-        except queue.Empty: ventana.after(200, check_result)
-    ventana.after(100, check_result)
+    def trabajo(tarea):
+        import download_attachment # Cliente de Google API: solo al usar la descarga
+        tarea.progreso("descargando adjuntos de Gmail...")
+        return download_attachment.main()
+    def terminado(stats):
+        files = (stats or {}).get('files', 0)
+        messagebox.showinfo("Descarga Completada", f"Descarga de archivos adjuntos completada ({files} archivos).")
+    gestor_tareas.ejecutar("Descarga Gmail", trabajo, terminado,
+                           lambda error: messagebox.showerror("Error Descarga", f"Error descarga: {error}"))
+
+def ejecutar_pipeline():
+    def trabajo(tarea):
+        import pipeline # Descarga + carga a BD en memoria (Google API + pandas)
+        tarea.progreso("descargando y cargando reportes...")
+        stats = pipeline.run_pipeline()
+        if stats is None: raise Exception("sin conexión a la BD.")
+        return stats
+    def terminado(stats):
+        cache_consultas.get_cache().invalidar(stats.get('sensors')) # Solo los sensores con datos nuevos
+        messagebox.showinfo("Pipeline Completado",
+                            f"Pipeline completado: {stats['files']} archivos, {stats['rows']} filas cargadas"
+                            f"{', ' + str(len(stats['errors'])) + ' con error' if stats['errors'] else ''}.")
+    gestor_tareas.ejecutar("Pipeline", trabajo, terminado,
+                           lambda error: messagebox.showerror("Error Pipeline", f"Error pipeline: {error}"))
 
 def ejecutar_get_data_to_database_test():
-    try:
-        process = subprocess.Popen(["python", "get_data_to_database_test.py"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=subprocess.CREATE_NO_WINDOW)
-        stdout, stderr = process.communicate()
-        if process.returncode == 0:
-            messagebox.showinfo("Carga a BD", "Script ejecutado.\nConsulta de nuevo para ver datos actualizados.")
-        else:
-            messagebox.showerror("Error Carga a BD", f"Error al ejecutar script:\n{stderr}")
-    except FileNotFoundError: messagebox.showerror("Error", "No se encontró 'get_data_to_database_test.py' o 'python'.")
-    except Exception as e: messagebox.showerror("Error", f"Error al ejecutar script:\n{e}")
-
-# --- CREACIÓN DE LA VENTANA PRINCIPAL ---
-ventana = tk.Tk()
-ventana.title("Gestor de Sensores LabIoT")
-ventana.geometry("950x700") # Un poco más ancho
-ventana.configure(bg='#F5F5F5') # Un gris muy claro para el fondo
+    def trabajo(tarea):
+        import get_data_to_database_test as ingest # pandas/numpy: solo al cargar CSV
+        # En el mismo proceso y con una conexión del pool: sin arrancar otro intérprete por clic
+        # La conexión no se registra en la tarea: KILL QUERY cortaría flow_per_hour o los agregados
+        # de archivos ya cargados. Cancelar solo actúa entre archivos, desde progreso.
+        conn = obtener_conexion()
+        def progreso(hechos, total, file_name):
+            tarea.verificar() # Cancelar detiene la carga entre archivos (lo ya cargado queda completo)
+            tarea.progreso(f"{hechos}/{total} {file_name}", hechos / total)
+        try:
+            tarea.progreso("buscando CSV pendientes...")
+            stats = ingest.ingest_directory(ingest.CSV_DIRECTORY, conn, progreso)
+        finally:
+            conn.close()
+        cargar_registro_sensores(refresh=True) # Por si la carga agregó sensores (en el hilo de la tarea, no en Tk)
+        return stats
+    def terminado(stats):
+        cache_consultas.get_cache().invalidar(stats['sensors']) # Solo los sensores con datos nuevos
+        messagebox.showinfo("Carga a BD",
+                            f"Carga completada: {stats['files_processed']} archivos, {stats['rows']} filas en {stats['seconds']}s"
+                            f"{', ' + str(len(stats['errors'])) + ' con error' if stats['errors'] else ''}."
+                            "\nConsulta de nuevo para ver datos actualizados.")
+    gestor_tareas.ejecutar("Carga a BD", trabajo, terminado,
+                           lambda error: messagebox.showerror("Error Carga a BD", f"Error en la carga:\n{error}"))
 
 # --- ESTILOS ---
 def configurar_estilos():
@@ -237,6 +388,25 @@ def configurar_estilos():
     estilo.configure('Label.TLabel', font=('Segoe UI', 10), foreground=color_texto_principal, background=ventana['bg'])
     estilo.configure('Content.TFrame', background=ventana['bg'])
 
+# --- Logos: caché de imágenes redimensionadas ---
+CACHE_LOGOS = "cache_logos" # PNG ya redimensionados; se regeneran si cambia el original o el alto
+
+def cargar_logo(ruta, alto):
+    """tk.PhotoImage del logo con alto máximo 'alto', usando la copia redimensionada en caché si está al día."""
+    base = os.path.splitext(os.path.basename(ruta))[0]
+    cacheado = os.path.join(CACHE_LOGOS, f"{base}_{alto}_{os.stat(ruta).st_mtime_ns}.png")
+    if not os.path.exists(cacheado):
+        from PIL import Image # Solo la primera vez (o si cambió el logo): decodificar y redimensionar
+        os.makedirs(CACHE_LOGOS, exist_ok=True)
+        imagen = Image.open(ruta)
+        w, h = imagen.size
+        ratio = min(alto / h, 1) # No agrandar si es más pequeña
+        imagen.resize((int(w * ratio), int(h * ratio)), Image.Resampling.LANCZOS).save(cacheado, "PNG")
+        for viejo in os.listdir(CACHE_LOGOS): # Versiones anteriores del mismo logo y alto
+            if viejo.startswith(f"{base}_{alto}_") and os.path.join(CACHE_LOGOS, viejo) != cacheado:
+                os.remove(os.path.join(CACHE_LOGOS, viejo))
+    return tk.PhotoImage(file=cacheado) # Tk 8.6 lee PNG sin PIL
+
 # --- Función para crear botones con borde de color ---
 def crear_boton_con_borde(parent, text, command, color_borde, padding_borde=2):
     # Frame exterior que simula el borde
@@ -247,128 +417,171 @@ def crear_boton_con_borde(parent, text, command, color_borde, padding_borde=2):
     boton.pack(padx=padding_borde, pady=padding_borde, fill='both', expand=True)
     return borde_frame # Devolver el frame que contiene todo
 
-# --- WIDGETS ---
-configurar_estilos()
-
-main_frame = ttk.Frame(ventana, padding=20, style='Content.TFrame')
-main_frame.pack(fill='both', expand=True)
-
-# --- Frame superior (Logos y Título) ---
-top_frame = ttk.Frame(main_frame, style='Content.TFrame')
-top_frame.pack(fill='x', pady=(0, 15))
-top_frame.grid_columnconfigure(0, weight=1); top_frame.grid_columnconfigure(1, weight=3); top_frame.grid_columnconfigure(2, weight=1)
-
-# Cargar Logos
-logo_label_ipn = None; logo_label_citedi = None
-try:
-    logo_img_ipn_orig = Image.open("logo1.png"); logo_img_citedi_orig = Image.open("logo2.png")
-    target_height_ipn = 100; target_height_citedi = 45
-    # Redimensionar IPN
-    w, h = logo_img_ipn_orig.size
-    ratio = min(target_height_ipn / h, 1) # No agrandar si es más pequeña
-    logo_img_ipn = logo_img_ipn_orig.resize((int(w * ratio), int(h * ratio)), Image.Resampling.LANCZOS)
-    # Redimensionar CITEDI
-    w, h = logo_img_citedi_orig.size
-    ratio = min(target_height_citedi / h, 1)
-    logo_img_citedi = logo_img_citedi_orig.resize((int(w * ratio), int(h * ratio)), Image.Resampling.LANCZOS)
-
-    logo_tk_ipn = ImageTk.PhotoImage(logo_img_ipn); logo_tk_citedi = ImageTk.PhotoImage(logo_img_citedi)
-    # Colocar logos (IPN izquierda, CITEDI derecha)
-    logo_label_ipn = tk.Label(top_frame, image=logo_tk_ipn, bg=ventana['bg']); logo_label_ipn.grid(row=0, column=0, padx=(0, 10), pady=5, sticky='w'); logo_label_ipn.image = logo_tk_ipn
-    logo_label_citedi = tk.Label(top_frame, image=logo_tk_citedi, bg=ventana['bg']); logo_label_citedi.grid(row=0, column=2, padx=(10, 0), pady=5, sticky='e'); logo_label_citedi.image = logo_tk_citedi
-except Exception as e: print(f"Error al cargar logos: {e}")
-
-# Título
-title_frame = ttk.Frame(top_frame, style='Content.TFrame'); title_frame.grid(row=0, column=1, sticky='ew'); title_frame.grid_columnconfigure(0, weight=1)
-titulo_label = ttk.Label(title_frame, text="Gestor de Datos de Sensores", style='Titulo.TLabel', anchor='center'); titulo_label.grid(row=0, column=0, pady=(5,0), sticky='ew')
-
-# --- Frame de Controles ---
-controls_frame = ttk.Frame(main_frame, style='Content.TFrame')
-controls_frame.pack(fill='x', pady=10)
-
-# Selección de Sensor
-sensor_select_frame = ttk.Frame(controls_frame, style='Content.TFrame'); sensor_select_frame.pack(side='left', padx=(0, 10), fill='x', expand=True)
-sensor_label = ttk.Label(sensor_select_frame, text="Sensor:", style='Label.TLabel'); sensor_label.pack(side='left', padx=(0, 5))
-combo = ttk.Combobox(sensor_select_frame, values=["sw01", "swm-02", "swm-03", "swm-04", "swm-05"], style='TCombobox', state='readonly'); combo.set("Selecciona uno"); combo.pack(side='left', fill='x', expand=True)
-
-# --- Botones de Acción con borde ---
-# Crear botones usando la función auxiliar
-borde_boton_consultar = crear_boton_con_borde(controls_frame, "Consultar", consultar_sensor_gui, color_guinda, padding_borde=1)
-borde_boton_consultar.pack(side='left', padx=6)
-
-borde_boton_descargar = crear_boton_con_borde(controls_frame, "Guardar XLSX", descargar_datos_gui, color_guinda, padding_borde=1)
-borde_boton_descargar.pack(side='left', padx=6)
-
-# --- Frame de Scripts ---
-scripts_frame = ttk.Frame(main_frame, style='Content.TFrame')
-scripts_frame.pack(fill='x', pady=15) # Más espacio vertical
-
-# --- Botones de Scripts con borde ---
-borde_boton_download = crear_boton_con_borde(scripts_frame, "Descargar Reportes Gmail", ejecutar_download_attachment, color_guinda, padding_borde=1)
-borde_boton_download.pack(side='left', padx=6, fill='x', expand=True)
-
-borde_boton_get_data = crear_boton_con_borde(scripts_frame, "Cargar Datos a BD", ejecutar_get_data_to_database_test, color_guinda, padding_borde=1)
-borde_boton_get_data.pack(side='left', padx=6, fill='x', expand=True)
-
-
-# --- Frame del Treeview ---
-tree_container_frame = ttk.Frame(main_frame, style='Content.TFrame')
-tree_container_frame.pack(fill='both', expand=True, pady=(10, 0))
-
-scrollbar_vertical = ttk.Scrollbar(tree_container_frame, orient="vertical")
-scrollbar_horizontal = ttk.Scrollbar(tree_container_frame, orient="horizontal")
-
-# --- Treeview ---
-# Configurar para mostrar líneas (si el tema lo soporta)
-tree = ttk.Treeview(tree_container_frame,
-                    columns=("ID", "Sensor ID", "Time", "Water Flow", "Total Pulse", "Flow Per Hour", "Last Pulse", "Battery"),
-                    show='headings', # Cambiar a 'tree headings' si quieres líneas de árbol
-                    yscrollcommand=scrollbar_vertical.set,
-                    xscrollcommand=scrollbar_horizontal.set,
-                    style='Treeview',
-                    padding=(5, 0, 5, 0)) # Padding horizontal en celdas
-
-# --- Añadir líneas de separación (solo funciona en algunos temas) ---
-style = ttk.Style()
-# Podría necesitar 'vista' en Windows, 'aqua' en Mac, o 'clam'/'alt'
-if 'clam' in estilo.theme_names() or 'alt' in estilo.theme_names():
-     try:
-         estilo.configure("Treeview", rowheight=30) # Re-asegurar altura si se usa clam/alt
-         # Intenta configurar el layout para mostrar separadores
-         # Esto es muy dependiente del tema y puede no funcionar
-         estilo.layout("Treeview.Item",
-                      [('Treeitem.padding', {'sticky': 'nswe', 'children':
-                          [('Treeitem.indicator', {'side': 'left', 'sticky': ''}),
-                           ('Treeitem.image', {'side': 'left', 'sticky': ''}),
-                           #('Treeitem.focus', {'side': 'left', 'sticky': '', 'children': [
-                           ('Treeitem.text', {'side': 'left', 'sticky': ''}),
-                           #]})
-                           ]})])
-         # Intenta añadir un separador visual (puede no funcionar)
-         # estilo.configure('Treeview.Separator', background='#CCCCCC')
-     except Exception as e:
-         print(f"No se pudo configurar layout/separador del Treeview: {e}")
-
-
-scrollbar_vertical.config(command=tree.yview)
-scrollbar_horizontal.config(command=tree.xview)
-scrollbar_vertical.pack(side="right", fill="y")
-scrollbar_horizontal.pack(side="bottom", fill="x")
-tree.pack(side="left", fill="both", expand=True)
-
-# Configurar Tags para filas alternas (redefinir por si acaso)
-tree.tag_configure('oddrow', background=color_gris_muy_claro, foreground=color_texto_principal)
-tree.tag_configure('evenrow', background=color_blanco, foreground=color_texto_principal)
-
-# Cabeceras y Columnas (sin cambios en definición, solo estilo arriba)
-tree.heading("ID", text="ID", anchor=tk.CENTER); tree.column("ID", width=40, anchor=tk.CENTER, stretch=tk.NO)
-tree.heading("Sensor ID", text="Sensor", anchor=tk.CENTER); tree.column("Sensor ID", width=60, anchor=tk.CENTER, stretch=tk.NO)
-tree.heading("Time", text="Timestamp", anchor=tk.W); tree.column("Time", width=150, anchor=tk.W, stretch=tk.YES)
-tree.heading("Water Flow", text="W Flow", anchor=tk.E); tree.column("Water Flow", width=100, anchor=tk.E)
-tree.heading("Total Pulse", text="T Pulse", anchor=tk.E); tree.column("Total Pulse", width=100, anchor=tk.E)
-tree.heading("Flow Per Hour", text="Flow/Hr", anchor=tk.E); tree.column("Flow Per Hour", width=90, anchor=tk.E)
-tree.heading("Last Pulse", text="L Pulse", anchor=tk.E); tree.column("Last Pulse", width=90, anchor=tk.E)
-tree.heading("Battery", text="Bat.", anchor=tk.E); tree.column("Battery", width=50, anchor=tk.E, stretch=tk.NO)
-
-# --- BUCLE PRINCIPAL ---
-ventana.mainloop()
\ No newline at end of file
+# --- ARRANQUE ---
+def run():
+    """Construye la ventana y entra al bucle de Tk (main.py llama esta función)."""
+    global ventana, combo, combo_resolucion, tree, tabla, estado_var, gestor_tareas, entry_desde, entry_hasta, exportar_todos_var
+    # --- CREACIÓN DE LA VENTANA PRINCIPAL ---
+    ventana = tk.Tk()
+    ventana.title("Gestor de Sensores LabIoT")
+    ventana.geometry("950x700") # Un poco más ancho
+    ventana.configure(bg='#F5F5F5') # Un gris muy claro para el fondo
+
+    # --- WIDGETS ---
+    configurar_estilos()
+
+    main_frame = ttk.Frame(ventana, padding=20, style='Content.TFrame')
+    main_frame.pack(fill='both', expand=True)
+
+    # --- Frame superior (Logos y Título) ---
+    top_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    top_frame.pack(fill='x', pady=(0, 15))
+    top_frame.grid_columnconfigure(0, weight=1); top_frame.grid_columnconfigure(1, weight=3); top_frame.grid_columnconfigure(2, weight=1)
+
+    # Cargar Logos (ya redimensionados desde la caché en disco; PIL solo se usa si hay que regenerarlos)
+    try:
+        logo_tk_ipn = cargar_logo("logo1.png", 100); logo_tk_citedi = cargar_logo("logo2.png", 45)
+        # Colocar logos (IPN izquierda, CITEDI derecha)
+        logo_label_ipn = tk.Label(top_frame, image=logo_tk_ipn, bg=ventana['bg']); logo_label_ipn.grid(row=0, column=0, padx=(0, 10), pady=5, sticky='w'); logo_label_ipn.image = logo_tk_ipn
+        logo_label_citedi = tk.Label(top_frame, image=logo_tk_citedi, bg=ventana['bg']); logo_label_citedi.grid(row=0, column=2, padx=(10, 0), pady=5, sticky='e'); logo_label_citedi.image = logo_tk_citedi
+    except Exception as e: print(f"Error al cargar logos: {e}")
+
+    # Título
+    title_frame = ttk.Frame(top_frame, style='Content.TFrame'); title_frame.grid(row=0, column=1, sticky='ew'); title_frame.grid_columnconfigure(0, weight=1)
+    titulo_label = ttk.Label(title_frame, text="Gestor de Datos de Sensores", style='Titulo.TLabel', anchor='center'); titulo_label.grid(row=0, column=0, pady=(5,0), sticky='ew')
+
+    # --- Frame de Controles ---
+    controls_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    controls_frame.pack(fill='x', pady=10)
+
+    # Selección de Sensor
+    sensor_select_frame = ttk.Frame(controls_frame, style='Content.TFrame'); sensor_select_frame.pack(side='left', padx=(0, 10), fill='x', expand=True)
+    sensor_label = ttk.Label(sensor_select_frame, text="Sensor:", style='Label.TLabel'); sensor_label.pack(side='left', padx=(0, 5))
+    combo = ttk.Combobox(sensor_select_frame, values=sensores.get_registry().names(), postcommand=actualizar_combo_sensores, style='TCombobox', state='readonly'); combo.set("Selecciona uno"); combo.pack(side='left', fill='x', expand=True)
+    resolucion_label = ttk.Label(sensor_select_frame, text="Resolución:", style='Label.TLabel'); resolucion_label.pack(side='left', padx=(10, 5))
+    combo_resolucion = ttk.Combobox(sensor_select_frame, values=list(RESOLUCIONES), style='TCombobox', state='readonly', width=10); combo_resolucion.set("Crudo"); combo_resolucion.pack(side='left')
+
+    # --- Botones de Acción con borde ---
+    # Crear botones usando la función auxiliar
+    borde_boton_consultar = crear_boton_con_borde(controls_frame, "Consultar", consultar_sensor_gui, color_guinda, padding_borde=1)
+    borde_boton_consultar.pack(side='left', padx=6)
+
+    borde_boton_descargar = crear_boton_con_borde(controls_frame, "Exportar...", descargar_datos_gui, color_guinda, padding_borde=1)
+    borde_boton_descargar.pack(side='left', padx=6)
+    borde_boton_grafica = crear_boton_con_borde(controls_frame, "Graficar", abrir_grafica, color_guinda, padding_borde=1)
+    borde_boton_grafica.pack(side='left', padx=6)
+    exportar_todos_var = tk.BooleanVar(value=False)
+    exportar_todos_check = ttk.Checkbutton(controls_frame, text="Todos los sensores", variable=exportar_todos_var); exportar_todos_check.pack(side='left', padx=6)
+
+    # --- Rango de fechas (opcional) para consultar y exportar ---
+    rango_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    rango_frame.pack(fill='x', pady=(0, 5))
+    ttk.Label(rango_frame, text="Desde:", style='Label.TLabel').pack(side='left', padx=(0, 5))
+    entry_desde = ttk.Entry(rango_frame, width=18); entry_desde.pack(side='left', padx=(0, 10))
+    ttk.Label(rango_frame, text="Hasta:", style='Label.TLabel').pack(side='left', padx=(0, 5))
+    entry_hasta = ttk.Entry(rango_frame, width=18); entry_hasta.pack(side='left', padx=(0, 10))
+    ttk.Label(rango_frame, text="(AAAA-MM-DD [HH:MM], vacío = sin límite)", style='Label.TLabel').pack(side='left')
+
+    # --- Frame de Scripts ---
+    scripts_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    scripts_frame.pack(fill='x', pady=15) # Más espacio vertical
+
+    # --- Botones de Scripts con borde ---
+    borde_boton_download = crear_boton_con_borde(scripts_frame, "Descargar Reportes Gmail", ejecutar_download_attachment, color_guinda, padding_borde=1)
+    borde_boton_download.pack(side='left', padx=6, fill='x', expand=True)
+
+    borde_boton_get_data = crear_boton_con_borde(scripts_frame, "Cargar Datos a BD", ejecutar_get_data_to_database_test, color_guinda, padding_borde=1)
+    borde_boton_get_data.pack(side='left', padx=6, fill='x', expand=True)
+
+    borde_boton_pipeline = crear_boton_con_borde(scripts_frame, "Descargar y Cargar", ejecutar_pipeline, color_guinda, padding_borde=1)
+    borde_boton_pipeline.pack(side='left', padx=6, fill='x', expand=True)
+
+
+    # --- Barra de estado (progreso de tareas en segundo plano) ---
+    estado_var = tk.StringVar(value="Listo.")
+    status_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    status_frame.pack(side='bottom', fill='x', pady=(8, 0))
+    estado_label = ttk.Label(status_frame, textvariable=estado_var, style='Label.TLabel', anchor='w')
+    estado_label.pack(side='left', fill='x', expand=True)
+    borde_boton_cancelar = crear_boton_con_borde(status_frame, "Cancelar", lambda: gestor_tareas.cancelar(), color_guinda, padding_borde=1)
+    borde_boton_cancelar.pack(side='right', padx=6)
+    boton_cancelar = borde_boton_cancelar.winfo_children()[0]
+    boton_cancelar.state(['disabled'])
+
+    def actualizar_boton_cancelar(en_curso):
+        boton_cancelar.state(['!disabled'] if en_curso else ['disabled'])
+
+    gestor_tareas = GestorTareas(ventana, estado_var, actualizar_boton_cancelar)
+    # Esquema y lista de sensores en segundo plano: la ventana aparece sin esperar a la BD
+    gestor_tareas.ejecutar("Conexión BD", iniciar_bd, lambda nombres: combo.configure(values=nombres),
+                           lambda error: print(f"Advertencia: error preparando la BD: {error}"))
+
+    # --- Frame del Treeview ---
+    tree_container_frame = ttk.Frame(main_frame, style='Content.TFrame')
+    tree_container_frame.pack(fill='both', expand=True, pady=(10, 0))
+
+    scrollbar_vertical = ttk.Scrollbar(tree_container_frame, orient="vertical")
+    scrollbar_horizontal = ttk.Scrollbar(tree_container_frame, orient="horizontal")
+
+    # --- Treeview ---
+    # Configurar para mostrar líneas (si el tema lo soporta)
+    tree = ttk.Treeview(tree_container_frame,
+                        columns=("ID", "Sensor ID", "Time", "Water Flow", "Total Pulse", "Flow Per Hour", "Last Pulse", "Battery"),
+                        show='headings', # Cambiar a 'tree headings' si quieres líneas de árbol
+                        yscrollcommand=scrollbar_vertical.set,
+                        xscrollcommand=scrollbar_horizontal.set,
+                        style='Treeview',
+                        padding=(5, 0, 5, 0)) # Padding horizontal en celdas
+
+    # --- Añadir líneas de separación (solo funciona en algunos temas) ---
+    style = ttk.Style()
+    # Podría necesitar 'vista' en Windows, 'aqua' en Mac, o 'clam'/'alt'
+    if 'clam' in estilo.theme_names() or 'alt' in estilo.theme_names():
+         try:
+             estilo.configure("Treeview", rowheight=30) # Re-asegurar altura si se usa clam/alt
+             # Intenta configurar el layout para mostrar separadores
+             # Esto es muy dependiente del tema y puede no funcionar
+             estilo.layout("Treeview.Item",
+                          [('Treeitem.padding', {'sticky': 'nswe', 'children':
+                              [('Treeitem.indicator', {'side': 'left', 'sticky': ''}),
+                               ('Treeitem.image', {'side': 'left', 'sticky': ''}),
+                               #('Treeitem.focus', {'side': 'left', 'sticky': '', 'children': [
+                               ('Treeitem.text', {'side': 'left', 'sticky': ''}),
+                               #]})
+                               ]})])
+             # Intenta añadir un separador visual (puede no funcionar)
+             # estilo.configure('Treeview.Separator', background='#CCCCCC')
+         except Exception as e:
+             print(f"No se pudo configurar layout/separador del Treeview: {e}")
+
+
+    scrollbar_vertical.config(command=tree.yview)
+    scrollbar_horizontal.config(command=tree.xview)
+    scrollbar_vertical.pack(side="right", fill="y")
+    scrollbar_horizontal.pack(side="bottom", fill="x")
+    tree.pack(side="left", fill="both", expand=True)
+
+    # Configurar Tags para filas alternas (redefinir por si acaso)
+    tree.tag_configure('oddrow', background=color_gris_muy_claro, foreground=color_texto_principal)
+    tree.tag_configure('evenrow', background=color_blanco, foreground=color_texto_principal)
+
+    # Cabeceras y Columnas (sin cambios en definición, solo estilo arriba)
+    tree.heading("ID", text="ID", anchor=tk.CENTER); tree.column("ID", width=40, anchor=tk.CENTER, stretch=tk.NO)
+    tree.heading("Sensor ID", text="Sensor", anchor=tk.CENTER); tree.column("Sensor ID", width=60, anchor=tk.CENTER, stretch=tk.NO)
+    tree.heading("Time", text="Timestamp", anchor=tk.W); tree.column("Time", width=150, anchor=tk.W, stretch=tk.YES)
+    tree.heading("Water Flow", text="W Flow", anchor=tk.E); tree.column("Water Flow", width=100, anchor=tk.E)
+    tree.heading("Total Pulse", text="T Pulse", anchor=tk.E); tree.column("Total Pulse", width=100, anchor=tk.E)
+    tree.heading("Flow Per Hour", text="Flow/Hr", anchor=tk.E); tree.column("Flow Per Hour", width=90, anchor=tk.E)
+    tree.heading("Last Pulse", text="L Pulse", anchor=tk.E); tree.column("Last Pulse", width=90, anchor=tk.E)
+    tree.heading("Battery", text="Bat.", anchor=tk.E); tree.column("Battery", width=50, anchor=tk.E, stretch=tk.NO)
+
+    # Tabla virtual sobre el Treeview (reemplaza el yview de la barra vertical)
+    tabla = TablaVirtual(tree, scrollbar_vertical, obtener_conexion, formatear_fila,
+                         # Páginas en segundo plano (arrastre sin bloquear Tk), sin tocar la barra de estado ni Cancelar
+                         ejecutar=lambda *args: gestor_tareas.ejecutar(*args, silenciosa=True))
+
+    # --- BUCLE PRINCIPAL ---
+    ventana.mainloop()
+
+if __name__ == "__main__":
+    run()
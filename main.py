@@ -1,8 +1,6 @@
 # Archivo principal: Inicia la aplicación de interfaz gráfica.
 
-from interfaz import * # Importa y ejecuta la configuración de la interfaz
+import interfaz # Importar no abre la ventana: solo define funciones (arranque rápido)
 
 if __name__ == "__main__":
-    # El bucle principal de la interfaz (ventana.mainloop()) se encuentra
-    # al final del archivo interfaz.py y se ejecuta al importar.
-    pass
\ No newline at end of file
+    interfaz.run() # Construye la ventana y entra al bucle principal de Tk
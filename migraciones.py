@@ -0,0 +1,221 @@
+# Esquema versionado de la BD: cada migración se aplica una sola vez y queda registrada en schema_version.
+# Las migraciones revisan information_schema antes de alterar, así también sirven sobre tablas
+# creadas a mano (columnas o índices que ya existan no se vuelven a crear).
+#
+# Ningún paso borra datos: si hay lecturas duplicadas que impiden la clave única, la migración se detiene
+# y hay que revisarlas y eliminarlas explícitamente con --dedupe.
+#
+# Uso:  python migraciones.py          (aplica las pendientes; también lo hacen la carga y la interfaz)
+#       python migraciones.py --dedupe (informa y elimina lecturas (sensor_id, time) repetidas, luego migra)
+
+import argparse
+import mysql.connector
+import base_datos
+
+class MigracionDetenida(Exception):
+    """Una migración no puede seguir sin intervención manual (p. ej. datos duplicados)."""
+
+# --- Utilidades de inspección ---
+
+def _columnas(cursor, tabla):
+    cursor.execute("""
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (tabla,))
+    return {row[0] for row in cursor.fetchall()}
+
+def _indices(cursor, tabla):
+    """{nombre_índice: (único, [columnas en orden])} de una tabla."""
+    cursor.execute("""
+    SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (tabla,))
+    indices = {}
+    for nombre, no_unico, columna in cursor.fetchall():
+        indices.setdefault(nombre, (not no_unico, []))[1].append(columna)
+    return indices
+
+def _agregar_columnas(cursor, tabla, definiciones):
+    """Agrega las columnas {nombre: tipo} que falten en 'tabla'."""
+    existentes = _columnas(cursor, tabla)
+    faltantes = [f"ADD COLUMN {nombre} {tipo}" for nombre, tipo in definiciones.items() if nombre not in existentes]
+    if faltantes:
+        cursor.execute(f"ALTER TABLE {tabla} {', '.join(faltantes)}")
+
+# --- Migraciones ---
+
+def _m1_tablas_base(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sensors (
+        id INT PRIMARY KEY,
+        name VARCHAR(50) NULL,
+        file_pattern VARCHAR(255) NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sensor_data (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        sensor_id INT NOT NULL,
+        time DATETIME NOT NULL,
+        water_flow_value DOUBLE NULL,
+        total_pulse BIGINT NULL,
+        flow_per_hour DOUBLE NULL,
+        last_pulse BIGINT NULL,
+        battery DOUBLE NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS processed_files (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        file_name VARCHAR(255) NOT NULL UNIQUE,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+def _m2_columnas(cursor):
+    # Tablas anteriores al registro de sensores y a la firma de archivos procesados
+    _agregar_columnas(cursor, "sensors", {"name": "VARCHAR(50) NULL", "file_pattern": "VARCHAR(255) NULL"})
+    _agregar_columnas(cursor, "processed_files", {"file_size": "BIGINT NULL", "file_mtime": "BIGINT NULL"})
+
+def duplicados_por_sensor(cursor):
+    """[(sensor_id, lecturas_sobrantes)] con más de una lectura en el mismo (sensor_id, time)."""
+    cursor.execute("""
+    SELECT sensor_id, SUM(n - 1) FROM (
+        SELECT sensor_id, time, COUNT(*) AS n FROM sensor_data GROUP BY sensor_id, time HAVING n > 1
+    ) d GROUP BY sensor_id ORDER BY sensor_id
+    """)
+    return [(sensor_id, int(sobrantes)) for sensor_id, sobrantes in cursor.fetchall()]
+
+def _m3_clave_unica_sensor_time(cursor):
+    # Una lectura por sensor y segundo. El índice único (sensor_id, time) cubre también el orden
+    # (time, id) de la paginación y el LAG() por sensor (InnoDB agrega la PK 'id' a cada índice).
+    indices = _indices(cursor, "sensor_data")
+    if any(unico and columnas == ["sensor_id", "time"] for unico, columnas in indices.values()):
+        return
+    duplicados = duplicados_por_sensor(cursor)
+    if duplicados:
+        total = sum(sobrantes for _, sobrantes in duplicados)
+        raise MigracionDetenida(
+            f"sensor_data tiene {total} lecturas repetidas (sensor_id, time) en {len(duplicados)} sensor(es); "
+            "no se puede crear la clave única. Revísalas y ejecuta 'python migraciones.py --dedupe' para eliminarlas.")
+    cursor.execute("ALTER TABLE sensor_data ADD UNIQUE KEY uq_sensor_time (sensor_id, time)")
+    # El índice simple (sensor_id, time) que hubiera queda redundante
+    for nombre, (unico, columnas) in indices.items():
+        if not unico and columnas == ["sensor_id", "time"]:
+            cursor.execute(f"ALTER TABLE sensor_data DROP INDEX `{nombre}`")
+
+def _m4_agregados(cursor):
+    for tabla, tipo in (("sensor_data_hourly", "DATETIME"), ("sensor_data_daily", "DATE")):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tabla} (
+            sensor_id INT NOT NULL,
+            bucket {tipo} NOT NULL,
+            flow_sum DOUBLE NULL,
+            water_flow_min DOUBLE NULL,
+            water_flow_max DOUBLE NULL,
+            water_flow_avg DOUBLE NULL,
+            battery_min DOUBLE NULL,
+            samples INT NOT NULL,
+            PRIMARY KEY (sensor_id, bucket)
+        )
+        """)
+
+def _m5_version_datos(cursor):
+    # Versión de datos por sensor: la suben las inserciones y los recálculos de flow_per_hour
+    # y de agregados; es la marca de agua de cache_consultas
+    _agregar_columnas(cursor, "sensors", {"data_version": "BIGINT NOT NULL DEFAULT 0"})
+
+# (versión, descripción, función). Agregar al final; nunca cambiar una ya publicada.
+MIGRACIONES = [
+    (1, "tablas sensors, sensor_data y processed_files", _m1_tablas_base),
+    (2, "columnas name/file_pattern y file_size/file_mtime", _m2_columnas),
+    (3, "clave única (sensor_id, time) en sensor_data", _m3_clave_unica_sensor_time),
+    (4, "tablas de agregados por hora y día", _m4_agregados),
+    (5, "columna data_version en sensors", _m5_version_datos),
+]
+VERSION_ACTUAL = MIGRACIONES[-1][0]
+
+def version_esquema(connection):
+    """Última versión aplicada (0 si la BD no tiene schema_version)."""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def migrar(connection):
+    """
+    Aplica las migraciones pendientes en orden. Devuelve True si el esquema quedó al día.
+    Los ALTER/CREATE de MySQL no son transaccionales: si una falla, se puede volver a correr.
+    """
+    if connection is None: return False
+    cursor = None
+    try:
+        actual = version_esquema(connection)
+        if actual >= VERSION_ACTUAL: return True
+        cursor = connection.cursor()
+        for version, descripcion, aplicar in MIGRACIONES:
+            if version <= actual: continue
+            print(f"⚙️ Migración {version}: {descripcion}...")
+            aplicar(cursor)
+            cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, descripcion))
+            connection.commit()
+        print(f"✅ Esquema en la versión {VERSION_ACTUAL}.")
+        return True
+    except (mysql.connector.Error, MigracionDetenida) as err:
+        print(f"❌ Error aplicando migraciones: {err}")
+        try:
+            connection.rollback()
+        except mysql.connector.Error:
+            pass
+        return False
+    finally:
+        if cursor: cursor.close()
+
+def eliminar_duplicados(connection):
+    """
+    Borra las lecturas repetidas (sensor_id, time) conservando la de menor id. Informa por sensor
+    lo que se elimina antes de borrar. Devuelve el número de filas eliminadas.
+    """
+    cursor = connection.cursor()
+    try:
+        duplicados = duplicados_por_sensor(cursor)
+        if not duplicados:
+            print("✅ No hay lecturas duplicadas.")
+            return 0
+        for sensor_id, sobrantes in duplicados:
+            print(f"  sensor {sensor_id}: {sobrantes} lecturas repetidas (se conserva la de menor id)")
+        cursor.execute("""
+        DELETE sd FROM sensor_data sd
+        JOIN sensor_data keep ON keep.sensor_id = sd.sensor_id AND keep.time = sd.time AND keep.id < sd.id
+        """)
+        eliminadas = cursor.rowcount
+        connection.commit()
+        print(f"✅ {eliminadas} lecturas duplicadas eliminadas.")
+        return eliminadas
+    except mysql.connector.Error:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica las migraciones pendientes del esquema.")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Eliminar lecturas (sensor_id, time) repetidas antes de migrar (informa lo que borra)")
+    args = parser.parse_args()
+    conn = base_datos.get_connection()
+    try:
+        if args.dedupe: eliminar_duplicados(conn)
+        migrar(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,110 @@
+# Pipeline Gmail -> BD en memoria: cada adjunto descargado pasa directo a parseo e inserción
+# por una cola acotada (productor/consumidor), sin esperar a que termine la descarga ni releer del disco.
+# Guardar el CSV en SAVE_LOCATION queda como archivo histórico opcional.
+
+import time
+import queue
+import argparse
+import threading
+import traceback
+import download_attachment
+import get_data_to_database_test as ingest
+import sensores
+import migraciones
+
+# --- Configuración ---
+QUEUE_SIZE = 16 # Adjuntos en espera como máximo; si la BD va lenta, la descarga se frena
+_END = object() # Marca de fin de la cola
+
+def _consume(attachments, conn, batch_size, archive, stats):
+    """Consumidor: único escritor de la BD. Parsea e inserta cada adjunto en cuanto llega."""
+    processed = ingest.load_processed_files(conn)
+    registry = sensores.get_registry(conn, refresh=True)
+    sensor_min_times, sensor_max_times = {}, {}
+    while True:
+        item = attachments.get()
+        if item is _END:
+            break
+        file_name, content, received_at = item
+        try:
+            signature = (len(content), None) # En memoria no hay mtime; el tamaño basta para detectar reenvíos
+            stored = processed.get(file_name, False)
+            if stored is not False and (stored is None or stored[0] == len(content)):
+                print(f"  ℹ️ {file_name} ya estaba procesado. Omitiendo.")
+                continue
+            print(f"\n-> Procesando (pipeline): {file_name}")
+            result = ingest.prepare_file(content, file_name, registry.match(file_name))
+            outcome = ingest.write_prepared_file(file_name, result, registry.match(file_name), registry, conn,
+                                                 batch_size, signature)
+            if outcome['marked']:
+                processed[file_name] = signature
+                stats['files'] += 1
+                stats['rows'] += outcome['inserted']
+                stats['latencies'].append(time.perf_counter() - received_at)
+            else:
+                stats['errors'].append(file_name)
+                if not archive:
+                    # Sin copia en disco se perdería: se guarda para que la carga por directorio lo reintente
+                    download_attachment.save_attachment(file_name, content)
+            ingest.track_time_range(outcome, sensor_min_times, sensor_max_times)
+        except Exception as e:
+            print(f"  ❌ Error procesando {file_name} en el pipeline: {e}")
+            traceback.print_exc()
+            stats['errors'].append(file_name)
+    stats['sensors'] = sorted(sensor_min_times) # Sensores con datos nuevos (para invalidar cachés)
+    if stats['rows'] > 0:
+        print("\n--- Ejecutando actualización incremental de flow_per_hour ---")
+        ingest.update_flow_per_hour_incremental(sensor_min_times, conn, sensor_max_times)
+        ingest.update_rollups_incremental(sensor_min_times, conn, sensor_max_times)
+        ingest.update_parquet_cache(sensor_min_times, conn, sensor_max_times=sensor_max_times)
+
+def run_pipeline(workers=download_attachment.DOWNLOAD_WORKERS, archive=True, incremental=True,
+                 queue_size=QUEUE_SIZE, batch_size=ingest.BATCH_SIZE):
+    """
+    Descarga reportes de Gmail y los carga a la BD en paralelo.
+
+    Devuelve estadísticas: archivos y filas cargados, archivos con error, sensores con datos nuevos, segundos totales
+    y latencia (descarga -> filas en sensor_data) promedio y máxima por archivo.
+    """
+    print("--- Iniciando Pipeline Gmail -> BD ---")
+    start = time.perf_counter()
+    stats = {'files': 0, 'rows': 0, 'errors': [], 'latencies': [], 'downloaded': 0, 'sensors': []}
+    conn = ingest.connect_to_database()
+    if conn is None:
+        print("❌ Sin conexión a la BD. Abortando pipeline.")
+        return None
+    if not migraciones.migrar(conn): # Firma de processed_files, clave única y agregados
+        print("⚠️ El esquema no está al día; se continúa con el existente.")
+
+    attachments = queue.Queue(maxsize=max(1, queue_size))
+    consumer = threading.Thread(target=_consume, args=(attachments, conn, batch_size, archive, stats), daemon=True)
+    consumer.start()
+    try:
+        # Productor: la descarga entrega cada adjunto a la cola (put bloquea si la cola está llena)
+        download_stats = download_attachment.main(
+            workers=workers, incremental=incremental, archive=archive,
+            on_attachment=lambda file_name, content: attachments.put((file_name, content, time.perf_counter()))
+        )
+        stats['downloaded'] = (download_stats or {}).get('files', 0)
+    finally:
+        attachments.put(_END)
+        consumer.join()
+        conn.close()
+
+    latencies = stats.pop('latencies')
+    stats['seconds'] = round(time.perf_counter() - start, 2)
+    stats['latency_avg_s'] = round(sum(latencies) / len(latencies), 3) if latencies else None
+    stats['latency_max_s'] = round(max(latencies), 3) if latencies else None
+    print(f"\n--- Pipeline Finalizado: {stats['files']} archivos, {stats['rows']} filas, "
+          f"{len(stats['errors'])} con error, {stats['seconds']}s ---")
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Descarga reportes de Gmail y los carga a la BD sin pasar por el directorio.")
+    parser.add_argument("--workers", type=int, default=download_attachment.DOWNLOAD_WORKERS, help="Hilos de descarga")
+    parser.add_argument("--no-archive", action="store_true", help="No guardar copia de los CSV en disco")
+    parser.add_argument("--full-sync", action="store_true", help="Ignorar el historyId guardado y hacer búsqueda completa")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help=f"Adjuntos en espera (default: {QUEUE_SIZE})")
+    parser.add_argument("--batch-size", type=int, default=ingest.BATCH_SIZE, help="Filas por INSERT multi-fila")
+    args = parser.parse_args()
+    run_pipeline(args.workers, not args.no_archive, not args.full_sync, args.queue_size, args.batch_size)
@@ -0,0 +1,121 @@
+# Registro de sensores: nombre <-> ID y patrón de nombre de archivo de sus reportes.
+# Se carga una vez desde la tabla 'sensors' y se guarda en caché; lo usan la carga de CSV y la interfaz.
+
+import re
+import threading
+import time
+
+# Sensores conocidos. La tabla 'sensors' manda: si tiene columnas 'name' / 'file_pattern'
+# se usan esas; si no, se completan con estos valores.
+DEFAULT_SENSORS = [
+    {"id": 1, "name": "sw01", "file_pattern": r"report-pv-sw01"},
+    {"id": 2, "name": "swm-02", "file_pattern": r"report-d-swm-02"},
+    {"id": 3, "name": "swm-03", "file_pattern": r"report-d-swm-03"},
+    {"id": 4, "name": "swm-04", "file_pattern": r"report-d-swm-04"},
+    {"id": 5, "name": "swm-05", "file_pattern": r"report-d-swm-05"},
+]
+MAX_AGE = 300 # Segundos antes de que get_registry(max_age=...) vuelva a leer la tabla
+
+class SensorRegistry:
+    """Caché de sensores con búsquedas O(1) y un único regex compilado para nombres de archivo."""
+
+    def __init__(self, sensors=None, valid_ids=None):
+        self._by_id = {}
+        self._by_name = {}
+        self._valid_ids = set()
+        self._matcher = None
+        self.loaded_at = 0.0
+        self._build(sensors if sensors is not None else DEFAULT_SENSORS, valid_ids)
+
+    def _build(self, sensors, valid_ids=None):
+        """Reconstruye los índices y el regex combinado a partir de una lista de dicts."""
+        by_id = {}
+        for sensor in sensors:
+            by_id[int(sensor["id"])] = {
+                "id": int(sensor["id"]),
+                "name": sensor.get("name") or str(sensor["id"]),
+                "file_pattern": sensor.get("file_pattern"),
+            }
+        # Un solo regex con un grupo nombrado por sensor: re.match + lastgroup dice qué sensor es
+        alternatives = [f"(?P<s{sensor_id}>{s['file_pattern']})" for sensor_id, s in sorted(by_id.items()) if s["file_pattern"]]
+        self._matcher = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+        self._by_id = by_id
+        self._by_name = {s["name"].lower(): sensor_id for sensor_id, s in by_id.items()}
+        self._valid_ids = set(by_id) if valid_ids is None else set(valid_ids)
+        self.loaded_at = time.monotonic()
+
+    def load(self, connection):
+        """Lee la tabla 'sensors' y reconstruye la caché. Si falla, conserva lo que había."""
+        if connection is None: return self
+        import mysql.connector # Con una conexión ya está cargado; el arranque de la interfaz no lo paga
+        cursor = None
+        try:
+            cursor = connection.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM sensors")
+            db_rows = cursor.fetchall()
+        except mysql.connector.Error as err:
+            print(f"❌ Error cargando sensores: {err}")
+            return self
+        finally:
+            if cursor: cursor.close()
+        defaults = {s["id"]: s for s in DEFAULT_SENSORS}
+        sensors = {s["id"]: dict(s) for s in DEFAULT_SENSORS}
+        for row in db_rows:
+            sensor_id = int(row["id"])
+            base = defaults.get(sensor_id, {})
+            sensors[sensor_id] = {
+                "id": sensor_id,
+                "name": row.get("name") or base.get("name"),
+                "file_pattern": row.get("file_pattern") or base.get("file_pattern"),
+            }
+        self._build(list(sensors.values()), valid_ids={int(row["id"]) for row in db_rows})
+        return self
+
+    def match(self, file_name):
+        """Devuelve el ID de sensor para un nombre de archivo de reporte, o None si no coincide."""
+        if self._matcher is None: return None
+        m = self._matcher.match(file_name)
+        return int(m.lastgroup[1:]) if m else None
+
+    def id_for_name(self, name):
+        """ID del sensor por su nombre (sin distinguir mayúsculas), o None."""
+        return self._by_name.get(str(name).lower())
+
+    def name_for_id(self, sensor_id):
+        """Nombre del sensor por su ID, o None."""
+        sensor = self._by_id.get(sensor_id)
+        return sensor["name"] if sensor else None
+
+    def is_valid(self, sensor_id):
+        """True si el sensor existe en la tabla 'sensors' (o en los defaults si no se ha cargado la BD)."""
+        return sensor_id in self._valid_ids
+
+    @property
+    def ids(self):
+        return set(self._valid_ids)
+
+    def names(self):
+        """Nombres de los sensores válidos, ordenados por ID (para el combobox de la interfaz)."""
+        return [self._by_id[sensor_id]["name"] for sensor_id in sorted(self._valid_ids) if sensor_id in self._by_id]
+
+    def is_stale(self, max_age=MAX_AGE):
+        """True si nunca se cargó desde la BD o la carga tiene más de 'max_age' segundos."""
+        return self.loaded_at == 0.0 or time.monotonic() - self.loaded_at > max_age
+
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry(connection=None, refresh=False, max_age=None):
+    """
+    Devuelve el registro compartido. Se recarga desde la BD si se pide 'refresh',
+    si nunca se cargó o si tiene más de 'max_age' segundos (requiere 'connection').
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SensorRegistry()
+            _registry.loaded_at = 0.0 # Solo defaults: cuenta como no cargado
+        stale = _registry.is_stale(max_age) if max_age is not None else _registry.loaded_at == 0.0
+        if connection is not None and (refresh or stale):
+            _registry.load(connection)
+        return _registry
@@ -0,0 +1,247 @@
+# Tabla virtual sobre un ttk.Treeview: solo se cargan en Tk las filas visibles.
+# Las filas se piden a la BD por páginas (keyset sobre (sensor_id, time, id)) al desplazarse,
+# y la barra de desplazamiento refleja el total real de filas del sensor.
+# Con 'ejecutar' (GestorTareas.ejecutar) las páginas se piden en segundo plano y el arrastre
+# de la barra espera ESPERA_MS sin movimiento antes de consultar.
+
+# consultas (y con él mysql.connector) se importa al pedir filas, no al crear la tabla
+
+# --- Configuración ---
+MARGEN_PREFETCH = 100 # Filas extra que se piden antes/después de la ventana visible
+MAX_BUFFER = 2000 # Filas que se conservan en memoria como máximo
+ALTO_FILA_DEFAULT = 30 # Debe coincidir con rowheight del estilo Treeview
+ESPERA_MS = 150 # Pausa tras el último movimiento de la barra antes de pedir la página
+
+class TablaVirtual:
+    """
+    Muestra en 'tree' una ventana de filas de un sensor, cargando páginas bajo demanda.
+
+    obtener_conexion(): devuelve una conexión (se cierra/devuelve al pool tras cada consulta).
+    formatear_fila(row): convierte un dict de la BD en la tupla de valores del Treeview.
+    ejecutar(nombre, funcion, al_terminar, al_error): si se da, las páginas se piden en segundo
+    plano (GestorTareas.ejecutar); sin él se consultan en el hilo de Tk.
+    """
+
+    def __init__(self, tree, scrollbar, obtener_conexion, formatear_fila, alto_fila=ALTO_FILA_DEFAULT,
+                 ejecutar=None, al_error=None):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.obtener_conexion = obtener_conexion
+        self.formatear_fila = formatear_fila
+        self.alto_fila = alto_fila
+        self.ejecutar = ejecutar
+        self.al_error = al_error or (lambda mensaje: print(f"Error cargando filas: {mensaje}"))
+        self.version = 0 # Cambia con cada sensor/lista mostrada: descarta páginas pedidas para la anterior
+        self._espera = None
+        self.sensor_id = None
+        self.rango = (None, None) # (inicio, fin) de 'time' del sensor mostrado
+        self.total = 0
+        self.posicion = 0 # Índice de la primera fila visible
+        self.buffer = [] # Filas en memoria (dicts), consecutivas
+        self.inicio_buffer = 0 # Índice absoluto de buffer[0]
+
+        self.tree.configure(yscrollcommand="") # La barra la maneja esta clase, no el Treeview
+        self.scrollbar.config(command=self._on_scrollbar)
+        self.tree.bind("<Configure>", lambda e: self._render())
+        self.tree.bind("<MouseWheel>", self._on_rueda) # Windows / macOS
+        self.tree.bind("<Button-4>", lambda e: self.desplazar(-3)) # Linux
+        self.tree.bind("<Button-5>", lambda e: self.desplazar(3))
+        self.tree.bind("<Prior>", lambda e: self.desplazar(-self.filas_visibles()))
+        self.tree.bind("<Next>", lambda e: self.desplazar(self.filas_visibles()))
+
+    # --- API pública ---
+    def cargar(self, sensor_id, inicio=None, fin=None):
+        """Empieza a mostrar un sensor (en [inicio, fin) si se indica) desde el principio. Devuelve el total de filas."""
+        conn = self.obtener_conexion()
+        try:
+            total, filas = self.consultar_inicio(sensor_id, conn, self.tamano_pagina_inicial(), inicio, fin)
+        finally:
+            conn.close()
+        self.mostrar(sensor_id, total, filas, inicio=inicio, fin=fin)
+        return total
+
+    def tamano_pagina_inicial(self):
+        """Filas a pedir en la primera página (ventana visible + margen). Llamar desde el hilo de Tk."""
+        return self.filas_visibles() + MARGEN_PREFETCH
+
+    @staticmethod
+    def consultar_inicio(sensor_id, conn, limite, inicio=None, fin=None):
+        """Parte de 'cargar' que solo usa la BD (se puede correr en un hilo): (total, primeras filas)."""
+        from consultas import contar_filas_sensor, consultar_pagina
+        total = contar_filas_sensor(sensor_id, conn, inicio, fin)
+        filas = consultar_pagina(sensor_id, conn, limite, inicio=inicio, fin=fin) if total else []
+        return total, filas
+
+    def mostrar(self, sensor_id, total, filas, formatear_fila=None, inicio=None, fin=None):
+        """Parte de 'cargar' que toca Tk: muestra el resultado de consultar_inicio."""
+        if formatear_fila is not None: self.formatear_fila = formatear_fila
+        self.version += 1
+        self.sensor_id = sensor_id
+        self.rango = (inicio, fin)
+        self.total = total
+        self.buffer = list(filas); self.inicio_buffer = 0; self.posicion = 0
+        self._ir_a(0)
+
+    def mostrar_lista(self, filas, formatear_fila=None):
+        """Muestra una lista ya completa en memoria (p. ej. agregados), sin paginar contra la BD."""
+        if formatear_fila is not None: self.formatear_fila = formatear_fila
+        self.version += 1
+        self.sensor_id = None # Sin sensor no se piden páginas: el buffer tiene todas las filas
+        self.total = len(filas)
+        self.buffer = list(filas); self.inicio_buffer = 0; self.posicion = 0
+        self._ir_a(0)
+
+    def limpiar(self):
+        """Vacía la tabla."""
+        self.version += 1
+        self.sensor_id = None; self.total = 0; self.buffer = []; self.posicion = 0
+        self._render()
+
+    def filas_visibles(self):
+        """Filas que caben en el alto actual del Treeview."""
+        alto = self.tree.winfo_height()
+        return max(1, (alto // self.alto_fila) - 1 if alto > 1 else 20) # -1 por la cabecera
+
+    def desplazar(self, filas):
+        """Desplaza la ventana visible 'filas' posiciones (negativo = hacia arriba)."""
+        self._ir_a(self.posicion + filas)
+        return "break"
+
+    # --- Eventos ---
+    def _on_rueda(self, event):
+        return self.desplazar(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, accion, cantidad=None, unidad=None):
+        if accion == "moveto":
+            self._ir_a(int(float(cantidad) * self.total), espera=ESPERA_MS) # Arrastre: consultar al soltar/pausar
+        elif accion == "scroll":
+            paso = self.filas_visibles() if unidad == "pages" else 1
+            self._ir_a(self.posicion + int(cantidad) * paso)
+
+    # --- Carga de páginas ---
+    def _ir_a(self, posicion, espera=0):
+        visibles = self.filas_visibles()
+        self.posicion = max(0, min(posicion, max(0, self.total - visibles)))
+        if self.sensor_id is not None and self.total:
+            if self.ejecutar is None:
+                self._asegurar(self.posicion, visibles)
+            elif self._plan(self.posicion, visibles) is not None:
+                self._programar(espera)
+        self._render()
+
+    def _programar(self, espera):
+        """Pide la página de la posición actual tras 'espera' ms sin más movimiento."""
+        if self._espera is not None: self.tree.after_cancel(self._espera)
+        self._espera = self.tree.after(espera, self._pedir)
+
+    def _pedir(self):
+        """Trae en segundo plano lo que le falta al buffer para la posición actual."""
+        self._espera = None
+        if self.sensor_id is None or not self.total: return
+        plan = self._plan(self.posicion, self.filas_visibles())
+        if plan is None: return
+        def trabajo(tarea):
+            conn = self.obtener_conexion()
+            tarea.registrar_conexion(conn) # Cancelar interrumpe el OFFSET largo en el servidor
+            try:
+                return self._traer(plan, conn)
+            finally:
+                conn.close()
+        def terminado(resultado):
+            self._aplicar(plan, resultado)
+            self._render()
+            self._pedir() # La posición pudo cambiar mientras se consultaba
+        if self.ejecutar("Página", trabajo, terminado, self.al_error) is None:
+            self._programar(ESPERA_MS) # Ya hay una página en curso: se reintenta al rato
+
+    def _asegurar(self, posicion, visibles):
+        """Garantiza (en el hilo actual) que el buffer cubra la ventana visible más el margen de prefetch."""
+        plan = self._plan(posicion, visibles)
+        if plan is None: return # Ya está todo en memoria
+        conn = self.obtener_conexion()
+        try:
+            self._aplicar(plan, self._traer(plan, conn))
+        finally:
+            conn.close()
+
+    def _plan(self, posicion, visibles):
+        """Qué falta pedir para cubrir la ventana (None si el buffer ya la cubre). Solo lee el estado."""
+        necesario_ini = max(0, posicion - MARGEN_PREFETCH)
+        necesario_fin = min(self.total, posicion + visibles + MARGEN_PREFETCH)
+        fin_buffer = self.inicio_buffer + len(self.buffer)
+        if self.buffer and necesario_ini >= self.inicio_buffer and necesario_fin <= fin_buffer:
+            return None
+        plan = {'version': self.version, 'sensor_id': self.sensor_id, 'rango': self.rango,
+                'posicion': posicion, 'visibles': visibles, 'salto': None, 'adelante': None, 'atras': None}
+        lejos = (not self.buffer or necesario_fin < self.inicio_buffer - MARGEN_PREFETCH
+                 or necesario_ini > fin_buffer + MARGEN_PREFETCH)
+        if lejos:
+            # Salto largo (arrastre de la barra): una búsqueda por posición y luego keyset
+            plan['salto'] = (necesario_ini, necesario_fin)
+            return plan
+        if necesario_fin > fin_buffer:
+            ultima = self.buffer[-1]
+            plan['adelante'] = ((ultima['time'], ultima['id']), necesario_fin - fin_buffer + MARGEN_PREFETCH)
+        if necesario_ini < self.inicio_buffer:
+            primera = self.buffer[0]
+            plan['atras'] = ((primera['time'], primera['id']), self.inicio_buffer - necesario_ini + MARGEN_PREFETCH)
+        return plan
+
+    @staticmethod
+    def _traer(plan, conn):
+        """Parte de la carga que solo usa la BD (se puede correr en un hilo)."""
+        from consultas import clave_en_posicion, consultar_pagina
+        sensor_id, (inicio, fin) = plan['sensor_id'], plan['rango']
+        resultado = {}
+        if plan['salto']:
+            desde, hasta = plan['salto']
+            clave = clave_en_posicion(sensor_id, desde, conn, inicio, fin)
+            resultado['salto'] = consultar_pagina(sensor_id, conn, hasta - desde, desde=clave, inclusivo=True,
+                                                  inicio=inicio, fin=fin) if clave else []
+            return resultado
+        if plan['adelante']:
+            clave, limite = plan['adelante']
+            resultado['adelante'] = consultar_pagina(sensor_id, conn, limite, desde=clave, inicio=inicio, fin=fin)
+        if plan['atras']:
+            clave, limite = plan['atras']
+            resultado['atras'] = consultar_pagina(sensor_id, conn, limite, desde=clave, hacia_atras=True,
+                                                  inicio=inicio, fin=fin)
+        return resultado
+
+    def _aplicar(self, plan, resultado):
+        """Incorpora al buffer lo traído por _traer (en el hilo de Tk)."""
+        if plan['version'] != self.version: return # Se cambió de sensor o de lista mientras se consultaba
+        if plan['salto']:
+            self.buffer = resultado['salto']
+            self.inicio_buffer = plan['salto'][0]
+            return
+        if 'adelante' in resultado:
+            self.buffer.extend(resultado['adelante'])
+        if 'atras' in resultado:
+            self.buffer[:0] = resultado['atras']
+            self.inicio_buffer -= len(resultado['atras'])
+        self._recortar(self.posicion, plan['visibles'])
+
+    def _recortar(self, posicion, visibles):
+        """Descarta filas lejanas a la ventana visible si el buffer crece demasiado."""
+        if len(self.buffer) <= MAX_BUFFER: return
+        centro = posicion + visibles // 2 - self.inicio_buffer
+        desde = max(0, min(len(self.buffer) - MAX_BUFFER, centro - MAX_BUFFER // 2))
+        self.buffer = self.buffer[desde:desde + MAX_BUFFER]
+        self.inicio_buffer += desde
+
+    def _render(self):
+        """Dibuja en el Treeview solo las filas visibles y actualiza la barra."""
+        self.tree.delete(*self.tree.get_children())
+        visibles = self.filas_visibles()
+        if self.total and self.buffer:
+            for indice in range(self.posicion, min(self.total, self.posicion + visibles)):
+                # Colores alternos por índice absoluto para que no "salten" al desplazarse
+                tag = 'evenrow' if indice % 2 == 0 else 'oddrow'
+                k = indice - self.inicio_buffer
+                valores = self.formatear_fila(self.buffer[k]) if 0 <= k < len(self.buffer) else ("…",) # Página en camino
+                self.tree.insert("", "end", values=valores, tags=(tag,))
+        if self.total:
+            self.scrollbar.set(self.posicion / self.total, min(1.0, (self.posicion + visibles) / self.total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
@@ -0,0 +1,139 @@
+# Ejecutor de tareas en segundo plano para la interfaz Tk.
+# Generaliza el patrón hilo + cola de ejecutar_download_attachment: el trabajo corre en un hilo,
+# el progreso llega por una cola y se aplica en el hilo de Tk con ventana.after().
+
+import queue
+import threading
+import traceback
+
+# --- Configuración ---
+INTERVALO_MS = 100 # Cada cuánto se revisa la cola de progreso
+
+class TareaCancelada(Exception):
+    """Se lanza dentro de una tarea cuando el usuario pidió cancelarla."""
+    pass
+
+class Tarea:
+    """Contexto que recibe la función de trabajo: progreso, cancelación y conexiones a interrumpir."""
+
+    def __init__(self, nombre, silenciosa=False):
+        self.nombre = nombre
+        self.silenciosa = silenciosa # Sin mensajes en la barra de estado ni botón Cancelar
+        self.cancelada = threading.Event()
+        self.cola = queue.Queue()
+        self._conexiones = []
+        self._lock = threading.Lock()
+
+    def progreso(self, mensaje, fraccion=None):
+        """Envía un mensaje de estado (y opcionalmente avance 0..1) a la barra de estado."""
+        self.cola.put(('progreso', mensaje, fraccion))
+
+    def verificar(self):
+        """Lanza TareaCancelada si se pidió cancelar. Llamar entre pasos o lotes."""
+        if self.cancelada.is_set():
+            raise TareaCancelada(self.nombre)
+
+    def registrar_conexion(self, conn):
+        """Asocia una conexión MySQL: al cancelar se interrumpe su consulta en curso (KILL QUERY)."""
+        with self._lock:
+            self._conexiones.append(conn)
+
+    def cancelar(self):
+        self.cancelada.set()
+        with self._lock:
+            conexiones = list(self._conexiones)
+        for conn in conexiones:
+            _matar_consulta(conn)
+
+def _matar_consulta(conn):
+    """Interrumpe la consulta que esté ejecutando 'conn' usando otra conexión del pool."""
+    try:
+        connection_id = conn.connection_id
+    except Exception:
+        return
+    if not connection_id: return
+    import mysql.connector, base_datos # Ya cargados si hay una conexión abierta; no pesan en el arranque
+    otra = None
+    try:
+        otra = base_datos.get_connection()
+        cursor = otra.cursor()
+        cursor.execute(f"KILL QUERY {int(connection_id)}")
+        cursor.close()
+    except mysql.connector.Error as err:
+        print(f"Advertencia: no se pudo interrumpir la consulta {connection_id}: {err}")
+    finally:
+        if otra: otra.close()
+
+class GestorTareas:
+    """
+    Lanza funciones en hilos y entrega sus resultados en el hilo de Tk.
+
+    funcion(tarea) -> resultado; al_terminar(resultado) y al_error(mensaje) se llaman en el hilo de Tk.
+    Una tarea con el mismo nombre no se puede lanzar dos veces a la vez (evita clics duplicados).
+    Las tareas silenciosas (p. ej. páginas de la tabla al desplazarse) no tocan la barra de estado
+    ni cuentan para al_cambiar.
+    """
+
+    def __init__(self, ventana, estado_var=None, al_cambiar=None):
+        self.ventana = ventana
+        self.estado_var = estado_var
+        self.al_cambiar = al_cambiar # Callback(en_curso: bool) para habilitar/deshabilitar controles
+        self.tareas = {}
+
+    def ejecutar(self, nombre, funcion, al_terminar=None, al_error=None, silenciosa=False):
+        """Lanza la tarea; devuelve None si ya había una con ese nombre en curso."""
+        if nombre in self.tareas:
+            if not silenciosa: self._estado(f"'{nombre}' ya está en curso...")
+            return None
+        tarea = Tarea(nombre, silenciosa)
+        self.tareas[nombre] = tarea
+
+        def trabajo():
+            try:
+                tarea.cola.put(('fin', funcion(tarea), None))
+            except TareaCancelada:
+                tarea.cola.put(('cancelada', None, None))
+            except Exception as e:
+                if tarea.cancelada.is_set(): # La consulta interrumpida suele llegar como error de MySQL
+                    tarea.cola.put(('cancelada', None, None))
+                else:
+                    tarea.cola.put(('error', f"{e}\n{traceback.format_exc()}", None))
+
+        threading.Thread(target=trabajo, name=f"tarea-{nombre}", daemon=True).start()
+        if not silenciosa:
+            self._estado(f"{nombre}: iniciando...")
+            if self.al_cambiar: self.al_cambiar(True)
+        self.ventana.after(INTERVALO_MS, lambda: self._revisar(tarea, al_terminar, al_error))
+        return tarea
+
+    def cancelar(self, nombre=None):
+        """Cancela la tarea indicada o todas las que estén en curso."""
+        for tarea_nombre, tarea in list(self.tareas.items()):
+            if nombre is None or tarea_nombre == nombre:
+                if not tarea.silenciosa: self._estado(f"{tarea_nombre}: cancelando...")
+                threading.Thread(target=tarea.cancelar, daemon=True).start() # KILL QUERY no bloquea la ventana
+
+    def _revisar(self, tarea, al_terminar, al_error):
+        while True:
+            try:
+                tipo, valor, fraccion = tarea.cola.get_nowait()
+            except queue.Empty:
+                self.ventana.after(INTERVALO_MS, lambda: self._revisar(tarea, al_terminar, al_error))
+                return
+            if tipo == 'progreso':
+                if not tarea.silenciosa:
+                    self._estado(f"{tarea.nombre}: {valor}" + (f" ({fraccion:.0%})" if fraccion is not None else ""))
+                continue
+            self.tareas.pop(tarea.nombre, None)
+            if not tarea.silenciosa:
+                if self.al_cambiar: self.al_cambiar(any(not t.silenciosa for t in self.tareas.values()))
+                self._estado(f"{tarea.nombre}: " + {'fin': "completado.", 'cancelada': "cancelado."}.get(tipo, "error."))
+            if tipo == 'fin':
+                if al_terminar: al_terminar(valor)
+            elif tipo == 'error':
+                if al_error: al_error(valor)
+            return
+
+    def _estado(self, texto):
+        if self.estado_var is not None:
+            self.estado_var.set(texto)